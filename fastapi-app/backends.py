@@ -0,0 +1,247 @@
+import fcntl
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+# Inference backends a model can be loaded with; all but "pytorch" run a model
+# exported next to the PyTorch weights
+BACKENDS = ("pytorch", "onnx", "onnx-int8", "openvino", "openvino-int8")
+# Frames sampled from a video to calibrate INT8 quantization
+CALIBRATION_FRAMES = 64
+
+
+def exported_path(model_path: str, backend: str) -> Path:
+    """
+    Where the model exported for backend is stored, next to the weights.
+    """
+    weights = Path(model_path)
+    if backend == "pytorch":
+        return weights
+    if backend == "onnx":
+        return weights.with_suffix(".onnx")
+    if backend == "onnx-int8":
+        return weights.with_name(f"{weights.stem}_int8.onnx")
+    if backend == "openvino":
+        return weights.with_name(f"{weights.stem}_openvino_model")
+    if backend == "openvino-int8":
+        return weights.with_name(f"{weights.stem}_int8_openvino_model")
+    raise ValueError(f"Unknown inference backend: {backend}")
+
+
+def sample_frames(
+    video_path: str, n_frames: int = CALIBRATION_FRAMES
+) -> List[np.ndarray]:
+    """
+    Read n_frames evenly spaced frames of a video.
+    """
+    cap = cv2.VideoCapture(video_path)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frames = []
+    for index in np.linspace(0, max(total - 1, 0), n_frames).astype(int):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+        ret, frame = cap.read()
+        if ret:
+            frames.append(frame)
+    cap.release()
+    if not frames:
+        raise RuntimeError(f"Could not read calibration frames from {video_path}")
+    return frames
+
+
+def load_model(
+    model_path: str,
+    backend: str,
+    imgsz: Tuple[int, int],
+    calibration_video: Optional[str] = None,
+) -> YOLO:
+    """
+    Load the model for backend, exporting it from the PyTorch weights first if
+    it has not been exported yet.
+
+    Exported models are returned as YOLO objects too, so they are called and
+    return results exactly like the PyTorch model. Exporting an INT8 model
+    needs a calibration_video to sample frames from. Processes loading the same
+    model at once, such as the server and its worker processes, export it only
+    once and never load it half written.
+    """
+    path = exported_path(model_path, backend)
+    if backend == "pytorch":
+        return YOLO(model_path)
+
+    if not path.exists():
+        with _export_lock(path):
+            # Another process may have exported it while this one waited
+            if not path.exists():
+                calibration_frames = None
+                if backend.endswith("-int8"):
+                    if calibration_video is None:
+                        raise RuntimeError(
+                            f"{path} has not been exported; set "
+                            "FLYBY_CALIBRATION_VIDEO to calibrate INT8 quantization"
+                        )
+                    calibration_frames = sample_frames(calibration_video)
+                export_model(model_path, backend, imgsz, calibration_frames)
+    return YOLO(str(path), task="detect")
+
+
+def export_model(
+    model_path: str,
+    backend: str,
+    imgsz: Tuple[int, int],
+    calibration_frames: Optional[List[np.ndarray]] = None,
+) -> Path:
+    """
+    Export the PyTorch weights for backend, returning the exported path.
+
+    Models are exported with dynamic input shapes, so they accept batches of
+    frames and tiles of any size. The export is made from a copy of the weights
+    in a temporary directory and only moved into place once complete.
+    """
+    path = exported_path(model_path, backend)
+    with tempfile.TemporaryDirectory(
+        dir=path.parent, prefix=".flyby-export-"
+    ) as export_dir:
+        weights = os.path.join(export_dir, os.path.basename(model_path))
+        shutil.copyfile(model_path, weights)
+        exported = _export(weights, backend, imgsz, calibration_frames, model_path)
+        os.replace(exported, path)
+    return path
+
+
+def _export(
+    weights: str,
+    backend: str,
+    imgsz: Tuple[int, int],
+    calibration_frames: Optional[List[np.ndarray]],
+    model_path: str,
+) -> Path:
+    """
+    Export weights for backend next to them, reusing the FP32 ONNX model
+    already exported from model_path to quantize to INT8 if there is one.
+    """
+    path = exported_path(weights, backend)
+    if backend == "onnx":
+        YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=True)
+    elif backend == "openvino":
+        YOLO(weights).export(format="openvino", imgsz=imgsz, dynamic=True)
+    elif backend == "onnx-int8":
+        source = exported_path(model_path, "onnx")
+        if not source.exists():
+            source = _export(weights, "onnx", imgsz, None, model_path)
+        _quantize_onnx(source, path, calibration_frames, imgsz)
+    elif backend == "openvino-int8":
+        model = YOLO(weights)
+        with tempfile.TemporaryDirectory(prefix="flyby-calibration-") as data_dir:
+            data = _write_calibration_dataset(data_dir, calibration_frames, model.names)
+            model.export(
+                format="openvino", imgsz=imgsz, dynamic=True, int8=True, data=data
+            )
+    else:
+        raise ValueError(f"Cannot export the {backend} backend")
+    return path
+
+
+@contextmanager
+def _export_lock(path: Path) -> Iterator[None]:
+    """
+    Hold an exclusive lock on exporting path, shared by every process.
+    """
+    with open(f"{path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def letterbox(frame: np.ndarray, imgsz: Tuple[int, int]) -> np.ndarray:
+    """
+    Resize a BGR frame to fit imgsz keeping its aspect ratio, pad it to imgsz
+    and return it as a normalised RGB CHW array, as YOLOv8 preprocesses it.
+    """
+    height, width = imgsz
+    scale = min(height / frame.shape[0], width / frame.shape[1])
+    resized_h = round(frame.shape[0] * scale)
+    resized_w = round(frame.shape[1] * scale)
+    resized = cv2.resize(frame, (resized_w, resized_h), interpolation=cv2.INTER_LINEAR)
+
+    padded = np.full((height, width, 3), 114, dtype=np.uint8)
+    top = (height - resized_h) // 2
+    left = (width - resized_w) // 2
+    padded[top : top + resized_h, left : left + resized_w] = resized
+    return padded[:, :, ::-1].transpose(2, 0, 1).astype(np.float32) / 255
+
+
+def _quantize_onnx(
+    source: Path,
+    destination: Path,
+    calibration_frames: List[np.ndarray],
+    imgsz: Tuple[int, int],
+) -> None:
+    """
+    Statically quantize an ONNX model to INT8, calibrating activation ranges on
+    the given frames.
+    """
+    import onnx
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        QuantFormat,
+        QuantType,
+        quantize_static,
+    )
+
+    model = onnx.load(str(source))
+    input_name = model.graph.input[0].name
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self._frames = iter(calibration_frames)
+
+        def get_next(self):
+            frame = next(self._frames, None)
+            if frame is None:
+                return None
+            return {input_name: letterbox(frame, imgsz)[None]}
+
+    quantize_static(
+        str(source),
+        str(destination),
+        FrameReader(),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        weight_type=QuantType.QInt8,
+        activation_type=QuantType.QUInt8,
+    )
+
+    # Keep the class names and other metadata ultralytics reads from the model
+    quantized = onnx.load(str(destination))
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(model.metadata_props)
+    onnx.save(quantized, str(destination))
+
+
+def _write_calibration_dataset(
+    data_dir: str, calibration_frames: List[np.ndarray], names: dict
+) -> str:
+    """
+    Save calibration frames as an unlabelled YOLO dataset, which is how
+    ultralytics takes calibration data for INT8 export. Returns its YAML path.
+    """
+    images_dir = os.path.join(data_dir, "images")
+    os.makedirs(images_dir)
+    for i, frame in enumerate(calibration_frames):
+        cv2.imwrite(os.path.join(images_dir, f"{i:05d}.jpg"), frame)
+
+    yaml_path = os.path.join(data_dir, "data.yaml")
+    with open(yaml_path, "w") as yaml_file:
+        yaml_file.write(f"path: {data_dir}\ntrain: images\nval: images\nnames:\n")
+        for class_id, name in names.items():
+            yaml_file.write(f"  {class_id}: {name!r}\n")
+    return yaml_path
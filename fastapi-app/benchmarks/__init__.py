@@ -0,0 +1 @@
+"""Benchmarks for the FlyBy processing pipeline. Run them from fastapi-app/."""
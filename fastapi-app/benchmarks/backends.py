@@ -0,0 +1,121 @@
+"""
+Check the detections and speed of exported inference backends against PyTorch.
+
+    python -m benchmarks.backends VIDEO [--backends onnx onnx-int8 openvino]
+
+Every backend's detections are matched one-to-one, per class, with the PyTorch
+model's on the same frames. INT8 backends are calibrated on frames sampled
+from VIDEO if they have not been exported yet.
+"""
+
+import argparse
+import json
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+import detector
+from backends import BACKENDS
+from benchmarks.tiling import read_frames
+from sort import iou_batch, linear_assignment
+
+
+def match_detections(
+    reference: Tuple[np.ndarray, np.ndarray],
+    candidate: Tuple[np.ndarray, np.ndarray],
+    iou: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Match the boxes of one frame with the same class, returning the IOU and
+    confidence difference of every pair overlapping by at least iou.
+    """
+    (ref_boxes, ref_classes), (cand_boxes, cand_classes) = reference, candidate
+    if len(ref_boxes) == 0 or len(cand_boxes) == 0:
+        return np.empty(0), np.empty(0)
+
+    overlap = iou_batch(ref_boxes[:, :4], cand_boxes[:, :4])
+    overlap[ref_classes[:, None] != cand_classes[None, :]] = 0
+    pairs = linear_assignment(-overlap).reshape(-1, 2).astype(int)
+    pairs = pairs[overlap[pairs[:, 0], pairs[:, 1]] >= iou]
+    confidence_delta = cand_boxes[pairs[:, 1], 4] - ref_boxes[pairs[:, 0], 4]
+    return overlap[pairs[:, 0], pairs[:, 1]], confidence_delta
+
+
+def detect(
+    frames: List[np.ndarray], backend: str, batch_size: int
+) -> Tuple[list, float]:
+    """
+    Detect objects in every frame, returning the detections and seconds taken.
+    """
+    tracker = detector.TACOTracker(detector.MODEL_PATH, backend=backend)
+    tracker._detect(frames[:1])  # warm up
+
+    detections = []
+    start_time = time.perf_counter()
+    for start in range(0, len(frames), batch_size):
+        detections.extend(tracker._detect(frames[start : start + batch_size]))
+    return detections, time.perf_counter() - start_time
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("video")
+    parser.add_argument(
+        "--backends", nargs="+", default=list(BACKENDS[1:]), choices=BACKENDS[1:]
+    )
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=detector.BATCH_SIZE)
+    parser.add_argument("--match-iou", type=float, default=0.5)
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    if detector.CALIBRATION_VIDEO is None:
+        detector.CALIBRATION_VIDEO = args.video
+    frames = read_frames(args.video, args.frames)
+
+    reference, reference_seconds = detect(frames, "pytorch", args.batch_size)
+    reference_count = sum(len(boxes) for boxes, _ in reference)
+    results = [
+        {
+            "backend": "pytorch",
+            "fps": len(frames) / reference_seconds,
+            "detections": reference_count,
+        }
+    ]
+
+    for backend in args.backends:
+        detections, seconds = detect(frames, backend, args.batch_size)
+        matches = [
+            match_detections(ref, cand, args.match_iou)
+            for ref, cand in zip(reference, detections)
+        ]
+        ious = np.concatenate([iou for iou, _ in matches])
+        confidence_deltas = np.concatenate([delta for _, delta in matches])
+        count = sum(len(boxes) for boxes, _ in detections)
+        results.append(
+            {
+                "backend": backend,
+                "fps": len(frames) / seconds,
+                "speedup": reference_seconds / seconds,
+                "detections": count,
+                # Share of PyTorch detections the backend also found
+                "recall": len(ious) / reference_count if reference_count else None,
+                # Share of the backend's detections PyTorch also found
+                "precision": len(ious) / count if count else None,
+                "mean_iou": float(ious.mean()) if len(ious) else None,
+                "max_confidence_delta": (
+                    float(np.abs(confidence_deltas).max()) if len(ious) else None
+                ),
+            }
+        )
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Time the SORT trackers on MOT-format detection files, without running a model.
+
+    python -m benchmarks.sort_micro [DET_FILE ...] [--objects 10 100 1000]
+
+Without detection files, synthetic ones are generated for every --objects
+density. Each file is tracked by Sort and VectorizedSort with dense and gated
+association.
+"""
+
+import argparse
+import json
+import time
+from typing import List
+
+import numpy as np
+
+import sort
+from benchmarks.stats import percentiles
+from benchmarks.synthetic import simulate_tracks, synthetic_detections
+
+TRACKERS = {
+    "sort": (sort.Sort, False),
+    "sort-gated": (sort.Sort, True),
+    "vectorized": (sort.VectorizedSort, False),
+    "vectorized-gated": (sort.VectorizedSort, True),
+}
+
+
+def load_detections(path: str) -> List[np.ndarray]:
+    """
+    Read a MOT detection file into [x1,y1,x2,y2,score] arrays, one per frame.
+    """
+    rows = np.loadtxt(path, delimiter=",", ndmin=2)
+    return split_frames(rows)
+
+
+def split_frames(rows: np.ndarray) -> List[np.ndarray]:
+    """
+    Split MOT rows [frame,id,x,y,w,h,score,...] sorted by frame into SORT input.
+    """
+    frames = int(rows[:, 0].max()) if len(rows) else 0
+    bounds = np.searchsorted(rows[:, 0], np.arange(1, frames + 2))
+    detections = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        dets = rows[start:end, 2:7].copy()
+        dets[:, 2:4] += dets[:, 0:2]  # convert [x1,y1,w,h] to [x1,y1,x2,y2]
+        detections.append(dets)
+    return detections
+
+
+def benchmark(detections: List[np.ndarray], name: str, repeats: int) -> dict:
+    """
+    Track every frame repeats times, keeping the fastest run.
+    """
+    tracker_class, gated = TRACKERS[name]
+    best = None
+    for _ in range(repeats):
+        sort.KalmanBoxTracker.count = 0
+        tracker = tracker_class(gated=gated)
+        frame_seconds = []
+        for dets in detections:
+            start_time = time.perf_counter()
+            tracker.update(dets)
+            frame_seconds.append(time.perf_counter() - start_time)
+        if best is None or sum(frame_seconds) < sum(best):
+            best = frame_seconds
+
+    return {
+        "tracker": name,
+        "frames": len(detections),
+        "detections_per_frame": float(np.mean([len(d) for d in detections])),
+        "fps": len(best) / sum(best),
+        "frame_latency": percentiles(best),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("detections", nargs="*", help="MOT-format det.txt files")
+    parser.add_argument("--objects", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--width", type=int, default=3840)
+    parser.add_argument("--height", type=int, default=2160)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--trackers", nargs="+", default=list(TRACKERS), choices=list(TRACKERS)
+    )
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    sequences = {path: load_detections(path) for path in args.detections}
+    if not sequences:
+        for objects in args.objects:
+            ground_truth = simulate_tracks(
+                args.width, args.height, args.frames, objects
+            )
+            rows = synthetic_detections(ground_truth, args.width, args.height)
+            sequences[f"synthetic-{objects}"] = split_frames(rows)
+
+    results = [
+        {"sequence": sequence, **benchmark(detections, name, args.repeats)}
+        for sequence, detections in sequences.items()
+        for name in args.trackers
+    ]
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Timing and memory statistics shared by the benchmarks, kept free of the model
+stack so benchmarks that do not run the model need none of it installed.
+"""
+
+import resource
+import sys
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+
+def percentiles(seconds: List[float]) -> Dict[str, float]:
+    """
+    Total, mean, p50 and p99 in milliseconds of a list of timings.
+    """
+    if not seconds:
+        return {"total_ms": 0.0, "mean_ms": 0.0, "p50_ms": 0.0, "p99_ms": 0.0}
+    ms = np.array(seconds) * 1000
+    return {
+        "total_ms": float(ms.sum()),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident memory of this process so far.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def timed(function: Callable, timings: List[float]) -> Callable:
+    """
+    Wrap function so every call's duration is appended to timings.
+    """
+
+    def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings.append(time.perf_counter() - start_time)
+
+    return wrapper
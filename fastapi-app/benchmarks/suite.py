@@ -0,0 +1,242 @@
+"""
+Benchmark every stage of video processing on a synthetic or real clip.
+
+    python -m benchmarks.suite [--video clip.mp4] [--output results.json] [--api]
+
+Without --video a synthetic clip is generated first. Decode, inference, SORT,
+annotation, handing frames to the encoder and flushing the playlist at the end
+are timed separately on one serial pass, then detector.process_video is timed
+end to end. ffmpeg encodes and segments in a single process of its own, so the
+CPU time it spent is reported as a whole. With --api the clip is
+also uploaded through the FastAPI app and timed until its job finishes; like
+starting the server, importing the app clears its static directories.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+
+import cv2
+
+import detector
+from benchmarks.stats import peak_rss_mb, percentiles, timed
+from benchmarks.synthetic import render_clip, simulate_tracks
+from hls import HlsWriter
+
+STAGES = ("decode", "inference", "sort", "annotate", "encode", "flush")
+
+
+def benchmark_stages(video_path: str, output_dir: str, batch_size: int) -> dict:
+    """
+    Process a video serially, timing each stage of every frame.
+
+    Inference runs once per batch, so the time of every stage for a batch,
+    decoding included, is shared evenly between its frames when computing
+    per-frame latency. encode is the time writing each frame to ffmpeg took,
+    which blocks only while ffmpeg is behind, and flush the time it took to
+    finish the last segments and the playlist.
+    """
+    tracker = detector.TACOTracker(detector.MODEL_PATH)
+    timings = defaultdict(list)
+    tracker._detect = timed(tracker._detect, timings["inference"])
+    tracker.tracker.update = timed(tracker.tracker.update, timings["sort"])
+    tracker.tracker.coast = timed(tracker.tracker.coast, timings["sort"])
+    tracker._annotate_frame = timed(tracker._annotate_frame, timings["annotate"])
+
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    writer = HlsWriter(os.path.join(output_dir, "stages.m3u8"), width, height, fps)
+    encode = timed(writer.write, timings["encode"])
+    read = timed(cap.read, timings["decode"])
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    frame_latencies = []
+    start_time = time.perf_counter()
+    try:
+        while True:
+            counted = {stage: len(timings[stage]) for stage in STAGES}
+            batch = []
+            for _ in range(batch_size):
+                ret, frame = read()
+                if not ret:
+                    timings["decode"].pop()  # the read that found the end
+                    break
+                batch.append(frame)
+            if not batch:
+                break
+
+            for annotated_frame in tracker.process_batch(batch):
+                encode(annotated_frame)
+
+            # Split each stage's time for the batch between its frames
+            batch_seconds = sum(
+                sum(timings[stage][counted[stage] :]) for stage in STAGES
+            )
+            frame_latencies.extend([batch_seconds / len(batch)] * len(batch))
+    finally:
+        cap.release()
+        flush_start = time.perf_counter()
+        writer.release()
+        timings["flush"].append(time.perf_counter() - flush_start)
+    wall_seconds = time.perf_counter() - start_time
+    tracker.track_store.close()
+
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    frames = len(frame_latencies)
+    return {
+        "frames": frames,
+        "wall_seconds": wall_seconds,
+        "fps": frames / wall_seconds if wall_seconds else 0.0,
+        "frame_latency": percentiles(frame_latencies),
+        "stages": {stage: percentiles(timings[stage]) for stage in STAGES},
+        # CPU time ffmpeg spent encoding and segmenting, in its own process
+        "ffmpeg_cpu_seconds": (children_after.ru_utime - children_before.ru_utime)
+        + (children_after.ru_stime - children_before.ru_stime),
+    }
+
+
+def benchmark_process_video(video_path: str, output_dir: str, pipelined: bool) -> dict:
+    """
+    Time detector.process_video end to end.
+    """
+    progress = []
+    start_time = time.perf_counter()
+    results = detector.process_video(
+        video_path,
+        os.path.join(output_dir, f"pipelined-{pipelined}.m3u8"),
+        progress_callback=lambda done, total: progress.append(
+            (time.perf_counter(), done)
+        ),
+        pipelined=pipelined,
+    )
+    wall_seconds = time.perf_counter() - start_time
+
+    # Latency between consecutive batches reaching the progress callback
+    times, frames_done = [start_time], [0]
+    for moment, done in progress:
+        times.append(moment)
+        frames_done.append(done)
+    batch_latencies = [
+        (times[i] - times[i - 1]) / max(1, frames_done[i] - frames_done[i - 1])
+        for i in range(1, len(times))
+    ]
+    frames = results["Frames processed"]
+    return {
+        "pipelined": pipelined,
+        "frames": frames,
+        "wall_seconds": wall_seconds,
+        "fps": frames / wall_seconds if wall_seconds else 0.0,
+        "frame_latency": percentiles(batch_latencies),
+    }
+
+
+def benchmark_api(video_path: str, poll_interval: float = 0.05) -> dict:
+    """
+    Upload a video through the FastAPI app and time it until the job is done.
+    """
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as client:
+        while client.get("/ready").status_code != 200:
+            time.sleep(poll_interval)
+
+        start_time = time.perf_counter()
+        with open(video_path, "rb") as video_file:
+            response = client.post(
+                "/upload", files={"file": (os.path.basename(video_path), video_file)}
+            )
+        response.raise_for_status()
+        upload_seconds = time.perf_counter() - start_time
+
+        job_id = response.json()["job_id"]
+        while True:
+            job = client.get(f"/jobs/{job_id}").json()
+            if job["status"] in ("done", "failed"):
+                break
+            time.sleep(poll_interval)
+        wall_seconds = time.perf_counter() - start_time
+
+        if job["status"] == "done":
+            shutil.rmtree(os.path.join(main._HLS_DIR, job["video_uuid"]))
+            os.remove(os.path.join(main._DATA_DIR, f"{job['video_uuid']}.json"))
+    return {
+        "status": job["status"],
+        "frames": job["frames_done"],
+        "upload_seconds": upload_seconds,
+        "wall_seconds": wall_seconds,
+        "fps": job["frames_done"] / wall_seconds if wall_seconds else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--video", help="Clip to benchmark instead of a synthetic one")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--objects", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=detector.BATCH_SIZE)
+    parser.add_argument("--api", action="store_true", help="Also time the API")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="flyby-benchmark-") as work_dir:
+        video_path = args.video
+        if video_path is None:
+            video_path = os.path.join(work_dir, "synthetic.mp4")
+            ground_truth = simulate_tracks(
+                args.width, args.height, args.frames, args.objects, args.seed
+            )
+            render_clip(
+                video_path,
+                ground_truth,
+                args.width,
+                args.height,
+                args.frames,
+                seed=args.seed,
+            )
+
+        # Load the model before timing anything
+        detector.model_registry.warm_up([detector.MODEL_PATH])
+
+        results = {
+            "video": args.video or "synthetic",
+            "config": {
+                **vars(args),
+                "backend": detector.BACKEND,
+                "max_stride": detector.MAX_STRIDE,
+                "tile_size": detector.TILE_SIZE,
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+            },
+            "stages": benchmark_stages(video_path, work_dir, args.batch_size),
+            "process_video": [
+                benchmark_process_video(video_path, work_dir, pipelined)
+                for pipelined in (False, True)
+            ],
+        }
+        if args.api:
+            results["api"] = benchmark_api(video_path)
+        results["peak_rss_mb"] = peak_rss_mb()
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
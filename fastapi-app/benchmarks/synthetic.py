@@ -0,0 +1,173 @@
+"""
+Generate synthetic aerial clips of floating debris, with MOT-format ground
+truth and noisy detections, for benchmarking without real footage.
+
+    python -m benchmarks.synthetic clip.mp4 --width 1920 --height 1080 --frames 300 --objects 40
+
+Writes clip.mp4, clip.gt.txt and clip.det.txt.
+"""
+
+import argparse
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+
+def simulate_tracks(
+    width: int, height: int, frames: int, objects: int, seed: int = 0
+) -> np.ndarray:
+    """
+    Simulate objects drifting across the frame as the camera pans.
+
+    Returns MOT ground truth rows [frame, id, x, y, w, h] for the frames each
+    object is visible in, numbered from 1. Objects appear and leave at random,
+    so about `objects` are on screen at any time.
+    """
+    rng = np.random.default_rng(seed)
+    n = objects * 2
+    size = rng.uniform(12, 48, (n, 1)) * rng.uniform(0.6, 1.4, (n, 2))
+    start = rng.uniform([0, 0], [width, height], (n, 2))
+    velocity = rng.normal(0, 1.5, (n, 2))
+    drift = rng.normal(0, 1.0, 2)  # camera pan shared by every object
+    born = rng.integers(0, max(1, frames // 2), n)
+    lifetime = rng.integers(max(2, frames // 4), frames + 1, n)
+
+    rows = []
+    for frame in range(frames):
+        alive = np.flatnonzero((born <= frame) & (frame < born + lifetime))
+        centre = start[alive] + (velocity[alive] + drift) * (frame - born[alive, None])
+        corner = centre - size[alive] / 2
+        visible = np.all(
+            (corner >= 0) & (corner + size[alive] <= [width, height]), axis=1
+        )
+        for i, (x, y), (w, h) in zip(
+            alive[visible], corner[visible], size[alive][visible]
+        ):
+            rows.append([frame + 1, i + 1, x, y, w, h])
+    return np.array(rows, dtype=np.float64).reshape(-1, 6)
+
+
+def synthetic_detections(
+    ground_truth: np.ndarray,
+    width: int,
+    height: int,
+    miss_rate: float = 0.1,
+    false_positives: float = 0.5,
+    jitter: float = 1.5,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Turn ground truth into detector-like output: MOT rows
+    [frame, -1, x, y, w, h, conf] with jittered boxes, missed objects and
+    false_positives spurious boxes per frame on average.
+    """
+    rng = np.random.default_rng(seed)
+    kept = ground_truth[rng.random(len(ground_truth)) >= miss_rate]
+    boxes = kept[:, 2:6] + rng.normal(0, jitter, (len(kept), 4))
+    detections = np.column_stack(
+        [kept[:, 0], np.full(len(kept), -1), boxes, rng.uniform(0.3, 1, len(kept))]
+    )
+
+    frames = int(ground_truth[:, 0].max()) if len(ground_truth) else 0
+    n_false = rng.poisson(false_positives * frames)
+    spurious = np.column_stack(
+        [
+            rng.integers(1, frames + 1, n_false),
+            np.full(n_false, -1),
+            rng.uniform([0, 0], [width - 40, height - 40], (n_false, 2)),
+            rng.uniform(10, 40, (n_false, 2)),
+            rng.uniform(0.15, 0.5, n_false),
+        ]
+    )
+    detections = np.concatenate([detections, spurious.reshape(-1, 7)])
+    return detections[np.argsort(detections[:, 0], kind="stable")]
+
+
+def render_clip(
+    path: str,
+    ground_truth: np.ndarray,
+    width: int,
+    height: int,
+    frames: int,
+    fps: float = 30,
+    seed: int = 0,
+) -> None:
+    """
+    Render ground truth boxes as debris on a rippling water background.
+    """
+    rng = np.random.default_rng(seed)
+    # Low frequency noise for the water, larger than the frame so it can pan
+    noise = rng.normal(0, 1, (height // 16 + 8, width // 16 + 8)).astype(np.float32)
+    noise = cv2.resize(
+        noise, (width + 128, height + 128), interpolation=cv2.INTER_CUBIC
+    )
+    water = np.stack([100 + 25 * noise, 80 + 20 * noise, 30 + 10 * noise], axis=2)
+    water = np.clip(water, 0, 255).astype(np.uint8)
+    colours = rng.integers(120, 256, (int(ground_truth[:, 1].max(initial=0)) + 1, 3))
+
+    writer = cv2.VideoWriter(
+        path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height)
+    )
+    rows_by_frame = np.split(
+        ground_truth, np.searchsorted(ground_truth[:, 0], np.arange(2, frames + 1))
+    )
+    for frame, rows in enumerate(rows_by_frame):
+        offset = int(64 + 48 * np.sin(frame / 60))
+        image = water[offset : offset + height, offset : offset + width].copy()
+        for _, track_id, x, y, w, h in rows:
+            centre = (int(x + w / 2), int(y + h / 2))
+            axes = (max(1, int(w / 2)), max(1, int(h / 2)))
+            colour = tuple(int(c) for c in colours[int(track_id)])
+            cv2.ellipse(image, centre, axes, 0, 0, 360, colour, -1)
+        writer.write(image)
+    writer.release()
+
+
+def write_mot(path: str, rows: np.ndarray) -> None:
+    """
+    Save rows in MOT text format, padding them to the usual ten columns.
+    """
+    padded = np.full((len(rows), 10), -1.0)
+    padded[:, 6] = 1
+    padded[:, : rows.shape[1]] = rows
+    np.savetxt(path, padded, delimiter=",", fmt="%.2f")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("output", help="Path of the .mp4 clip to write")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--objects", type=int, default=40)
+    parser.add_argument("--fps", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-video", action="store_true", help="Only write the MOT files"
+    )
+    args = parser.parse_args()
+
+    ground_truth = simulate_tracks(
+        args.width, args.height, args.frames, args.objects, args.seed
+    )
+    output = Path(args.output)
+    write_mot(str(output.with_suffix(".gt.txt")), ground_truth)
+    write_mot(
+        str(output.with_suffix(".det.txt")),
+        synthetic_detections(ground_truth, args.width, args.height, seed=args.seed),
+    )
+    if not args.no_video:
+        render_clip(
+            args.output,
+            ground_truth,
+            args.width,
+            args.height,
+            args.frames,
+            args.fps,
+            args.seed,
+        )
+
+
+if __name__ == "__main__":
+    main()
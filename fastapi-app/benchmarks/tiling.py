@@ -0,0 +1,137 @@
+"""
+Compare throughput and recall of tiled inference against whole-frame inference.
+
+    python -m benchmarks.tiling VIDEO [--ground-truth GT] [--tile-sizes 640 960]
+
+GT is a MOT-format file (frame,id,x,y,w,h,...) with frames numbered from 1.
+Without one, only throughput and detection counts are reported.
+"""
+
+import argparse
+import json
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+import detector
+from sort import iou_batch, linear_assignment
+
+
+def load_ground_truth(path: str) -> Dict[int, np.ndarray]:
+    """
+    Read MOT-format boxes into [x1,y1,x2,y2] arrays keyed by frame number.
+    """
+    rows = np.loadtxt(path, delimiter=",", ndmin=2)
+    boxes = defaultdict(lambda: np.empty((0, 4)))
+    for frame in np.unique(rows[:, 0]).astype(int):
+        frame_rows = rows[rows[:, 0] == frame]
+        boxes[frame] = np.column_stack(
+            [frame_rows[:, 2:4], frame_rows[:, 2:4] + frame_rows[:, 4:6]]
+        )
+    return boxes
+
+
+def matched_count(detections: np.ndarray, truth: np.ndarray, iou: float) -> int:
+    """
+    Number of ground truth boxes matched one-to-one by a detection.
+    """
+    if len(detections) == 0 or len(truth) == 0:
+        return 0
+    overlap = iou_batch(truth, detections[:, :4])
+    pairs = linear_assignment(-overlap).reshape(-1, 2).astype(int)
+    return int(np.sum(overlap[pairs[:, 0], pairs[:, 1]] >= iou))
+
+
+def read_frames(video_path: str, limit: int) -> List[np.ndarray]:
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < limit:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def run(
+    frames: List[np.ndarray],
+    truth: Optional[Dict[int, np.ndarray]],
+    batch_size: int,
+    match_iou: float,
+    **tracker_options,
+) -> dict:
+    """
+    Time detection on every frame with one tracker configuration.
+    """
+    tracker = detector.TACOTracker(detector.MODEL_PATH, **tracker_options)
+    tracker._detect(frames[:1])  # warm up
+
+    detections = []
+    start_time = time.perf_counter()
+    for start in range(0, len(frames), batch_size):
+        detections.extend(tracker._detect(frames[start : start + batch_size]))
+    seconds = time.perf_counter() - start_time
+
+    result = {
+        **tracker_options,
+        "frames": len(frames),
+        "seconds": seconds,
+        "fps": len(frames) / seconds,
+        "detections": sum(len(d) for d, _ in detections),
+    }
+    if truth is not None:
+        total = sum(len(truth[i + 1]) for i in range(len(frames)))
+        found = sum(
+            matched_count(d, truth[i + 1], match_iou)
+            for i, (d, _) in enumerate(detections)
+        )
+        result["recall"] = found / total if total else None
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("video")
+    parser.add_argument("--ground-truth", help="MOT-format ground truth boxes")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=detector.BATCH_SIZE)
+    parser.add_argument("--tile-sizes", type=int, nargs="+", default=[640])
+    parser.add_argument("--tile-overlap", type=float, default=detector.TILE_OVERLAP)
+    parser.add_argument(
+        "--tile-merges", nargs="+", default=["nms", "merge"], help="nms and/or merge"
+    )
+    parser.add_argument("--match-iou", type=float, default=0.5)
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    frames = read_frames(args.video, args.frames)
+    truth = load_ground_truth(args.ground_truth) if args.ground_truth else None
+
+    results = [run(frames, truth, args.batch_size, args.match_iou, tile_size=0)]
+    for tile_size in args.tile_sizes:
+        for tile_merge in args.tile_merges:
+            results.append(
+                run(
+                    frames,
+                    truth,
+                    args.batch_size,
+                    args.match_iou,
+                    tile_size=tile_size,
+                    tile_overlap=args.tile_overlap,
+                    tile_merge=tile_merge,
+                )
+            )
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
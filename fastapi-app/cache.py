@@ -0,0 +1,170 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Hashable, Optional
+
+
+@dataclass
+class CacheEntry:
+    video_uuid: str
+    size_bytes: int
+    created: float
+    last_used: float
+
+
+class ResultCache:
+    """
+    Maps the content hash of an uploaded video, together with the settings it
+    was processed with, to the video_uuid of its stored results.
+
+    Entries are kept in least recently used order. Once their total size goes
+    over max_bytes, or an entry has not been used for max_age seconds, the least
+    recently used entries are evicted and evict(video_uuid) deletes their files.
+    The most recent entry is never evicted for size alone.
+    """
+
+    def __init__(
+        self,
+        max_bytes: Optional[int],
+        max_age: Optional[float],
+        evict: Callable[[str], None],
+    ):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._evict = evict
+        self._entries = OrderedDict()
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size_bytes
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Return the video_uuid stored for key, marking it as recently used.
+        """
+        with self._lock:
+            evicted = self._expire()
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.last_used = time.time()
+                self._entries.move_to_end(key)
+        self._delete(evicted)
+        return entry.video_uuid if entry is not None else None
+
+    def put(self, key: str, video_uuid: str, size_bytes: int) -> None:
+        """
+        Store the results of key, evicting older entries if over budget.
+        """
+        now = time.time()
+        with self._lock:
+            evicted = []
+            if key in self._entries:
+                replaced = self._remove(key)
+                if replaced != video_uuid:
+                    evicted.append(replaced)
+            self._entries[key] = CacheEntry(video_uuid, size_bytes, now, now)
+            self._size_bytes += size_bytes
+
+            evicted.extend(self._expire())
+            while (
+                self.max_bytes is not None
+                and self._size_bytes > self.max_bytes
+                and len(self._entries) > 1
+            ):
+                evicted.append(self._remove(next(iter(self._entries))))
+        self._delete(evicted)
+
+    def _expire(self) -> list:
+        """
+        Remove entries unused for max_age, returning their video_uuids.
+        """
+        if self.max_age is None:
+            return []
+        cutoff = time.time() - self.max_age
+        expired = []
+        for key, entry in self._entries.items():
+            if entry.last_used >= cutoff:
+                break  # the remaining entries were used more recently
+            expired.append(key)
+        return [self._remove(key) for key in expired]
+
+    def _remove(self, key: str) -> str:
+        entry = self._entries.pop(key)
+        self._size_bytes -= entry.size_bytes
+        return entry.video_uuid
+
+    def _delete(self, video_uuids: list) -> None:
+        # Files are deleted outside the lock so lookups are not held up
+        for video_uuid in video_uuids:
+            self._evict(video_uuid)
+
+
+@dataclass
+class CachedResponse:
+    content: bytes
+    media_type: str
+    etag: str = field(init=False)
+
+    def __post_init__(self):
+        self.etag = f'"{hashlib.sha1(self.content).hexdigest()}"'
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """
+        Whether an If-None-Match header lists this response's ETag.
+        """
+        if not if_none_match:
+            return False
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or self.etag in tags
+
+
+class ResponseCache:
+    """
+    Rendered response bodies by key, such as the rewritten manifests of
+    processed videos, so they are served without touching the disk.
+
+    Entries are kept in least recently used order and evicted once their total
+    size goes over max_bytes.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        with self._lock:
+            response = self._entries.get(key)
+            if response is not None:
+                self._entries.move_to_end(key)
+            return response
+
+    def put(self, key: Hashable, response: CachedResponse) -> None:
+        with self._lock:
+            self._discard(key)
+            if len(response.content) > self.max_bytes:
+                return
+            self._entries[key] = response
+            self._size_bytes += len(response.content)
+            while self._size_bytes > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key: Hashable) -> None:
+        response = self._entries.pop(key, None)
+        if response is not None:
+            self._size_bytes -= len(response.content)
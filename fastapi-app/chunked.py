@@ -0,0 +1,389 @@
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import detector
+from detection_log import DetectionLog
+from hls import HlsWriter
+from motion_gate import MotionGate
+from pipeline import run_pipeline
+from sort import iou_batch, linear_assignment
+from stride import AdaptiveStride
+from track_store import COLUMNS, TrackStore
+
+# Worker processes videos are split between; 1 processes videos in one pass
+CHUNK_WORKERS = int(os.environ.get("FLYBY_CHUNK_WORKERS", "1"))
+# Frames at the start of a chunk also processed at the end of the previous one,
+# where the tracks of both are matched
+CHUNK_OVERLAP = int(os.environ.get("FLYBY_CHUNK_OVERLAP", "30"))
+# Shortest chunk worth starting a worker for, in frames
+MIN_CHUNK_FRAMES = 300
+# Mean IOU over the overlap above which two tracks are the same object
+STITCH_IOU_THRESHOLD = 0.5
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(workers: int) -> ProcessPoolExecutor:
+    """
+    Share one pool of worker processes between videos, so models stay loaded
+    and concurrent jobs do not oversubscribe the CPU.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawn rather than fork, as the server process runs threads
+            _executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(max(1, (os.cpu_count() or 1) // workers),),
+            )
+        return _executor
+
+
+def _init_worker(threads: int) -> None:
+    # Split the cores between workers instead of every worker using all of them
+    import torch
+
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+
+
+def chunk_ranges(
+    frames_total: int, chunks: int, overlap: int
+) -> List[Tuple[int, int, int]]:
+    """
+    Split frames_total frames into chunks of (read_start, start, end) frame
+    indices. Each chunk owns frames [start, end) and reads from overlap frames
+    earlier, so its tracks are established where the previous chunk ends.
+    """
+    bounds = np.linspace(0, frames_total, chunks + 1).astype(int).tolist()
+    return [
+        (max(0, start - overlap), start, end)
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def _track_chunk(
+    video_path: str,
+    read_start: int,
+    end: Optional[int],
+    batch_size: int,
+    record_detections: bool,
+    tracker_options: dict,
+) -> Tuple[
+    Dict[str, np.ndarray],
+    Dict[int, str],
+    int,
+    Optional[dict],
+    Optional[AdaptiveStride],
+    Optional[MotionGate],
+]:
+    """
+    Track the frames [read_start, end) of a video in a worker process, or up to
+    the last frame if end is None.
+
+    Returns the track log with frames numbered from the start of the video,
+    the model's class names, the number of frames read, if recorded, the
+    columns of the detection log numbered the same way, and the tracker's
+    stride policy and motion gate, if enabled, for their reports.
+    """
+    tracker = detector.TACOTracker(
+        detector.MODEL_PATH, annotate=False, **tracker_options
+    )
+    if record_detections:
+        tracker.detection_log = DetectionLog()
+    cap = cv2.VideoCapture(video_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, read_start)
+    frames = itertools.islice(
+        detector._read_frames(cap), None if end is None else end - read_start
+    )
+    try:
+        for batch in detector._batched(frames, max(1, batch_size)):
+            tracker.process_batch(batch)
+    finally:
+        cap.release()
+
+    columns = {name: tracker.track_store.column(name) for name, _ in COLUMNS}
+    tracker.track_store.close()
+    columns["frame"] += read_start
+
+    detections = None
+    if record_detections:
+        detections = tracker.detection_log.columns()
+        detections["frame"] += read_start
+        detections["detected"] += read_start
+    return (
+        columns,
+        tracker.class_names,
+        tracker.frame_count,
+        detections,
+        tracker.stride_policy,
+        tracker.motion_gate,
+    )
+
+
+def _match_tracks(
+    previous: Dict[str, np.ndarray], current: Dict[str, np.ndarray]
+) -> Dict[int, int]:
+    """
+    Match the tracks of two chunks over the frames both tracked, returning
+    current track ids mapped to the previous track ids of the same objects.
+    """
+    previous_ids, previous_index = np.unique(previous["track_id"], return_inverse=True)
+    current_ids, current_index = np.unique(current["track_id"], return_inverse=True)
+    if len(previous_ids) == 0 or len(current_ids) == 0:
+        return {}
+
+    # Sum the IOU of every pair of tracks over the frames both appear in
+    iou_sums = np.zeros((len(previous_ids), len(current_ids)))
+    shared_frames = np.zeros_like(iou_sums)
+    previous_boxes = np.column_stack([previous[n] for n in ("x1", "y1", "x2", "y2")])
+    current_boxes = np.column_stack([current[n] for n in ("x1", "y1", "x2", "y2")])
+    for frame in np.intersect1d(previous["frame"], current["frame"]):
+        p = np.flatnonzero(previous["frame"] == frame)
+        c = np.flatnonzero(current["frame"] == frame)
+        rows, cols = np.ix_(previous_index[p], current_index[c])
+        iou_sums[rows, cols] += iou_batch(previous_boxes[p], current_boxes[c])
+        shared_frames[rows, cols] += 1
+
+    mean_iou = iou_sums / np.maximum(shared_frames, 1)
+    matched = linear_assignment(-mean_iou).reshape(-1, 2).astype(int)
+    return {
+        int(current_ids[c]): int(previous_ids[p])
+        for p, c in matched
+        if mean_iou[p, c] >= STITCH_IOU_THRESHOLD
+    }
+
+
+def stitch_chunks(
+    chunks: List[Dict[str, np.ndarray]], ranges: List[Tuple[int, int, int]]
+) -> Dict[str, np.ndarray]:
+    """
+    Merge the track logs of consecutive chunks into one, giving tracks unique
+    ids and continuing tracks matched across chunk boundaries under one id.
+
+    Every chunk keeps only the rows of the frames it owns; its rows in the
+    overlap are only used to match its tracks to the previous chunk's.
+    """
+    merged = []
+    previous = None
+    next_id = 1
+    for columns, (read_start, start, end) in zip(chunks, ranges):
+        # Frames are numbered from 1, so a chunk owns frames start+1 to end
+        overlap = columns["frame"] <= start
+        mapping = {}
+        if previous is not None:
+            window = previous["frame"] > read_start
+            mapping = _match_tracks(
+                {name: column[window] for name, column in previous.items()},
+                {name: column[overlap] for name, column in columns.items()},
+            )
+
+        owned = {name: column[~overlap] for name, column in columns.items()}
+        for track_id in np.unique(owned["track_id"]).tolist():
+            if track_id not in mapping:
+                mapping[track_id] = next_id
+                next_id += 1
+        owned["track_id"] = np.array(
+            [mapping[track_id] for track_id in owned["track_id"].tolist()],
+            dtype=owned["track_id"].dtype,
+        )
+
+        merged.append(owned)
+        previous = owned
+
+    return {
+        name: np.concatenate([columns[name] for columns in merged])
+        for name, _ in COLUMNS
+    }
+
+
+def _render(
+    video_path: str,
+    output_path: str,
+    columns: Dict[str, np.ndarray],
+    class_names: Dict[int, str],
+    batch_size: int,
+) -> None:
+    """
+    Draw the merged tracks on the video and encode it to HLS.
+    """
+    cap = cv2.VideoCapture(video_path)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    writer = HlsWriter(output_path, width, height, fps)
+
+    tracks = np.column_stack([columns[n] for n in ("x1", "y1", "x2", "y2", "track_id")])
+    frame_numbers = itertools.count(1)
+
+    def annotate(frames: List[np.ndarray]) -> List[np.ndarray]:
+        annotated_frames = []
+        for frame in frames:
+            number = next(frame_numbers)
+            rows = slice(*np.searchsorted(columns["frame"], [number, number + 1]))
+            annotated_frames.append(
+                detector.annotate_frame(
+                    frame, tracks[rows], columns["class_id"][rows], class_names
+                )
+            )
+        return annotated_frames
+
+    batches = detector._batched(detector._read_frames(cap), max(1, batch_size))
+    try:
+        run_pipeline(batches, annotate, writer.write, detector.PIPELINE_QUEUE_SIZE)
+    finally:
+        cap.release()
+        writer.release()
+
+
+def process_video_chunked(
+    video_path: str,
+    output_path: str,
+    workers: int = CHUNK_WORKERS,
+    overlap: int = CHUNK_OVERLAP,
+    batch_size: int = detector.BATCH_SIZE,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    analytics_callback: Optional[Callable[[dict], None]] = None,
+    tracks_path: Optional[str] = None,
+    detections_path: Optional[str] = None,
+    **tracker_options,
+) -> dict:
+    """
+    Process a video like detector.process_video, split into time chunks that
+    are tracked in parallel by worker processes.
+
+    Tracks are stitched across chunk boundaries and drawn on the video in a
+    final pass, so objects crossing a boundary are only counted once. Videos too
+    short to split fall back to detector.process_video. progress_callback is
+    called as chunks finish tracking. As tracks are only known once stitched,
+    analytics_callback is called once at the end, with every track.
+
+    With more than one worker, chunks are decoded with OpenCV and run the
+    model in their own process, so detector.FFMPEG_DECODE, SCALED_OUTPUT and
+    INFERENCE_WORKERS are not used, including by videos too short to split.
+    Stride and motion gate reports count the frames of every chunk, those of
+    the overlaps twice.
+    """
+    cap = cv2.VideoCapture(video_path)
+    frames_total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    cap.release()
+
+    chunks = min(workers, frames_total // MIN_CHUNK_FRAMES)
+    if chunks <= 1:
+        # Short videos are processed the way chunks are, as they share results
+        # with other videos processed in chunks
+        single_pass_options = (
+            {"ffmpeg_decode": False, "inference_workers": 0} if workers > 1 else {}
+        )
+        return detector.process_video(
+            video_path,
+            output_path,
+            batch_size=batch_size,
+            progress_callback=progress_callback,
+            analytics_callback=analytics_callback,
+            tracks_path=tracks_path,
+            detections_path=detections_path,
+            **single_pass_options,
+            **tracker_options,
+        )
+
+    # The overlap must leave every chunk frames of its own
+    ranges = chunk_ranges(frames_total, chunks, min(overlap, MIN_CHUNK_FRAMES // 2))
+    executor = _get_executor(workers)
+    futures = {}
+    for i, (read_start, _, end) in enumerate(ranges):
+        # The frame count is an estimate, so the last chunk reads to the end
+        end = None if i == len(ranges) - 1 else end
+        future = executor.submit(
+            _track_chunk,
+            video_path,
+            read_start,
+            end,
+            batch_size,
+            bool(detections_path),
+            tracker_options,
+        )
+        futures[future] = i
+
+    results = [None] * len(ranges)
+    frames_done = 0
+    for future in as_completed(futures):
+        i = futures[future]
+        results[i] = future.result()
+        read_start, start, _ = ranges[i]
+        frames_done += results[i][2] - (start - read_start)
+        if progress_callback:
+            progress_callback(frames_done, frames_total)
+
+    class_names = results[0][1]
+    columns = stitch_chunks([result[0] for result in results], ranges)
+    if detections_path:
+        # Like the tracks, every chunk keeps the detections of the frames it owns
+        detection_log = DetectionLog()
+        for result, (_, start, _) in zip(results, ranges):
+            detection_log.extend(result[3], after_frame=start)
+        detection_log.save(
+            detections_path,
+            frames_done,
+            class_names=class_names,
+            confidence_threshold=detector.processing_settings(**tracker_options)[
+                "confidence_threshold"
+            ],
+        )
+    if output_path:
+        _render(video_path, output_path, columns, class_names, batch_size)
+
+    track_store = TrackStore(memory_budget=detector.TRACK_STORE_MEMORY_BUDGET)
+    track_store.extend(columns)
+    summaries = track_store.summaries()
+    if tracks_path:
+        track_store.save(
+            tracks_path, frames=frames_done, fps=fps, class_names=class_names
+        )
+    track_store.close()
+
+    # Like TACOTracker, count each track under the class it was first seen with
+    track_classes = [
+        class_names[class_id] if class_id >= 0 else "unknown"
+        for class_id in summaries["class_id"].tolist()
+    ]
+    class_counts = {}
+    for class_name in track_classes:
+        class_counts[class_name] = class_counts.get(class_name, 0) + 1
+
+    video_data = {
+        "Total tracked objects": len(summaries["track_id"]),
+        "Class counts:": class_counts,
+        "Frames processed": frames_done,
+    }
+    # Report on the stride policies and motion gates of every chunk as one
+    for index, name in ((4, "Stride report"), (5, "Motion gate report")):
+        policies = [result[index] for result in results if result[index] is not None]
+        if policies:
+            for policy in policies[1:]:
+                policies[0].merge(policy)
+            video_data[name] = policies[0].report()
+    if analytics_callback:
+        new_tracks = [
+            {"track_id": track_id, "class_name": class_name, "first_seen": first_seen}
+            for track_id, class_name, first_seen in zip(
+                summaries["track_id"].tolist(),
+                track_classes,
+                summaries["first_seen"].tolist(),
+            )
+        ]
+        new_tracks.sort(key=lambda track: track["first_seen"])
+        analytics_callback({**video_data, "New tracks": new_tracks})
+
+    return video_data
@@ -0,0 +1,96 @@
+import json
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class DetectionLog:
+    """
+    Detections of every frame of a video before tracking, so tracking can be
+    run again with other settings without running the model.
+
+    Frames detection was skipped on, when striding, are recorded as such and
+    replayed with the boxes predicted by SORT.
+    """
+
+    def __init__(self):
+        self._frames = []
+        self._detections = []
+        self._class_ids = []
+        self._detected = []
+
+    def __len__(self) -> int:
+        """
+        Number of frames detection ran on.
+        """
+        return len(self._detected)
+
+    def append(self, frame: int, detections: np.ndarray, class_ids: np.ndarray):
+        """
+        Add the detections [x1,y1,x2,y2,score] of one frame and their classes.
+        """
+        self._detected.append(frame)
+        if len(detections):
+            self._frames.append(np.full(len(detections), frame, np.int32))
+            self._detections.append(np.asarray(detections, np.float32))
+            self._class_ids.append(np.asarray(class_ids, np.int16))
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """
+        Return every detection as one array per column, and the frames
+        detection ran on as "detected".
+        """
+        frames = np.concatenate([np.empty(0, np.int32), *self._frames])
+        detections = np.concatenate([np.empty((0, 5), np.float32), *self._detections])
+        class_ids = np.concatenate([np.empty(0, np.int16), *self._class_ids])
+        return {
+            "frame": frames,
+            "detections": detections,
+            "class_id": class_ids,
+            "detected": np.array(self._detected, np.int32),
+        }
+
+    def extend(self, columns: Dict[str, np.ndarray], after_frame: int = 0) -> None:
+        """
+        Add the detections of frames after after_frame, given as returned by
+        columns(), which must follow the frames already logged.
+        """
+        rows = columns["frame"] > after_frame
+        self._frames.append(columns["frame"][rows])
+        self._detections.append(columns["detections"][rows])
+        self._class_ids.append(columns["class_id"][rows])
+        detected = columns["detected"]
+        self._detected.extend(detected[detected > after_frame].tolist())
+
+    def save(self, path: str, frames: int, **metadata) -> None:
+        """
+        Write the log of a video of frames frames to an .npz file, with
+        metadata saved alongside as JSON.
+        """
+        np.savez_compressed(
+            path,
+            metadata=np.array(json.dumps({"frames": frames, **metadata})),
+            **self.columns(),
+        )
+
+
+def load(path: str) -> Tuple[List[Optional[Tuple[np.ndarray, np.ndarray]]], dict]:
+    """
+    Read a saved DetectionLog, returning the detections and class ids of every
+    frame in order, or None for frames detection was skipped on, and its
+    metadata.
+    """
+    with np.load(path) as saved:
+        metadata = json.loads(saved["metadata"].item())
+        frames = saved["frame"]
+        detections = saved["detections"]
+        class_ids = saved["class_id"].astype(int)
+        detected = set(saved["detected"].tolist())
+
+    bounds = np.searchsorted(frames, np.arange(1, metadata["frames"] + 2))
+    return [
+        ((detections[start:end], class_ids[start:end]) if frame in detected else None)
+        for frame, start, end in zip(
+            range(1, metadata["frames"] + 1), bounds[:-1], bounds[1:]
+        )
+    ], metadata
@@ -3,175 +3,509 @@ import cv2
 import numpy as np
 from pathlib import Path
 from collections import defaultdict
+from backends import load_model
+from detection_log import DetectionLog
+from frame_reader import FfmpegFrameReader
 import pandas as pd
-from typing import Dict, List, Tuple, Set
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Set
+from hls import HlsWriter
+import inspect
+import itertools
 import json
-from sort import Sort  # Simple Online Realtime Tracking for MOT
+import metrics
+from motion_gate import MotionGate
+import os
+from pipeline import run_pipeline
+from shm_pipeline import SharedMemoryInference
+from sort import ClassTracker  # Simple Online Realtime Tracking for MOT
+from sort import TRACK_IOU_THRESHOLD, TRACK_MAX_AGE, TRACK_MIN_HITS
+from stride import AdaptiveStride
+from tiling import merge_detections, slice_frame, tile_origins
+import threading
 import time
-
+from track_store import TrackStore
 
 MODEL_PATH = "models/yolov8s_100epochs.pt"
+INFERENCE_IMAGE_SIZE = (736, 1280)
+# Runtime the model is loaded with, one of backends.BACKENDS
+BACKEND = os.environ.get("FLYBY_BACKEND", "pytorch")
+# Video sampled to calibrate INT8 backends when exporting them on first load
+CALIBRATION_VIDEO = os.environ.get("FLYBY_CALIBRATION_VIDEO")
+
+# Number of frames sent to the model in a single call
+BATCH_SIZE = int(os.environ.get("FLYBY_BATCH_SIZE", "8"))
+# Decode videos with ffmpeg, scaled down to the inference size, into reused
+# buffers instead of with OpenCV at full size
+FFMPEG_DECODE = os.environ.get("FLYBY_FFMPEG_DECODE", "0") == "1"
+# With FFMPEG_DECODE, also write annotated videos at the scaled down size frames
+# are decoded at, instead of decoding them at full size to keep the source size
+SCALED_OUTPUT = os.environ.get("FLYBY_SCALED_OUTPUT", "0") == "1"
+# Processes running the model on the frames of videos, decoded by another
+# process into shared memory, kept running between videos; 0 runs the model in
+# the process tracking the video
+INFERENCE_WORKERS = int(os.environ.get("FLYBY_INFERENCE_WORKERS", "0"))
+# Bytes of shared memory the frame ring of inference workers may take, fewer
+# batches being buffered between pipeline stages to fit; /dev/shm must have
+# this much free
+SHM_RING_BUDGET = int(os.environ.get("FLYBY_SHM_RING_BUDGET_MB", "512")) * 1024 * 1024
+# Run decoding, inference and encoding on separate threads
+PIPELINED = os.environ.get("FLYBY_PIPELINED", "1") == "1"
+# Number of batches buffered between pipeline stages
+PIPELINE_QUEUE_SIZE = int(os.environ.get("FLYBY_PIPELINE_QUEUE_SIZE", "2"))
+# Most frames to advance between detector runs; 1 runs detection on every frame
+MAX_STRIDE = int(os.environ.get("FLYBY_MAX_STRIDE", "1"))
+# Fraction of a frame that may have changed since the last frame detected on
+# for it to reuse that frame's detections, e.g. 0.001; 0 disables
+MOTION_GATE_THRESHOLD = float(os.environ.get("FLYBY_MOTION_GATE_THRESHOLD", "0"))
+# Side of the square tiles frames are cut into for inference; 0 disables tiling
+TILE_SIZE = int(os.environ.get("FLYBY_TILE_SIZE", "0"))
+# Fraction of a tile shared with each neighbouring tile
+TILE_OVERLAP = float(os.environ.get("FLYBY_TILE_OVERLAP", "0.2"))
+# How boxes found in overlapping tiles are merged, "nms" or "merge"
+TILE_MERGE = os.environ.get("FLYBY_TILE_MERGE", "nms")
+# Number of tiles sent to the model in a single call
+TILE_BATCH_SIZE = 32
+# Bytes of per-frame track positions kept in memory before spilling to disk
+TRACK_STORE_MEMORY_BUDGET = (
+    int(os.environ.get("FLYBY_TRACK_STORE_BUDGET_MB", "64")) * 1024 * 1024
+)
+# Seconds between analytics updates sent while a video is processed
+ANALYTICS_INTERVAL = float(os.environ.get("FLYBY_ANALYTICS_INTERVAL", "1.0"))
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded YOLO models, keyed by weights path and
+    inference backend.
+
+    YOLO predictors are not thread-safe, so every model comes with a lock that
+    must be held while running inference on it.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._inference_locks = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self.warm_up_error = None
+
+    def get(self, model_path: str, backend: str = BACKEND) -> YOLO:
+        """
+        Return the model for model_path on backend, loading it on first use.
+        """
+        key = (model_path, backend)
+        with self._lock:
+            if key not in self._models:
+                self._models[key] = load_model(
+                    model_path, backend, INFERENCE_IMAGE_SIZE, CALIBRATION_VIDEO
+                )
+                self._inference_locks[key] = threading.Lock()
+            return self._models[key]
+
+    def inference_lock(self, model_path: str, backend: str = BACKEND) -> threading.Lock:
+        """
+        Return the lock guarding inference on the model for model_path.
+        """
+        self.get(model_path, backend)
+        return self._inference_locks[(model_path, backend)]
+
+    def warm_up(self, model_paths: Iterable[str], backend: str = BACKEND) -> None:
+        """
+        Load each model and run a dummy frame through it.
+        """
+        dummy_frame = np.zeros((*INFERENCE_IMAGE_SIZE, 3), dtype=np.uint8)
+        try:
+            for model_path in model_paths:
+                model = self.get(model_path, backend)
+                with self.inference_lock(model_path, backend):
+                    model(dummy_frame, imgsz=INFERENCE_IMAGE_SIZE, verbose=False)
+        except Exception as error:
+            self.warm_up_error = str(error)
+            raise
+        self._ready.set()
+
+    def is_ready(self) -> bool:
+        """
+        Whether warm-up has finished successfully.
+        """
+        return self._ready.is_set()
+
+
+model_registry = ModelRegistry()
 
 
 def get_model_classes(model_path):
     """Get available classes of trash model."""
-    model = YOLO(model_path)
-    return model.names
+    return model_registry.get(model_path).names
 
 
 class TACOTracker:
     def __init__(
         self,
-        model_path: str,
+        model_path: Optional[str],
         confidence_threshold: float = 0.15,
         iou_threshold: float = 0.45,
-        max_age: int = 30,
-        min_hits: int = 3,
+        max_age: int = TRACK_MAX_AGE,
+        min_hits: int = TRACK_MIN_HITS,
+        sort_iou_threshold: float = TRACK_IOU_THRESHOLD,
+        vectorized_tracking: bool = True,
+        gated_association: bool = True,
+        max_stride: int = MAX_STRIDE,
+        motion_gate_threshold: float = MOTION_GATE_THRESHOLD,
+        tile_size: int = TILE_SIZE,
+        tile_overlap: float = TILE_OVERLAP,
+        tile_merge: str = TILE_MERGE,
+        backend: str = BACKEND,
+        annotate: bool = True,
+        class_names: Optional[Dict[int, str]] = None,
     ):
         """
-        Initialize the marine debris tracking system."""
-        # Load YOLOv8 model
-        self.model = YOLO(model_path)
+        Initialize the marine debris tracking system.
+
+        With a max_stride above 1, detection is skipped on some frames and the
+        boxes predicted by SORT are used instead. With a motion_gate_threshold,
+        frames that barely differ from the last one detection ran on are
+        tracked with its detections instead. With a tile_size, frames are
+        cut into overlapping tiles that are run through the model at full
+        resolution, and boxes found in several tiles are merged with tile_merge.
+        The model runs on backend, PyTorch or an exported ONNX Runtime or
+        OpenVINO model, optionally quantized to INT8. Without annotate, frames
+        are returned as they are instead of with boxes drawn on them.
+
+        Without a model_path, no model is loaded and frames can only be tracked
+        from detections made elsewhere, given to replay_frame or process_batch
+        along with the model's class_names.
+        """
+        # Share the YOLOv8 model loaded for this process
+        if model_path is not None:
+            self.model = model_registry.get(model_path, backend)
+            self.model_lock = model_registry.inference_lock(model_path, backend)
+            class_names = self.model.names
 
-        self.class_names = self.model.names
+        self.class_names = class_names
         self.conf_threshold = confidence_threshold
         self.iou_threshold = iou_threshold
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_merge = tile_merge
+        self.annotate = annotate
+
+        # Initialize SORT tracker, keeping all tracks in stacked arrays unless
+        # the per-track filterpy implementation is requested
+        self.tracker = ClassTracker(
+            max_age=max_age,
+            min_hits=min_hits,
+            iou_threshold=sort_iou_threshold,
+            vectorized=vectorized_tracking,
+            gated=gated_association,
+        )
 
-        # Initialize SORT tracker
-        self.tracker = Sort(max_age=max_age, min_hits=min_hits)
-
-        # Storage for tracking statistics
+        # Storage for tracking statistics; per-frame positions go to a columnar
+        # store which spills to disk past its memory budget
         self.tracked_objects = defaultdict(dict)
+        self.track_store = TrackStore(memory_budget=TRACK_STORE_MEMORY_BUDGET)
         self.frame_count = 0
 
-    def process_frame(self, frame: np.ndarray) -> Tuple[np.ndarray, Dict]:
+        self.stride_policy = AdaptiveStride(max_stride) if max_stride > 1 else None
+        self.motion_gate = (
+            MotionGate(motion_gate_threshold) if motion_gate_threshold > 0 else None
+        )
+        # Detections of the last frame detection ran on, reused on gated frames
+        self._last_detections = None
+
+        # Set to a DetectionLog to record the detections of every frame
+        self.detection_log = None
+        # Set to the factors from frame to source video coordinates of
+        # [x1,y1,x2,y2] for frames decoded scaled down, so tracks are kept in
+        # source coordinates
+        self.box_scale = None
+
+    def process_frame(self, frame: np.ndarray) -> np.ndarray:
         """
         Process a single frame of video.
         """
+        return self.process_batch([frame])[0]
+
+    def replay_frame(self, detections: Optional[Tuple[np.ndarray, np.ndarray]]) -> None:
+        """
+        Track the next frame from the detections and class ids recorded in a
+        DetectionLog, or from the boxes predicted by SORT if detection was
+        skipped on it. Requires annotate to be off.
+        """
+        if detections is None:
+            self._predict_frame(None)
+        else:
+            self._track_frame(None, *detections)
+
+    def process_batch(
+        self,
+        frames: List[np.ndarray],
+        detections: Optional[List[Tuple[np.ndarray, np.ndarray]]] = None,
+    ) -> List[np.ndarray]:
+        """
+        Process consecutive frames of video with a single model call, or with
+        the detections and class ids of every frame if already made.
+
+        Detections are fed to SORT in frame order, so tracking results are the
+        same as calling process_frame on each frame in turn.
+        """
+        start_time = time.perf_counter()
+        gated = [False] * len(frames)
+        if detections is not None:
+            detect = [True] * len(frames)
+            detections = iter(detections)
+        else:
+            if self.stride_policy is None:
+                detect = [True] * len(frames)
+            else:
+                detect = self.stride_policy.plan(self.frame_count, len(frames))
+            if self.motion_gate is not None:
+                gated = [
+                    run_detection and self.motion_gate.is_static(frame)
+                    for frame, run_detection in zip(frames, detect)
+                ]
+
+            run_model = [d and not g for d, g in zip(detect, gated)]
+            detection_start = time.perf_counter()
+            detections = iter(
+                self._detect([f for f, run in zip(frames, run_model) if run])
+            )
+            detection_seconds = time.perf_counter() - detection_start
+            if self.stride_policy is not None:
+                self.stride_policy.detection_seconds += detection_seconds
+            if self.motion_gate is not None:
+                self.motion_gate.detection_seconds += detection_seconds
+            n_detected = sum(run_model)
+            if metrics.ENABLED and n_detected:
+                # Share the batch's inference time between the frames detected
+                for _ in range(n_detected):
+                    metrics.STAGE_SECONDS.observe(
+                        detection_seconds / n_detected, stage="inference"
+                    )
+
+        annotated_frames = []
+        for frame, run_detection, reuse_detections in zip(frames, detect, gated):
+            if reuse_detections:
+                metrics.FRAMES_GATED.inc()
+                annotated_frames.append(
+                    self._track_frame(frame, *self._last_detections)
+                )
+            elif run_detection:
+                self._last_detections = next(detections)
+                annotated_frames.append(
+                    self._track_frame(frame, *self._last_detections)
+                )
+            else:
+                annotated_frames.append(self._predict_frame(frame))
+
+        if metrics.ENABLED:
+            frame_seconds = (time.perf_counter() - start_time) / len(frames)
+            for _ in frames:
+                metrics.FRAME_SECONDS.observe(frame_seconds)
+        return annotated_frames
+
+    def _detect(self, frames: List[np.ndarray]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Run inference on YOLOv8 for a list of frames, returning the detections
+        and class ids of each frame.
+        """
+        if not frames:
+            return []
+        if self.tile_size:
+            frame_detections = self._detect_tiled(frames)
+        else:
+            results = self._run_model(frames, INFERENCE_IMAGE_SIZE)
+            frame_detections = [self._extract_detections(r) for r in results]
+
+        if self.box_scale is not None:
+            for detections, _ in frame_detections:
+                detections[:, :4] *= self.box_scale
+        return frame_detections
+
+    def _detect_tiled(
+        self, frames: List[np.ndarray]
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Run inference on the tiles of every frame in a single batch and merge
+        the boxes of each frame's tiles.
+        """
+        tiles = []
+        frame_origins = []
+        for frame in frames:
+            origins = tile_origins(
+                frame.shape[0], frame.shape[1], self.tile_size, self.tile_overlap
+            )
+            tiles.extend(slice_frame(frame, origins, self.tile_size))
+            frame_origins.append(origins)
+
+        results = []
+        for start in range(0, len(tiles), TILE_BATCH_SIZE):
+            tile_batch = tiles[start : start + TILE_BATCH_SIZE]
+            results.extend(self._run_model(tile_batch, self.tile_size))
+        results = iter(results)
+
+        frame_detections = []
+        for origins in frame_origins:
+            all_detections, all_class_ids = [], []
+            for x, y in origins:
+                detections, class_ids = self._extract_detections(next(results))
+                # Move boxes from tile to frame coordinates
+                detections = detections.copy()
+                detections[:, [0, 2]] += x
+                detections[:, [1, 3]] += y
+                all_detections.append(detections)
+                all_class_ids.append(class_ids)
+
+            frame_detections.append(
+                merge_detections(
+                    np.concatenate(all_detections),
+                    np.concatenate(all_class_ids),
+                    self.iou_threshold,
+                    self.tile_merge,
+                )
+            )
+
+        return frame_detections
+
+    def _run_model(self, images: List[np.ndarray], imgsz) -> list:
+        """
+        Run YOLOv8 on a list of images.
+        """
+        with self.model_lock:
+            return self.model(
+                images,
+                conf=self.conf_threshold,
+                iou=self.iou_threshold,
+                imgsz=imgsz,
+                verbose=False,
+            )
+
+    def _extract_detections(self, result) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Format the boxes of a YOLOv8 result for SORT.
+        """
+        boxes = result.boxes
+        if len(boxes) == 0:
+            return np.empty((0, 5)), np.array([])
+
+        xyxy = boxes.xyxy.cpu().numpy()
+        conf = boxes.conf.cpu().numpy()
+        class_ids = boxes.cls.cpu().numpy()
+
+        return np.column_stack([xyxy, conf]), class_ids
+
+    def _track_frame(
+        self, frame: np.ndarray, detections: np.ndarray, class_ids: np.ndarray
+    ) -> np.ndarray:
+        """
+        Update SORT with the detections of the next frame and annotate it.
+        """
         self.frame_count += 1
+        if self.detection_log is not None:
+            self.detection_log.append(self.frame_count, detections, class_ids)
+
+        with metrics.STAGE_SECONDS.time(stage="sort"):
+            tracked_objects, track_class_ids = self.tracker.update(
+                detections, class_ids
+            )
+        if self.stride_policy is not None:
+            self.stride_policy.observe_detection(
+                self.frame_count, detections, tracked_objects
+            )
 
-        # Run inference on YOLOv8.
-        results = self.model(
-            frame,
-            conf=self.conf_threshold,
-            iou=self.iou_threshold,
-            imgsz=(736, 1280),
-            verbose=False,
-        )[0]
-
-        # Extract detections and format for SORT.
-        detections = []
-        class_ids = []
-        if len(results.boxes) > 0:
-            for box in results.boxes:
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                conf = box.conf[0].cpu().numpy()
-                class_id = box.cls[0].cpu().numpy()
-                detections.append([x1, y1, x2, y2, conf])
-                class_ids.append(class_id)
-
-        detections = np.array(detections) if detections else np.empty((0, 5))
-        class_ids = np.array(class_ids) if class_ids else np.array([])
-
-        tracked_objects = self.tracker.update(detections)
+        # Matched tracks come first, in the order of their detections
+        n_matched = min(len(tracked_objects), len(class_ids))
+        confidences = np.zeros(len(tracked_objects), dtype=np.float32)
+        confidences[:n_matched] = detections[:n_matched, 4]
 
         # Draw annotations
-        self._update_tracking_stats(tracked_objects, class_ids)
+        with metrics.STAGE_SECONDS.time(stage="stats"):
+            self._update_tracking_stats(tracked_objects, confidences, track_class_ids)
+        metrics.DETECTIONS_PER_FRAME.observe(len(detections))
+        metrics.LIVE_TRACKS.set(len(tracked_objects))
+        metrics.FRAMES_PROCESSED.inc(detected="true")
 
-        return self._annotate_frame(frame, tracked_objects, class_ids)
+        with metrics.STAGE_SECONDS.time(stage="annotate"):
+            return self._annotate_frame(frame, tracked_objects, track_class_ids)
+
+    def _predict_frame(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Annotate the next frame with the boxes predicted by SORT, without
+        running detection.
+        """
+        self.frame_count += 1
+
+        with metrics.STAGE_SECONDS.time(stage="sort"):
+            tracked_objects, track_class_ids = self.tracker.coast()
+        if self.stride_policy is not None:
+            self.stride_policy.observe_prediction(tracked_objects)
+
+        confidences = np.zeros(len(tracked_objects), dtype=np.float32)
+
+        with metrics.STAGE_SECONDS.time(stage="stats"):
+            self._update_tracking_stats(tracked_objects, confidences, track_class_ids)
+        metrics.LIVE_TRACKS.set(len(tracked_objects))
+        metrics.FRAMES_PROCESSED.inc(detected="false")
+
+        with metrics.STAGE_SECONDS.time(stage="annotate"):
+            return self._annotate_frame(frame, tracked_objects, track_class_ids)
 
     def _update_tracking_stats(
         self,
         tracked_objects: np.ndarray,
-        class_ids: np.ndarray,
-    ) -> Dict:
+        confidences: np.ndarray,
+        track_class_ids: np.ndarray,
+    ) -> None:
         """
         Update tracking statistics for the current frame.
         """
+        # Log positions of active tracks
+        self.track_store.append(
+            self.frame_count, tracked_objects, confidences, track_class_ids
+        )
 
-        # Update active tracks
-        current_tracks = set()
-
-        for i, track in enumerate(tracked_objects):
-            track_id = int(track[4])
-            current_tracks.add(track_id)
-
-            # Find matching detection for class information
-            if i < len(class_ids):
-                class_id = int(class_ids[i])
-                class_name = self.class_names[class_id]
-            else:
-                class_id = -1
-                class_name = "unknown"
-
+        for track_id, class_id, confidence in zip(
+            tracked_objects[:, 4].astype(int).tolist(),
+            track_class_ids.tolist(),
+            confidences.tolist(),
+        ):
             if track_id not in self.tracked_objects:
                 # New track
                 self.tracked_objects[track_id] = {
                     "first_seen": self.frame_count,
                     "last_seen": self.frame_count,
-                    "positions": [(self.frame_count, track[:4])],
                     "class_id": class_id,
-                    "class_name": class_name,
-                    "confidence": float(track[4]) if len(track) > 4 else 0,
+                    "class_name": (
+                        self.class_names[class_id] if class_id >= 0 else "unknown"
+                    ),
+                    "confidence": confidence,
                 }
             else:
                 # Update existing track
                 self.tracked_objects[track_id]["last_seen"] = self.frame_count
-                self.tracked_objects[track_id]["positions"].append(
-                    (self.frame_count, track[:4])
-                )
 
     def _annotate_frame(
-        self, frame: np.ndarray, tracked_objects: np.ndarray, class_ids: np.ndarray
+        self,
+        frame: np.ndarray,
+        tracked_objects: np.ndarray,
+        track_class_ids: np.ndarray,
     ) -> np.ndarray:
         """
         Draw bounding boxes and class on frame.
         """
-        annotated_frame = frame.copy()
-
-        for i, track in enumerate(tracked_objects):
-            bbox = track[:4].astype(int)
-            track_id = int(track[4])
-
-            class_name = (
-                self.class_names[int(class_ids[i])] if i < len(class_ids) else "unknown"
-            )
-
-            cv2.rectangle(
-                annotated_frame, (bbox[0], bbox[1]), (bbox[2], bbox[3]), (0, 255, 0), 2
-            )
-
-            label = f"ID: {track_id} | {class_name}"
-            cv2.putText(
-                annotated_frame,
-                label,
-                (bbox[0], bbox[1] - 10),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.5,
-                (0, 255, 0),
-                2,
-            )
-
-        return annotated_frame
-
-    def _calculate_track_distance(self, positions: np.ndarray) -> float:
+        if not self.annotate:
+            return frame
+        if self.box_scale is not None:
+            tracked_objects = tracked_objects.copy()
+            tracked_objects[:, :4] /= self.box_scale
+        return annotate_frame(frame, tracked_objects, track_class_ids, self.class_names)
+
+    def track_summaries(self) -> Dict[str, np.ndarray]:
         """
-        Calculate total distance traveled by tracked object.
+        Summarise the distance travelled, first/last frame and dwell time of
+        every track.
         """
-        if len(positions) < 2:
-            return 0.0
-
-        # Calculate bounding box centers
-        centers = np.column_stack(
-            [
-                (positions[:, 0] + positions[:, 2]) / 2,
-                (positions[:, 1] + positions[:, 3]) / 2,
-            ]
-        )
-
-        # Calculate total distance
-        distances = np.sqrt(np.sum(np.diff(centers, axis=0) ** 2, axis=1))
-        return float(np.sum(distances))
+        return self.track_store.summaries()
 
     def frequency_counts(self) -> Dict:
         """
@@ -185,47 +519,288 @@ class TACOTracker:
 
         return report
 
+    def analytics(self, tracks_reported: int = 0) -> dict:
+        """
+        Counts so far, in the format of process_video's results, plus the
+        tracks confirmed since the first tracks_reported tracks.
+        """
+        new_tracks = itertools.islice(
+            self.tracked_objects.items(), tracks_reported, None
+        )
+        return {
+            "Total tracked objects": len(self.tracked_objects),
+            "Class counts:": dict(self.frequency_counts()),
+            "Frames processed": self.frame_count,
+            "New tracks": [
+                {
+                    "track_id": track_id,
+                    "class_name": track_info["class_name"],
+                    "first_seen": track_info["first_seen"],
+                }
+                for track_id, track_info in new_tracks
+            ],
+        }
+
 
-def process_video(video_path: str, output_path: str) -> dict:
+def annotate_frame(
+    frame: np.ndarray,
+    tracked_objects: np.ndarray,
+    track_class_ids: np.ndarray,
+    class_names: Dict[int, str],
+) -> np.ndarray:
     """
-    Process entire video file and write annotated video to filesystem. Output statistics.
+    Draw bounding boxes and class on a copy of frame.
     """
-    # Initialize object tracking
-    tracker = TACOTracker(MODEL_PATH)
+    annotated_frame = frame.copy()
 
-    # Load video
-    cap = cv2.VideoCapture(video_path)
+    for i, track in enumerate(tracked_objects):
+        bbox = track[:4].astype(int)
+        track_id = int(track[4])
 
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
+        class_id = int(track_class_ids[i])
+        class_name = class_names[class_id] if class_id >= 0 else "unknown"
+
+        cv2.rectangle(
+            annotated_frame, (bbox[0], bbox[1]), (bbox[2], bbox[3]), (0, 255, 0), 2
+        )
+
+        label = f"ID: {track_id} | {class_name}"
+        cv2.putText(
+            annotated_frame,
+            label,
+            (bbox[0], bbox[1] - 10),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.5,
+            (0, 255, 0),
+            2,
+        )
+
+    return annotated_frame
 
-    writer = cv2.VideoWriter(
-        output_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height)
-    )
 
+def _read_frames(cap: cv2.VideoCapture) -> Iterator[np.ndarray]:
+    """
+    Yield frames from an opened video capture until it is exhausted.
+    """
     while cap.isOpened():
         ret, frame = cap.read()
         if not ret:
             break
+        yield frame
+
+
+def _batched(frames: Iterable[np.ndarray], batch_size: int) -> Iterator[List]:
+    """
+    Group frames into lists of at most batch_size frames.
+    """
+    batch = []
+    for frame in frames:
+        batch.append(frame)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def processing_settings(**tracker_options) -> dict:
+    """
+    Every setting that affects the results of process_video with the given
+    tracker options, so results of the same video can be told apart.
+    """
+    parameters = inspect.signature(TACOTracker.__init__).parameters.values()
+    defaults = {
+        parameter.name: parameter.default
+        for parameter in parameters
+        if parameter.default is not inspect.Parameter.empty
+    }
+    return {"model_path": MODEL_PATH, **defaults, **tracker_options}
+
+
+def process_video(
+    video_path: str,
+    output_path: str,
+    batch_size: int = BATCH_SIZE,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    pipelined: bool = PIPELINED,
+    analytics_callback: Optional[Callable[[dict], None]] = None,
+    analytics_interval: float = ANALYTICS_INTERVAL,
+    tracks_path: Optional[str] = None,
+    detections_path: Optional[str] = None,
+    ffmpeg_decode: bool = FFMPEG_DECODE,
+    scaled_output: bool = SCALED_OUTPUT,
+    inference_workers: int = INFERENCE_WORKERS,
+    **tracker_options,
+) -> dict:
+    """
+    Process entire video file and write annotated video to filesystem as an HLS
+    playlist at output_path. Output statistics.
+
+    Frames are run through the model batch_size at a time. progress_callback, if
+    given, is called with (frames processed, total frames) after every batch.
+    When pipelined, decoding and encoding run on their own threads alongside
+    inference; otherwise every step runs in turn on the calling thread.
+    analytics_callback, if given, is called with TACOTracker.analytics() at most
+    once every analytics_interval seconds and once more at the end, each time
+    with the tracks confirmed since the previous call. With a tracks_path, the
+    tracks of every frame are saved there for track_store.TrackLog to read.
+    With a detections_path, the detections of every frame are saved there
+    before tracking, so retrack.py can track them again with other settings.
+    With ffmpeg_decode, frames are decoded by ffmpeg into reused buffers,
+    scaled down to the inference size unless tiling or writing the annotated
+    video, which keeps the source size unless scaled_output is also given;
+    tracks and counts stay in source video coordinates either way.
+    With inference_workers, frames are decoded in another process into shared
+    memory and the model is run on them in a pool of that many worker processes
+    shared by every video, leaving only tracking, annotation and encoding to
+    this one; detection then runs on every frame and is never gated by motion.
+    tracker_options are passed on to TACOTracker.
+    """
+    if inference_workers:
+        tracker_options = {
+            **tracker_options,
+            "max_stride": 1,
+            "motion_gate_threshold": 0,
+        }
+    # Initialize object tracking, drawing boxes only if the video is written;
+    # only inference workers load the model when there are any
+    tracker = TACOTracker(
+        None if inference_workers else MODEL_PATH,
+        **{"annotate": bool(output_path), **tracker_options},
+    )
+    if detections_path:
+        tracker.detection_log = DetectionLog()
 
-        annotated_frame = tracker.process_frame(frame)
+    # Load video
+    cap = cv2.VideoCapture(video_path)
 
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    frames_total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    # Tiles are cut from full size frames, and annotations drawn on them unless
+    # the video may be written scaled down
+    if tracker.tile_size or (output_path and not scaled_output):
+        max_height, max_width = None, None
+    else:
+        max_height, max_width = INFERENCE_IMAGE_SIZE
+    # Enough buffers for the batches being read, queued either side of
+    # inference, processed and encoded at once
+    queue_size = PIPELINE_QUEUE_SIZE
+    held_batches = 2 * queue_size + 4
+
+    tracks_reported = 0
+    next_analytics = time.perf_counter() + analytics_interval
+
+    def send_analytics() -> None:
+        nonlocal tracks_reported, next_analytics
+        analytics = tracker.analytics(tracks_reported)
+        tracks_reported = analytics["Total tracked objects"]
+        next_analytics = time.perf_counter() + analytics_interval
+        analytics_callback(analytics)
+
+    def process(batch: Tuple[List[np.ndarray], Optional[list]]) -> List[np.ndarray]:
+        # Batches come with their detections if made by inference workers
+        annotated_frames = tracker.process_batch(*batch)
+        if progress_callback:
+            progress_callback(tracker.frame_count, frames_total)
+        # Updates are coalesced, so only a clock read is added per batch
+        if analytics_callback and time.perf_counter() >= next_analytics:
+            send_analytics()
+        return annotated_frames
+
+    def write(annotated_frame: np.ndarray) -> None:
         if output_path:
             writer.write(annotated_frame)
 
-    # Cleanup cv2 objects
-    cap.release()
-    if output_path:
-        writer.release()
-
+    # Released on failure from here on, whichever source replaces it
+    source = cap
+    writer = None
+    try:
+        if inference_workers:
+            cap.release()
+            source = SharedMemoryInference(
+                video_path,
+                inference_workers,
+                max(1, batch_size),
+                held_batches,
+                max_width,
+                max_height,
+                ffmpeg_decode,
+                tracker_options,
+                # At least one batch queued either side of inference
+                min_held_batches=2 * 1 + 4 if pipelined else 1,
+                max_bytes=SHM_RING_BUDGET,
+            )
+            # Buffer fewer batches between stages if the ring has room for fewer
+            queue_size = max(1, min(queue_size, (source.held_batches - 4) // 2))
+            width, height = source.width, source.height
+            tracker.box_scale = source.box_scale
+            tracker.class_names = source.class_names
+            batches = iter(source)
+        elif ffmpeg_decode:
+            cap.release()
+            source = FfmpegFrameReader(
+                video_path,
+                max_width,
+                max_height,
+                buffers=max(1, batch_size) * held_batches,
+            )
+            width, height = source.width, source.height
+            if source.scaled:
+                tracker.box_scale = source.box_scale
+            batches = ((batch, None) for batch in _batched(source, max(1, batch_size)))
+        else:
+            frames = _read_frames(cap)
+            batches = ((batch, None) for batch in _batched(frames, max(1, batch_size)))
+
+        # Encode annotated frames straight to HLS
+        writer = HlsWriter(output_path, width, height, fps) if output_path else None
+        if pipelined:
+            run_pipeline(batches, process, write, queue_size)
+        else:
+            for batch in batches:
+                for annotated_frame in process(batch):
+                    write(annotated_frame)
+    finally:
+        # Cleanup the decoder and finish the playlist
+        try:
+            source.release()
+        finally:
+            if writer is not None:
+                writer.release()
+
+    if analytics_callback:
+        send_analytics()
     report = tracker.frequency_counts()
+    if tracks_path:
+        tracker.track_store.save(
+            tracks_path,
+            frames=tracker.frame_count,
+            fps=fps,
+            class_names=tracker.class_names,
+        )
+    if detections_path:
+        tracker.detection_log.save(
+            detections_path,
+            tracker.frame_count,
+            class_names=tracker.class_names,
+            confidence_threshold=tracker.conf_threshold,
+        )
+    tracker.track_store.close()
 
-    return {
+    video_data = {
         "Total tracked objects": len(tracker.tracked_objects),
         "Class counts:": {class_name: count for class_name, count in report.items()},
         "Frames processed": tracker.frame_count,
     }
+    if tracker.stride_policy is not None:
+        video_data["Stride report"] = tracker.stride_policy.report()
+    if tracker.motion_gate is not None:
+        video_data["Motion gate report"] = tracker.motion_gate.report()
+
+    return video_data
 
 
 if __name__ == "__main__":
@@ -233,8 +808,8 @@ if __name__ == "__main__":
     # Path to input video
     VIDEO_PATH = "drone_sample.mov"
 
-    # Path to output video with annotations
-    OUTPUT_PATH = "annotations.mp4"
+    # Path to output HLS playlist with annotations
+    OUTPUT_PATH = "annotations.m3u8"
 
     report = process_video(VIDEO_PATH, OUTPUT_PATH)
 
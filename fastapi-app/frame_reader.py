@@ -0,0 +1,133 @@
+import itertools
+import subprocess
+import tempfile
+from typing import Iterator, Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+def scaled_size(
+    video_path: str, max_width: Optional[int], max_height: Optional[int]
+) -> Tuple[int, int, np.ndarray]:
+    """
+    Size of the frames of a video scaled down to fit within max_width by
+    max_height, and the factors [x,y,x,y] from their coordinates to the source
+    video's. Without max_width and max_height, frames keep their size.
+    """
+    cap = cv2.VideoCapture(video_path)
+    source_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    source_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    if source_width == 0 or source_height == 0:
+        raise RuntimeError(f"Could not open {video_path}")
+
+    scale = 1.0
+    if max_width and max_height:
+        scale = min(1.0, max_width / source_width, max_height / source_height)
+    # Even sizes, as chroma subsampled encoders require
+    width = max(2, round(source_width * scale / 2) * 2)
+    height = max(2, round(source_height * scale / 2) * 2)
+    box_scale = np.array([source_width / width, source_height / height] * 2)
+    return width, height, box_scale
+
+
+class FfmpegFrameReader:
+    """
+    Decodes a video with ffmpeg, scaled down to fit within max_width by
+    max_height, straight into a ring of preallocated BGR frame buffers.
+
+    Frames are yielded as views of the ring's buffers and no frame is ever
+    allocated or copied, so a buffer is overwritten once `buffers` more frames
+    have been read: no more than that many frames may be held at a time.
+    """
+
+    def __init__(
+        self,
+        video_path: str,
+        max_width: Optional[int],
+        max_height: Optional[int],
+        buffers: int,
+    ):
+        """
+        Without max_width and max_height, frames keep their size. With no
+        buffers, frames can only be read into buffers given to read_into.
+        """
+        # box_scale multiplies [x1,y1,x2,y2] boxes into source coordinates
+        self.width, self.height, self.box_scale = scaled_size(
+            video_path, max_width, max_height
+        )
+
+        self._ring = np.empty((buffers, self.height, self.width, 3), np.uint8)
+        self._exhausted = False
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(
+            [
+                "ffmpeg",
+                "-loglevel",
+                "error",
+                "-nostdin",
+                "-i",
+                video_path,
+                "-map",
+                "0:v:0",
+                "-vf",
+                f"scale={self.width}:{self.height}:flags=area",
+                "-fps_mode",
+                "passthrough",  # One output frame per decoded frame
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                "bgr24",
+                "pipe:1",
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=self._stderr,
+            bufsize=0,  # Read straight into the frame buffers
+        )
+
+    @property
+    def scaled(self) -> bool:
+        return bool(np.any(self.box_scale != 1))
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for i in itertools.count():
+            frame = self._ring[i % len(self._ring)]
+            if not self.read_into(frame):
+                return
+            yield frame
+
+    def read_into(self, frame: np.ndarray) -> bool:
+        """
+        Fill a contiguous frame buffer with the next frame from ffmpeg,
+        returning False at the end.
+        """
+        view = memoryview(frame).cast("B")
+        filled = 0
+        while filled < len(view):
+            n = self._process.stdout.readinto(view[filled:])
+            if not n:
+                self._exhausted = True
+                return False  # a partial frame at the end is dropped
+            filled += n
+        return True
+
+    def release(self) -> None:
+        """
+        Stop ffmpeg, raising RuntimeError if it failed before the end.
+        """
+        if self._stderr.closed:
+            return
+
+        self._process.stdout.close()
+        if not self._exhausted:
+            # Stopped reading early, so ffmpeg's exit status is of no interest
+            self._process.terminate()
+        returncode = self._process.wait()
+
+        self._stderr.seek(0)
+        message = self._stderr.read().decode(errors="replace").strip()
+        self._stderr.close()
+        if self._exhausted and returncode != 0:
+            raise RuntimeError(f"FFmpeg failed: {message}")
@@ -0,0 +1,198 @@
+import subprocess
+import tempfile
+import time
+
+import cv2
+import metrics
+import numpy as np
+
+# Segment length and number of segments kept in the playlist of live streams
+LIVE_SEGMENT_SECONDS = 2
+LIVE_PLAYLIST_SIZE = 6
+# FourCC codes of H.264 video, which is copied into segments as it is
+H264_FOURCCS = ("avc1", "h264", "H264", "x264", "X264")
+
+# Encoder settings playable by every HLS client
+_H264_ENCODER = [
+    "-c:v",
+    "libx264",
+    "-pix_fmt",
+    "yuv420p",
+    "-profile:v",
+    "baseline",
+    "-level",
+    "3.0",
+]
+_PLAYLIST = [
+    "-start_number",
+    "0",  # Start segment index at 0
+    "-hls_time",
+    "10",  # 10-second segments
+    "-hls_list_size",
+    "0",  # Keep all segments in the manifest
+    "-hls_playlist_type",
+    "event",  # Publish segments as they are written
+]
+
+
+def get_ffmpeg_command(
+    manifest_path: str, width: int, height: int, fps: float, live: bool = False
+) -> list[str]:
+    """
+    Build the ffmpeg command encoding raw BGR frames from stdin into HLS.
+
+    Live streams are timed by when frames arrive, repeating frames to keep a
+    constant frame rate when some are dropped, and are published as a rolling
+    playlist of short segments whose old segments are deleted.
+    """
+    if live:
+        input_timing = ["-use_wallclock_as_timestamps", "1"]
+        output_timing = [
+            "-fps_mode",
+            "cfr",
+            "-r",
+            str(fps),
+            "-force_key_frames",
+            f"expr:gte(t,n_forced*{LIVE_SEGMENT_SECONDS})",  # Cut segments on time
+        ]
+        playlist = [
+            "-start_number",
+            "0",
+            "-hls_time",
+            str(LIVE_SEGMENT_SECONDS),
+            "-hls_list_size",
+            str(LIVE_PLAYLIST_SIZE),  # Keep only the latest segments
+            "-hls_flags",
+            "delete_segments",  # Delete segments that left the playlist
+        ]
+    else:
+        input_timing = ["-r", str(fps)]
+        output_timing = []
+        playlist = _PLAYLIST
+
+    return [
+        "ffmpeg",
+        "-loglevel",
+        "error",
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "bgr24",
+        "-s",
+        f"{width}x{height}",
+        *input_timing,
+        "-i",
+        "pipe:0",
+        *output_timing,
+        *_H264_ENCODER,
+        *playlist,
+        "-f",
+        "hls",
+        manifest_path,
+    ]
+
+
+def segment_video(video_path: str, manifest_path: str) -> None:
+    """
+    Split a video file into an HLS playlist and segments without changing its
+    frames. H.264 video is remuxed without re-encoding; other codecs are
+    encoded once, as frames would otherwise be.
+
+    Raises RuntimeError if ffmpeg fails.
+    """
+    cap = cv2.VideoCapture(video_path)
+    fourcc = int(cap.get(cv2.CAP_PROP_FOURCC)).to_bytes(4, "little")
+    cap.release()
+    if fourcc.decode(errors="replace") in H264_FOURCCS:
+        video_codec = ["-c:v", "copy"]
+    else:
+        video_codec = _H264_ENCODER
+
+    start_time = time.perf_counter()
+    process = subprocess.run(
+        [
+            "ffmpeg",
+            "-loglevel",
+            "error",
+            "-i",
+            video_path,
+            "-map",
+            "0:v:0",
+            *video_codec,
+            *_PLAYLIST,
+            "-f",
+            "hls",
+            manifest_path,
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    metrics.FFMPEG_SECONDS.observe(time.perf_counter() - start_time)
+    if process.returncode != 0:
+        message = process.stderr.decode(errors="replace").strip()
+        raise RuntimeError(f"FFmpeg failed: {message}")
+
+
+class HlsWriter:
+    """
+    Encodes frames straight into an HLS playlist and segments with one ffmpeg
+    process. Segments are listed in the playlist as soon as they are written, so
+    the video can be streamed while later frames are still being produced.
+
+    Mirrors the write/release interface of cv2.VideoWriter.
+    """
+
+    def __init__(
+        self,
+        manifest_path: str,
+        width: int,
+        height: int,
+        fps: float,
+        live: bool = False,
+    ):
+        self._frame_shape = (height, width, 3)
+        self._stderr = tempfile.TemporaryFile()
+        self._start_time = time.perf_counter()
+        self._process = subprocess.Popen(
+            get_ffmpeg_command(manifest_path, width, height, fps, live),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=self._stderr,
+        )
+
+    def write(self, frame: np.ndarray) -> None:
+        """
+        Send one BGR frame to ffmpeg.
+        """
+        if frame.shape != self._frame_shape:
+            raise ValueError(
+                f"Expected frame of shape {self._frame_shape}, got {frame.shape}"
+            )
+        try:
+            self._process.stdin.write(np.ascontiguousarray(frame).data)
+            metrics.FFMPEG_BYTES.inc(frame.nbytes)
+        except BrokenPipeError:
+            self.release()
+
+    def release(self) -> None:
+        """
+        Finish the playlist and wait for ffmpeg to exit.
+
+        Raises RuntimeError if ffmpeg failed.
+        """
+        if self._stderr.closed:
+            return
+
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self._process.wait()
+        metrics.FFMPEG_SECONDS.observe(time.perf_counter() - self._start_time)
+
+        self._stderr.seek(0)
+        message = self._stderr.read().decode(errors="replace").strip()
+        self._stderr.close()
+        if returncode != 0:
+            raise RuntimeError(f"FFmpeg failed: {message}")
@@ -0,0 +1,115 @@
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+@dataclass
+class Job:
+    id: str
+    status: str = "queued"  # queued, running, done or failed
+    frames_done: int = 0
+    frames_total: int = 0
+    video_uuid: Optional[str] = None
+    error: Optional[str] = None
+    # Analytics sent while the video was processed, oldest first
+    analytics: List[dict] = field(default_factory=list, repr=False)
+
+    def set_progress(self, frames_done: int, frames_total: int) -> None:
+        """
+        Record how many frames of the video have been processed.
+        """
+        self.frames_done = frames_done
+        self.frames_total = max(frames_total, frames_done)
+
+    def add_analytics(self, analytics: dict) -> None:
+        """
+        Record an update of the counts and tracks found so far.
+        """
+        self.analytics.append(analytics)
+
+    def is_finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def to_dict(self) -> dict:
+        """
+        The status of the job, without its analytics.
+        """
+        return {
+            name: value for name, value in vars(self).items() if name != "analytics"
+        }
+
+
+class JobManager:
+    """
+    Runs video processing jobs on a bounded pool of background threads.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, max_history: int = 1000):
+        """
+        max_pending bounds the number of queued and running jobs together;
+        max_history bounds how many finished jobs are remembered.
+        """
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="flyby-job"
+        )
+        self._max_pending = max_pending
+        self._max_history = max_history
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, work: Callable[..., str], *args) -> Job:
+        """
+        Queue work(job, *args), which returns the video_uuid of the result.
+
+        Raises JobQueueFull when max_pending jobs are already queued or running.
+        """
+        with self._lock:
+            if self.pending_count() >= self._max_pending:
+                raise JobQueueFull()
+
+            job = Job(id=str(uuid.uuid4()))
+            self._jobs[job.id] = job
+            self._forget_finished_jobs()
+
+        self._executor.submit(self._run, job, work, args)
+        return job
+
+    def add_done(self, video_uuid: str) -> Job:
+        """
+        Record a job that finished without running, for results that exist.
+        """
+        with self._lock:
+            job = Job(id=str(uuid.uuid4()), status="done", video_uuid=video_uuid)
+            self._jobs[job.id] = job
+            self._forget_finished_jobs()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def pending_count(self) -> int:
+        """
+        Number of jobs that are queued or running.
+        """
+        return sum(job.status in ("queued", "running") for job in self._jobs.values())
+
+    def _run(self, job: Job, work: Callable[..., str], args: tuple) -> None:
+        job.status = "running"
+        try:
+            job.video_uuid = work(job, *args)
+            job.status = "done"
+        except Exception as error:
+            job.error = str(error)
+            job.status = "failed"
+
+    def _forget_finished_jobs(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.is_finished()]
+        for job_id in finished[: max(0, len(self._jobs) - self._max_history)]:
+            del self._jobs[job_id]
@@ -0,0 +1,265 @@
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Optional
+from urllib.parse import urlsplit
+
+import cv2
+
+import detector
+from hls import HlsWriter
+
+# Seconds between updates of a live stream's data file
+LIVE_DATA_INTERVAL = 2.0
+# Seconds to wait for the first frame of a stream before giving up
+LIVE_CONNECT_TIMEOUT = 30.0
+# Seconds without a frame after which a stream is considered ended
+LIVE_READ_TIMEOUT = 10.0
+# URL schemes of the network streams accepted as sources; anything else ffmpeg
+# can open, such as local files or its concat: and subfile: protocols, is not
+LIVE_URL_SCHEMES = ("rtsp", "rtsps", "rtmp", "rtmps", "srt", "udp", "http", "https")
+# Schemes only accepted from LIVE_ALLOWED_HOSTS, as ffmpeg follows redirects
+# from any host to internal ones
+LIVE_ALLOWLIST_ONLY_SCHEMES = ("http", "https")
+# Comma separated hosts streams may come from even if they are not public
+# addresses, and the only hosts HTTP streams may come from
+LIVE_ALLOWED_HOSTS = frozenset(
+    host.strip().lower()
+    for host in os.environ.get("FLYBY_LIVE_ALLOWED_HOSTS", "").split(",")
+    if host.strip()
+)
+
+
+def check_source_url(source_url: str) -> None:
+    """
+    Raise ValueError unless source_url is a network stream URL of one of
+    LIVE_URL_SCHEMES on a host in LIVE_ALLOWED_HOSTS or resolving only to
+    public addresses, so streams cannot be used to reach the server's own or
+    internal services, such as cloud metadata endpoints.
+    """
+    parts = urlsplit(source_url)
+    scheme = parts.scheme.lower()
+    if scheme not in LIVE_URL_SCHEMES or not parts.hostname:
+        raise ValueError(
+            f"Expected a stream URL starting with one of "
+            f"{', '.join(s + '://' for s in LIVE_URL_SCHEMES)}"
+        )
+    if parts.hostname in LIVE_ALLOWED_HOSTS:
+        return
+    if scheme in LIVE_ALLOWLIST_ONLY_SCHEMES:
+        raise ValueError(
+            f"Streams over {scheme} are only allowed from FLYBY_LIVE_ALLOWED_HOSTS"
+        )
+
+    try:
+        addresses = {
+            info[4][0] for info in socket.getaddrinfo(parts.hostname, parts.port)
+        }
+    except (OSError, ValueError) as error:
+        raise ValueError(f"Could not resolve {parts.hostname}: {error}") from error
+    for address in addresses:
+        # Drop any IPv6 zone, as in fe80::1%eth0
+        if not ipaddress.ip_address(address.split("%")[0]).is_global:
+            raise ValueError(f"Streams from {parts.hostname} are not allowed")
+
+
+class LiveSession:
+    """
+    Tracks objects in a continuous video stream, publishing the annotated video
+    as a rolling HLS playlist and its counts as a JSON file while it runs.
+
+    One thread reads frames from the stream as fast as they arrive and keeps
+    only the newest; another runs the tracker on the newest frame whenever it
+    is free. Frames that arrive while the tracker is busy are dropped, so
+    latency stays within one frame's processing time instead of building up a
+    backlog. The playlist repeats frames to fill the gaps.
+    """
+
+    def __init__(
+        self,
+        source_url: str,
+        manifest_path: str,
+        data_path: Optional[str] = None,
+        **tracker_options,
+    ):
+        """
+        source_url is a network stream URL accepted by check_source_url, such as
+        a public RTSP, RTMP or UDP URL, or ValueError is raised.
+        tracker_options are passed on to TACOTracker.
+        """
+        check_source_url(source_url)
+        self.id = str(uuid.uuid4())
+        self.source_url = source_url
+        self.manifest_path = manifest_path
+        self.data_path = data_path
+        self.status = "connecting"  # connecting, live, finished, stopped or failed
+        self.error = None
+
+        self._tracker = detector.TACOTracker(detector.MODEL_PATH, **tracker_options)
+        self._tracker_lock = threading.Lock()
+        self._latest = None  # newest frame read and the time it arrived
+        self._fps = None
+        self._frame_ready = threading.Condition()
+        self._stop = threading.Event()
+        self._frames_read = 0
+        self._frames_dropped = 0
+        self._latency = 0.0
+        self._started = None
+        self._threads = [
+            threading.Thread(target=self._read, name="flyby-live-read", daemon=True),
+            threading.Thread(target=self._track, name="flyby-live-track", daemon=True),
+        ]
+
+    def start(self) -> None:
+        self._started = time.time()
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Stop reading the stream and finish the playlist.
+        """
+        if self.status in ("connecting", "live"):
+            self.status = "stopped"
+        self._stop.set()
+        with self._frame_ready:
+            self._frame_ready.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def is_running(self) -> bool:
+        return any(thread.is_alive() for thread in self._threads)
+
+    def summary(self) -> dict:
+        """
+        Counts so far, in the format of process_video's results, plus the state
+        of the stream.
+        """
+        with self._tracker_lock:
+            report = self._tracker.frequency_counts()
+            total_tracked = len(self._tracker.tracked_objects)
+            frames_processed = self._tracker.frame_count
+        elapsed = time.time() - self._started if self._started else 0.0
+        return {
+            "Total tracked objects": total_tracked,
+            "Class counts:": dict(report),
+            "Frames processed": frames_processed,
+            "Live": {
+                "id": self.id,
+                "status": self.status,
+                "error": self.error,
+                "frames_read": self._frames_read,
+                "frames_dropped": self._frames_dropped,
+                "processing_fps": frames_processed / elapsed if elapsed else 0.0,
+                "latency_seconds": self._latency,
+            },
+        }
+
+    def _read(self) -> None:
+        """
+        Read frames as they arrive, replacing any frame not yet tracked.
+        """
+        cap = cv2.VideoCapture(
+            self.source_url,
+            cv2.CAP_FFMPEG,
+            [
+                cv2.CAP_PROP_OPEN_TIMEOUT_MSEC,
+                int(LIVE_CONNECT_TIMEOUT * 1000),
+                cv2.CAP_PROP_READ_TIMEOUT_MSEC,
+                int(LIVE_READ_TIMEOUT * 1000),
+            ],
+        )
+        self._fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        try:
+            while not self._stop.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                with self._frame_ready:
+                    if self._latest is not None:
+                        self._frames_dropped += 1
+                    self._latest = (frame, time.perf_counter())
+                    self._frames_read += 1
+                    self._frame_ready.notify()
+        except Exception as error:
+            self._fail(error)
+        finally:
+            cap.release()
+            # The stream ended or failed; let the tracking thread finish
+            self._stop.set()
+            with self._frame_ready:
+                self._frame_ready.notify_all()
+
+    def _next_frame(self, timeout: float) -> Optional[tuple]:
+        with self._frame_ready:
+            self._frame_ready.wait_for(
+                lambda: self._latest is not None or self._stop.is_set(), timeout
+            )
+            latest, self._latest = self._latest, None
+        return latest
+
+    def _track(self) -> None:
+        """
+        Track the newest frame whenever the previous one is done.
+        """
+        writer = None
+        next_data_write = 0.0
+        try:
+            latest = self._next_frame(LIVE_CONNECT_TIMEOUT)
+            if latest is None:
+                if self.status == "connecting":
+                    raise RuntimeError(f"No frames received from {self.source_url}")
+                return
+
+            height, width = latest[0].shape[:2]
+            writer = HlsWriter(self.manifest_path, width, height, self._fps, live=True)
+            self.status = "live"
+
+            while not self._stop.is_set():
+                if latest is not None:
+                    frame, arrived = latest
+                    with self._tracker_lock:
+                        annotated_frame = self._tracker.process_frame(frame)
+                    writer.write(annotated_frame)
+                    self._latency = time.perf_counter() - arrived
+
+                # Keep the data file fresh even while the stream stalls
+                if time.perf_counter() >= next_data_write:
+                    self._write_data()
+                    next_data_write = time.perf_counter() + LIVE_DATA_INTERVAL
+                latest = self._next_frame(LIVE_DATA_INTERVAL)
+
+            if self.status == "live":
+                self.status = "finished"
+        except Exception as error:
+            self._fail(error)
+        finally:
+            self._stop.set()
+            try:
+                if writer is not None:
+                    writer.release()
+            except RuntimeError as error:
+                self._fail(error)
+            self._tracker.track_store.close()
+            self._write_data()
+
+    def _fail(self, error: Exception) -> None:
+        if self.status not in ("failed", "stopped"):
+            self.status = "failed"
+            self.error = str(error)
+
+    def _write_data(self) -> None:
+        """
+        Replace the data file with the current summary in one step, so readers
+        never see a partly written file.
+        """
+        if self.data_path is None:
+            return
+        temp_path = f"{self.data_path}.tmp"
+        with open(temp_path, "w") as data_file:
+            json.dump(self.summary(), data_file)
+        os.replace(temp_path, self.data_path)
@@ -1,28 +1,85 @@
+import asyncio
 import json
 import os
 import re
 import shutil
-import subprocess
+import threading
+import time
 import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
 
+import cache
+import chunked
 import detector
-from fastapi import FastAPI, HTTPException, UploadFile
+import jobs
+import live
+import hls
+import metrics
+import overlay
+import retrack
+import uploads
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from pydantic import BaseModel
+from starlette.requests import ClientDisconnect
+from track_store import TrackLog
 
 _UPLOADS_DIR = os.path.abspath("temp-uploads")
-_ANALYZED_DIR = os.path.abspath("temp-analyzed")
 _STATIC_DIR = os.path.abspath("static")
 _HLS_DIR = os.path.join(_STATIC_DIR, "hls")
 _DATA_DIR = os.path.join(_STATIC_DIR, "data")
 _VIDEO_MANIFEST_NAME = "playlist.m3u8"
+# Directory next to a video's segments holding the tracks of every frame
+_VIDEO_TRACKS_NAME = "tracks"
+# File next to a video's segments holding the detections of every frame
+_VIDEO_DETECTIONS_NAME = "detections.npz"
+# File next to a video's segments holding the boxes to draw over it
+_VIDEO_OVERLAY_NAME = "overlay.json"
+# Relative segment paths in a manifest, rewritten to be served from /stream/hls
+_VIDEO_SEGMENT_REGEX = re.compile(r"(.*.ts)\n")
+# Bytes a form upload may exceed the largest video by, for its boundaries and
+# other fields
+_MAX_FORM_OVERHEAD = 64 * 1024
+# Largest video accepted, whether uploaded at once or in parts
+_MAX_UPLOAD_BYTES = int(os.environ.get("FLYBY_MAX_UPLOAD_MB", "4096")) * 1024 * 1024
+# Seconds an upload in parts is kept without receiving a part before it is
+# discarded
+_UPLOAD_MAX_IDLE = float(os.environ.get("FLYBY_UPLOAD_MAX_IDLE_HOURS", "24")) * 3600
+
+# Serve videos untouched with their boxes as data for the client to draw,
+# instead of drawing the boxes into the video
+_OVERLAY_MODE = os.environ.get("FLYBY_OVERLAY", "0") == "1"
+# Number of videos processed at the same time
+_MAX_WORKERS = int(os.environ.get("FLYBY_MAX_WORKERS", "2"))
+# Number of videos allowed to be queued or processing before uploads are rejected
+_MAX_PENDING_JOBS = int(os.environ.get("FLYBY_MAX_PENDING_JOBS", "8"))
+# Number of live streams tracked at the same time
+_MAX_LIVE_SESSIONS = int(os.environ.get("FLYBY_MAX_LIVE_SESSIONS", "2"))
+# Most rows of the track log returned by one query
+_MAX_TRACK_ROWS = int(os.environ.get("FLYBY_MAX_TRACK_ROWS", "100000"))
+# Most tracker parameter sets compared by one retrack request
+_MAX_RETRACK_PARAMETER_SETS = 64
+# Seconds after which an idle event stream is sent a comment to keep it open
+_EVENTS_KEEPALIVE_SECONDS = 15.0
+# Size and idle time after which processed videos are evicted from static/
+_CACHE_MAX_BYTES = int(os.environ.get("FLYBY_CACHE_MAX_MB", "2048")) * 1024 * 1024
+_CACHE_MAX_AGE = float(os.environ.get("FLYBY_CACHE_MAX_AGE_HOURS", "168")) * 3600
+# Bytes of manifests and data of finished videos kept in memory
+_RESPONSE_CACHE_BYTES = (
+    int(os.environ.get("FLYBY_RESPONSE_CACHE_MB", "64")) * 1024 * 1024
+)
+# Manifests and data of finished videos never change; segments never change
+# once listed in a manifest
+_FINISHED_CACHE_CONTROL = "public, max-age=86400"
+_SEGMENT_CACHE_CONTROL = "public, max-age=31536000, immutable"
 
 # Clean temporary storage
 shutil.rmtree(_UPLOADS_DIR, ignore_errors=True)
 os.makedirs(_UPLOADS_DIR, exist_ok=True)
-shutil.rmtree(_ANALYZED_DIR, ignore_errors=True)
-os.makedirs(_ANALYZED_DIR, exist_ok=True)
 shutil.rmtree(_STATIC_DIR, ignore_errors=True)
 os.makedirs(_STATIC_DIR, exist_ok=True)
 shutil.rmtree(_HLS_DIR, ignore_errors=True)
@@ -31,37 +88,87 @@ shutil.rmtree(_DATA_DIR, ignore_errors=True)
 os.makedirs(_DATA_DIR, exist_ok=True)
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load and warm up the model in the background so the API comes online
+    # immediately; /ready reports when it is done
+    threading.Thread(
+        target=detector.model_registry.warm_up,
+        args=([detector.MODEL_PATH],),
+        daemon=True,
+    ).start()
+    yield
+
+    # Finish the playlists of streams still live
+    for session, _ in list(live_sessions.values()):
+        session.stop(timeout=live.LIVE_READ_TIMEOUT)
+
+
+class SegmentFiles(StaticFiles):
+    """Static files that let clients cache HLS segments for good."""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if str(full_path).endswith(".ts"):
+            response.headers["Cache-Control"] = _SEGMENT_CACHE_CONTROL
+        return response
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
-    allow_methods=["GET", "POST"],
+    allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["*"],
 )
 # Make HLS video segments publicly accessible at /stream/hls
-app.mount("/stream/hls", StaticFiles(directory=_HLS_DIR), name="hls")
-
-
-def _get_ffmpeg_command(input_path: str, output_manifest_path: str) -> list[str]:
-    return [
-        "ffmpeg",
-        "-i",
-        input_path,
-        "-profile:v",
-        "baseline",
-        "-level",
-        "3.0",
-        "-start_number",
-        "0",  # Start segment index at 0
-        "-hls_time",
-        "10",  # 10-second segments
-        "-hls_list_size",
-        "0",  # Keep all segments in the manifest
-        "-f",
-        "hls",
-        output_manifest_path,
+app.mount("/stream/hls", SegmentFiles(directory=_HLS_DIR), name="hls")
+
+job_manager = jobs.JobManager(_MAX_WORKERS, _MAX_PENDING_JOBS)
+metrics.JOB_QUEUE_DEPTH.set_function(job_manager.pending_count)
+
+
+def _delete_results(video_uuid: str) -> None:
+    """Delete the HLS segments and data of a processed video."""
+    shutil.rmtree(os.path.join(_HLS_DIR, video_uuid), ignore_errors=True)
+    response_cache.discard(("manifest", video_uuid))
+    response_cache.discard(("data", video_uuid))
+    response_cache.discard(("overlay", video_uuid))
+    try:
+        os.remove(os.path.join(_DATA_DIR, f"{video_uuid}.json"))
+    except FileNotFoundError:
+        pass
+
+
+def _results_size(video_uuid: str) -> int:
+    """Bytes taken by the HLS segments, tracks and data of a processed video."""
+    paths = [
+        os.path.join(directory, name)
+        for directory, _, names in os.walk(os.path.join(_HLS_DIR, video_uuid))
+        for name in names
     ]
+    paths.append(os.path.join(_DATA_DIR, f"{video_uuid}.json"))
+    return sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+
+
+# Results of previously uploaded videos by content hash and settings, and the
+# jobs processing videos that are not cached yet
+result_cache = cache.ResultCache(_CACHE_MAX_BYTES, _CACHE_MAX_AGE, _delete_results)
+metrics.RESULT_CACHE_BYTES.set_function(lambda: result_cache.size_bytes)
+_jobs_in_progress: dict[str, jobs.Job] = {}
+_jobs_in_progress_lock = threading.Lock()
+
+# Live streams by id, with the video_uuid their results are published under
+live_sessions: dict[str, tuple[live.LiveSession, str]] = {}
+_live_sessions_lock = threading.Lock()
+
+# Videos being uploaded in parts by upload_id
+partial_uploads: dict[str, uploads.PartialUpload] = {}
+_partial_uploads_lock = threading.Lock()
+
+# Rewritten manifests and data of finished videos by kind and video_uuid
+response_cache = cache.ResponseCache(_RESPONSE_CACHE_BYTES)
 
 
 @app.get("/health")
@@ -70,94 +177,626 @@ def health_check() -> dict[str, str]:
     return {"status": "online", "message": "API is running"}
 
 
+@app.get("/ready")
+def readiness_check() -> dict[str, str]:
+    """Verify the detection model is loaded and warmed up."""
+    if not detector.model_registry.is_ready():
+        detail = detector.model_registry.warm_up_error or "Model is warming up"
+        raise HTTPException(status_code=503, detail=detail)
+    return {"status": "ready", "message": "Model is warmed up"}
+
+
+@app.get("/metrics")
+def get_metrics() -> PlainTextResponse:
+    """Expose processing metrics in the Prometheus text format."""
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.post("/upload")
-def upload_process_video(file: UploadFile) -> dict[str, str]:
-    # Save uploaded video to storage
-    temp_video_path = os.path.join(_UPLOADS_DIR, file.filename)
-    with open(temp_video_path, "wb") as buf:
-        buf.write(file.file.read())
+async def upload_process_video(request: Request) -> dict[str, str]:
+    """
+    Queue the video sent as the file field of a multipart form for analysis.
+    """
+    # Turn away bodies declared too large before receiving any of them
+    content_length = int(request.headers.get("content-length") or 0)
+    if content_length > _MAX_UPLOAD_BYTES + _MAX_FORM_OVERHEAD:
+        raise HTTPException(
+            status_code=413, detail=f"Uploads are limited to {_MAX_UPLOAD_BYTES} bytes"
+        )
 
-    # Analyze video for garbage
-    temp_analyzed_video_path = os.path.join(_ANALYZED_DIR, file.filename)
-    video_garbage_data = detector.process_video(
-        temp_video_path, temp_analyzed_video_path
+    # Stream the video straight to storage under a unique name as it arrives,
+    # hashing it on the way, so identical uploads never share a temporary file
+    # and the size limit applies before the body is stored
+    try:
+        parser = uploads.FormFileParser(
+            request.headers.get("content-type", ""),
+            "file",
+            _UPLOADS_DIR,
+            _MAX_UPLOAD_BYTES,
+        )
+    except uploads.InvalidForm as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    try:
+        with metrics.UPLOAD_STEP_SECONDS.time(step="save"):
+            async for chunk in request.stream():
+                await run_in_threadpool(parser.write, chunk)
+            upload = parser.finish()
+    except uploads.UploadTooLarge as error:
+        parser.discard()
+        raise HTTPException(status_code=413, detail=str(error))
+    except uploads.InvalidForm as error:
+        parser.discard()
+        raise HTTPException(status_code=400, detail=str(error))
+    except BaseException:
+        parser.discard()
+        raise
+    return await run_in_threadpool(_submit_upload, upload.path, upload.close())
+
+
+@app.post("/uploads")
+def create_upload(filename: str = "", size: Optional[int] = None) -> dict:
+    """
+    Start uploading a video in parts, of size bytes in total if given. Parts
+    are sent in order to PUT /uploads/{upload_id}.
+    """
+    _discard_idle_uploads()
+    upload_id = uuid.uuid4().hex
+    extension = os.path.splitext(filename)[1]
+    try:
+        upload = uploads.PartialUpload(
+            os.path.join(_UPLOADS_DIR, f"{upload_id}{extension}"),
+            _MAX_UPLOAD_BYTES,
+            size,
+        )
+    except uploads.UploadTooLarge as error:
+        raise HTTPException(status_code=413, detail=str(error))
+    with _partial_uploads_lock:
+        partial_uploads[upload_id] = upload
+    return {"upload_id": upload_id, "offset": 0, "max_bytes": _MAX_UPLOAD_BYTES}
+
+
+@app.get("/uploads/{upload_id}")
+def get_upload(upload_id: str) -> dict:
+    """
+    Bytes received so far, where an interrupted upload resumes from.
+    """
+    upload = _get_partial_upload(upload_id)
+    return {"upload_id": upload_id, "offset": upload.offset, "size": upload.size}
+
+
+@app.put("/uploads/{upload_id}")
+async def upload_part(upload_id: str, request: Request, offset: int) -> dict:
+    """
+    Append the request body to an upload, streaming it to disk. offset must be
+    the number of bytes received so far; a part cut off midway keeps what was
+    received, so the upload resumes from the offset GET /uploads/{upload_id}
+    reports.
+    """
+    upload = _get_partial_upload(upload_id)
+    # Turn away parts declared too large before receiving any of them
+    content_length = int(request.headers.get("content-length") or 0)
+    if offset + content_length > (upload.size or _MAX_UPLOAD_BYTES):
+        raise HTTPException(
+            status_code=413, detail=f"Uploads are limited to {_MAX_UPLOAD_BYTES} bytes"
+        )
+
+    try:
+        with metrics.UPLOAD_STEP_SECONDS.time(step="part"):
+            with upload.receiving_part(offset):
+                async for chunk in request.stream():
+                    await run_in_threadpool(upload.write, chunk)
+    except uploads.UploadConflict as error:
+        raise HTTPException(status_code=409, detail=str(error))
+    except uploads.UploadTooLarge as error:
+        _discard_upload(upload_id)
+        raise HTTPException(status_code=413, detail=str(error))
+    except ClientDisconnect:
+        pass  # Keep what was received for the client to resume from
+    return {"upload_id": upload_id, "offset": upload.offset}
+
+
+@app.post("/uploads/{upload_id}/complete")
+def complete_upload(upload_id: str) -> dict[str, str]:
+    """
+    Finish an upload in parts and queue the video for analysis like /upload.
+    """
+    upload = _get_partial_upload(upload_id)
+    if upload.size is not None and upload.offset != upload.size:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Upload is at offset {upload.offset} of {upload.size}",
+        )
+    try:
+        content_hash = upload.close()
+    except uploads.UploadConflict as error:
+        raise HTTPException(status_code=409, detail=str(error))
+    with _partial_uploads_lock:
+        partial_uploads.pop(upload_id, None)
+    return _submit_upload(upload.path, content_hash)
+
+
+@app.delete("/uploads/{upload_id}")
+def abort_upload(upload_id: str) -> dict[str, str]:
+    """
+    Abandon an upload in parts, deleting what was received.
+    """
+    _get_partial_upload(upload_id)
+    try:
+        _discard_upload(upload_id)
+    except uploads.UploadConflict as error:
+        raise HTTPException(status_code=409, detail=str(error))
+    return {"upload_id": upload_id}
+
+
+def _get_partial_upload(upload_id: str) -> uploads.PartialUpload:
+    with _partial_uploads_lock:
+        upload = partial_uploads.get(upload_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+
+def _discard_upload(upload_id: str) -> None:
+    """Delete an upload in parts, raising UploadConflict while a part is received."""
+    with _partial_uploads_lock:
+        upload = partial_uploads.get(upload_id)
+        if upload is None:
+            return
+        upload.remove()
+        del partial_uploads[upload_id]
+
+
+def _discard_idle_uploads() -> None:
+    """Delete uploads in parts that have not received a part for too long."""
+    with _partial_uploads_lock:
+        idle = [
+            upload_id
+            for upload_id, upload in partial_uploads.items()
+            if upload.idle_seconds > _UPLOAD_MAX_IDLE
+        ]
+    for upload_id in idle:
+        try:
+            _discard_upload(upload_id)
+        except uploads.UploadConflict:
+            pass  # Resumed since
+
+
+def _submit_upload(temp_video_path: str, content_hash: str) -> dict[str, str]:
+    """Queue a saved upload for analysis, unless its results are cached."""
+    cache_key = _result_cache_key(content_hash)
+
+    with _jobs_in_progress_lock:
+        # Reuse the results of an identical upload processed the same way
+        video_uuid = result_cache.get(cache_key)
+        if video_uuid is not None:
+            metrics.RESULT_CACHE_LOOKUPS.inc(result="hit")
+            os.remove(temp_video_path)
+            return {"job_id": job_manager.add_done(video_uuid).id}
+
+        job = _jobs_in_progress.get(cache_key)
+        if job is not None:
+            metrics.RESULT_CACHE_LOOKUPS.inc(result="in_progress")
+            os.remove(temp_video_path)
+            return {"job_id": job.id}
+
+        # Queue video for analysis
+        metrics.RESULT_CACHE_LOOKUPS.inc(result="miss")
+        try:
+            job = job_manager.submit(
+                _process_uploaded_video, temp_video_path, cache_key
+            )
+        except jobs.JobQueueFull:
+            os.remove(temp_video_path)
+            raise HTTPException(status_code=429, detail="Too many videos processing")
+        _jobs_in_progress[cache_key] = job
+
+    return {"job_id": job.id}
+
+
+@app.get("/jobs/{job_id}")
+def get_job_status(job_id: str) -> dict[str, str | int | None]:
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}/events")
+def get_job_events(
+    job_id: str, last_event_id: Optional[str] = Header(None)
+) -> StreamingResponse:
+    """
+    Stream the progress and analytics of a job as server-sent events, ending
+    with a done or failed event once it finishes.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    # Analytics events are numbered, so a reconnecting client resumes after
+    # the last one it received
+    analytics_sent = int(last_event_id) + 1 if (last_event_id or "").isdigit() else 0
+    return StreamingResponse(
+        _job_events(job, analytics_sent),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    os.remove(temp_video_path)
-    if not os.path.exists(temp_analyzed_video_path):
-        raise HTTPException(status_code=500, detail="Failed to analyze video")
 
-    # Generate unique identifier for video
-    video_uuid = str(uuid.uuid4())
 
-    # Save video garbage data to storage
-    video_garbage_data_path = os.path.join(_DATA_DIR, f"{video_uuid}.json")
-    with open(video_garbage_data_path, "w") as data_file:
-        json.dump(video_garbage_data, data_file)
+async def _job_events(job: jobs.Job, analytics_sent: int) -> AsyncIterator[str]:
+    """
+    Poll a job for changes at the analytics interval, so fast progress updates
+    are coalesced and no thread is held while waiting.
+    """
+    progress_sent = None
+    last_sent = time.monotonic()
+    while True:
+        # Check before reading, so updates made just before finishing are sent
+        finished = job.is_finished()
+        events = []
+
+        progress = {"frames_done": job.frames_done, "frames_total": job.frames_total}
+        if progress != progress_sent:
+            events.append(_server_sent_event("progress", progress))
+            progress_sent = progress
+
+        for analytics in job.analytics[analytics_sent:]:
+            events.append(_server_sent_event("analytics", analytics, analytics_sent))
+            analytics_sent += 1
+
+        if finished:
+            events.append(_server_sent_event(job.status, job.to_dict()))
+        elif not events and time.monotonic() - last_sent >= _EVENTS_KEEPALIVE_SECONDS:
+            events.append(": keepalive\n\n")
+
+        if events:
+            yield "".join(events)
+            last_sent = time.monotonic()
+        if finished:
+            return
+        await asyncio.sleep(detector.ANALYTICS_INTERVAL)
+
+
+def _server_sent_event(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    lines = [f"event: {event}", f"data: {json.dumps(data)}"]
+    if event_id is not None:
+        lines.insert(0, f"id: {event_id}")
+    return "\n".join(lines) + "\n\n"
+
+
+class LiveStreamRequest(BaseModel):
+    url: str
+
+
+@app.post("/live")
+def start_live_stream(request: LiveStreamRequest) -> dict[str, str]:
+    """Start tracking a live stream, such as an RTSP, RTMP or UDP URL."""
+    try:
+        live.check_source_url(request.url)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+    with _live_sessions_lock:
+        # Forget streams that ended, with their trackers; their segments and
+        # data stay published under their video_uuid
+        for live_id, (session, _) in list(live_sessions.items()):
+            if not session.is_running():
+                del live_sessions[live_id]
+        if len(live_sessions) >= _MAX_LIVE_SESSIONS:
+            raise HTTPException(status_code=429, detail="Too many live streams")
+
+        # Publish the stream like an uploaded video, so /stream and /data work
+        video_uuid = str(uuid.uuid4())
+        video_dir = os.path.join(_HLS_DIR, video_uuid)
+        os.makedirs(video_dir, exist_ok=True)
+        session = live.LiveSession(
+            request.url,
+            os.path.join(video_dir, _VIDEO_MANIFEST_NAME),
+            os.path.join(_DATA_DIR, f"{video_uuid}.json"),
+        )
+        live_sessions[session.id] = (session, video_uuid)
+        session.start()
+
+    return {"live_id": session.id, "video_uuid": video_uuid}
+
+
+@app.get("/live/{live_id}")
+def get_live_stream(live_id: str) -> dict:
+    with _live_sessions_lock:
+        if live_id not in live_sessions:
+            raise HTTPException(status_code=404, detail="Live stream not found")
+        session, video_uuid = live_sessions[live_id]
+    return {"video_uuid": video_uuid, **session.summary()}
+
+
+@app.delete("/live/{live_id}")
+def stop_live_stream(live_id: str) -> dict:
+    """Stop tracking a live stream; its last segments and data are kept."""
+    with _live_sessions_lock:
+        if live_id not in live_sessions:
+            raise HTTPException(status_code=404, detail="Live stream not found")
+        session, video_uuid = live_sessions.pop(live_id)
+    session.stop()
+    return {"video_uuid": video_uuid, **session.summary()}
+
+
+def _result_cache_key(content_hash: str, **tracker_options) -> str:
+    """Identify the results of a video processed with the given options."""
+    settings = detector.processing_settings(**tracker_options)
+    settings["chunk_workers"] = chunked.CHUNK_WORKERS
+    settings["overlay"] = _OVERLAY_MODE
+    # Adaptive stride plans which frames to detect on a batch at a time
+    if settings["max_stride"] > 1:
+        settings["batch_size"] = detector.BATCH_SIZE
+    # Processing in chunks uses none of these, so they do not tell results apart
+    if chunked.CHUNK_WORKERS <= 1:
+        settings["ffmpeg_decode"] = detector.FFMPEG_DECODE
+        settings["scaled_output"] = detector.SCALED_OUTPUT
+        settings["inference_workers"] = detector.INFERENCE_WORKERS
+    return f"{content_hash}:{json.dumps(settings, sort_keys=True)}"
+
+
+def _process_uploaded_video(job: jobs.Job, temp_video_path: str, cache_key: str) -> str:
+    """Analyze an uploaded video straight into HLS segments. Runs as a job."""
+    try:
+        video_uuid = _analyze_video(job, temp_video_path)
+        with _jobs_in_progress_lock:
+            result_cache.put(cache_key, video_uuid, _results_size(video_uuid))
+    finally:
+        with _jobs_in_progress_lock:
+            _jobs_in_progress.pop(cache_key, None)
+    return video_uuid
+
+
+def _analyze_video(job: jobs.Job, temp_video_path: str) -> str:
+    """Run detection on a video, saving its HLS segments and data."""
+    # Generate unique identifier for video, so it can be streamed while processing
+    video_uuid = str(uuid.uuid4())
+    job.video_uuid = video_uuid
 
     # Create unique directory for processed video segments
     video_dir = os.path.join(_HLS_DIR, video_uuid)
     os.makedirs(video_dir, exist_ok=True)
     video_manifest_path = os.path.join(video_dir, _VIDEO_MANIFEST_NAME)
+    tracks_path = os.path.join(video_dir, _VIDEO_TRACKS_NAME)
 
-    # Use ffmpeg to segment video for HLS streaming
-    cmd = _get_ffmpeg_command(temp_analyzed_video_path, video_manifest_path)
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    os.remove(temp_analyzed_video_path)
-    if result.returncode != 0:
-        raise HTTPException(status_code=500, detail=f"FFmpeg failed")
+    # Analyze video for garbage
+    try:
+        if _OVERLAY_MODE:
+            # The video can be streamed as it is while its boxes are found
+            with metrics.UPLOAD_STEP_SECONDS.time(step="segment"):
+                hls.segment_video(temp_video_path, video_manifest_path)
+        with metrics.UPLOAD_STEP_SECONDS.time(step="analyze"):
+            video_garbage_data = chunked.process_video_chunked(
+                temp_video_path,
+                None if _OVERLAY_MODE else video_manifest_path,
+                progress_callback=job.set_progress,
+                analytics_callback=job.add_analytics,
+                tracks_path=tracks_path,
+                detections_path=os.path.join(video_dir, _VIDEO_DETECTIONS_NAME),
+            )
+        if _OVERLAY_MODE:
+            overlay.write_overlay(
+                tracks_path, os.path.join(video_dir, _VIDEO_OVERLAY_NAME)
+            )
+    except Exception:
+        shutil.rmtree(video_dir, ignore_errors=True)
+        raise
+    finally:
+        os.remove(temp_video_path)
 
-    return {"video_uuid": video_uuid}
+    # Save video garbage data to storage in one step, so it is never read
+    # partly written
+    video_garbage_data_path = os.path.join(_DATA_DIR, f"{video_uuid}.json")
+    with metrics.UPLOAD_STEP_SECONDS.time(step="save_data"):
+        with open(f"{video_garbage_data_path}.tmp", "w") as data_file:
+            json.dump(video_garbage_data, data_file)
+        os.replace(f"{video_garbage_data_path}.tmp", video_garbage_data_path)
+
+    # Have the results ready in memory for the first viewers
+    _load_response("manifest", video_uuid)
+    _load_response("data", video_uuid)
+
+    return video_uuid
 
 
 @app.get("/stream/{video_uuid}")
-def get_video_manifest(video_uuid: str) -> str:
-    # Sanity check
-    video_dir = os.path.join(_HLS_DIR, video_uuid)
-    if (
-        not os.path.exists(video_dir)
-        or len(os.listdir(video_dir)) == 0
-        or _VIDEO_MANIFEST_NAME not in os.listdir(video_dir)
-    ):
-        return HTTPException(status_code=404, detail="Video not found")
+@metrics.instrument("manifest")
+def get_video_manifest(
+    video_uuid: str, if_none_match: Optional[str] = Header(None)
+) -> Response:
+    return _conditional_response(*_load_response("manifest", video_uuid), if_none_match)
 
-    video_manifest_path = os.path.join(video_dir, _VIDEO_MANIFEST_NAME)
-    manifest_content = None
+
+@app.get("/data/{video_uuid}")
+@metrics.instrument("data")
+def get_video_garbage_data(
+    video_uuid: str, if_none_match: Optional[str] = Header(None)
+) -> Response:
+    return _conditional_response(*_load_response("data", video_uuid), if_none_match)
+
+
+@app.get("/overlay/{video_uuid}")
+@metrics.instrument("overlay")
+def get_video_overlay(
+    video_uuid: str, if_none_match: Optional[str] = Header(None)
+) -> Response:
+    """
+    The boxes to draw over a video processed in overlay mode, encoded as
+    described in overlay.build_overlay.
+    """
+    return _conditional_response(*_load_response("overlay", video_uuid), if_none_match)
+
+
+@app.get("/tracks/{video_uuid}")
+@metrics.instrument("tracks")
+def get_video_tracks(
+    video_uuid: str,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    track_id: Optional[list[int]] = Query(None),
+    class_name: Optional[list[str]] = Query(None),
+    limit: int = _MAX_TRACK_ROWS,
+) -> dict:
+    """
+    Query the tracked positions of a processed video by time range in seconds,
+    track ids and class names. Returns one list per column, in frame order.
+    """
+    try:
+        track_log = TrackLog(os.path.join(_HLS_DIR, video_uuid, _VIDEO_TRACKS_NAME))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Tracks not found")
+
+    # Frames are numbered from 1, frame n starting (n - 1) / fps seconds in
+    fps = track_log.metadata["fps"]
+    class_ids = None
+    if class_name is not None:
+        class_names = {"unknown": -1}
+        for class_id, name in track_log.metadata["class_names"].items():
+            class_names[name] = int(class_id)
+        class_ids = [class_names[name] for name in class_name if name in class_names]
+
+    limit = max(0, min(limit, _MAX_TRACK_ROWS))
+    rows = track_log.query(
+        start_frame=None if start is None else int(start * fps) + 1,
+        end_frame=None if end is None else int(end * fps) + 1,
+        track_ids=track_id,
+        class_ids=class_ids,
+        limit=limit + 1,
+    )
+    return {
+        "fps": fps,
+        "class_names": track_log.metadata["class_names"],
+        "truncated": len(rows["frame"]) > limit,
+        **{name: column[:limit].tolist() for name, column in rows.items()},
+    }
+
+
+class RetrackRequest(BaseModel):
+    max_age: Optional[list[int]] = None
+    min_hits: Optional[list[int]] = None
+    sort_iou_threshold: Optional[list[float]] = None
+    confidence_threshold: Optional[list[float]] = None
+
+
+@app.post("/retrack/{video_uuid}")
+def retrack_video(video_uuid: str, request: RetrackRequest) -> dict:
+    """
+    Compare the counts of a processed video tracked again with every
+    combination of the given tracker settings, from its saved detections.
+    """
+    detections_path = os.path.join(_HLS_DIR, video_uuid, _VIDEO_DETECTIONS_NAME)
+    if not os.path.isfile(detections_path):
+        raise HTTPException(status_code=404, detail="Detections not found")
+
+    grid = retrack.parameter_grid(**request.model_dump())
+    if len(grid) > _MAX_RETRACK_PARAMETER_SETS:
+        raise HTTPException(status_code=400, detail="Too many parameter sets")
+
+    return {"results": retrack.retrack_grid(detections_path, grid)}
+
+
+def _load_response(kind: str, video_uuid: str) -> tuple[cache.CachedResponse, bool]:
+    """
+    Return the manifest or data of a video, and whether the video is finished.
+    Those of finished videos are served from memory once read.
+    """
+    key = (kind, video_uuid)
+    response = response_cache.get(key)
+    if response is not None:
+        return response, True
+
+    if kind == "manifest":
+        response = _read_manifest(video_uuid)
+    elif kind == "overlay":
+        response = _read_overlay(video_uuid)
+    else:
+        response = _read_data(video_uuid)
+    finished = _is_finished(video_uuid)
+    if finished:
+        response_cache.put(key, response)
+    return response, finished
+
+
+def _read_manifest(video_uuid: str) -> cache.CachedResponse:
+    video_manifest_path = os.path.join(_HLS_DIR, video_uuid, _VIDEO_MANIFEST_NAME)
     try:
         with open(video_manifest_path, "r") as manifest_file:
             manifest_content = manifest_file.read()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Video not found")
     except OSError:
-        return HTTPException(status_code=500, detail="Failed to read video manifest")
+        raise HTTPException(status_code=500, detail="Failed to read video manifest")
 
     # Replace inaccurate relative video segment paths with correct absolute paths
-    video_segment_regex = re.compile(r"(.*.ts)\n")
-    manifest_content = re.sub(
-        video_segment_regex, f"hls/{video_uuid}/\\1\n", manifest_content
+    manifest_content = _VIDEO_SEGMENT_REGEX.sub(
+        f"hls/{video_uuid}/\\1\n", manifest_content
     )
-
-    return Response(
-        content=manifest_content, media_type="application/vnd.apple.mpegurl"
+    return cache.CachedResponse(
+        manifest_content.encode(), "application/vnd.apple.mpegurl"
     )
 
 
-@app.get("/data/{video_uuid}")
-def get_video_garbage_data(video_uuid: str) -> dict[str, int | dict[str, int]]:
+def _read_data(video_uuid: str) -> cache.CachedResponse:
     # Sanity check
-    video_dir = os.path.join(_HLS_DIR, video_uuid)
-    if (
-        not os.path.exists(video_dir)
-        or len(os.listdir(video_dir)) == 0
-        or _VIDEO_MANIFEST_NAME not in os.listdir(video_dir)
-    ):
-        return HTTPException(status_code=404, detail="Video not found")
+    if not os.path.isfile(os.path.join(_HLS_DIR, video_uuid, _VIDEO_MANIFEST_NAME)):
+        raise HTTPException(status_code=404, detail="Video not found")
 
     video_garbage_data_path = os.path.join(_DATA_DIR, f"{video_uuid}.json")
-    garbage_data = None
     try:
         with open(video_garbage_data_path, "r") as data_file:
             garbage_data = json.load(data_file)
+    except FileNotFoundError:
+        # The playlist is written as the video is processed, its data after
+        raise HTTPException(status_code=409, detail="Video is still processing")
+    except (OSError, ValueError):
+        raise HTTPException(status_code=500, detail="Failed to read video garbage data")
+    return cache.CachedResponse(json.dumps(garbage_data).encode(), "application/json")
+
+
+def _read_overlay(video_uuid: str) -> cache.CachedResponse:
+    # Overlays are only saved once a video is processed
+    video_overlay_path = os.path.join(_HLS_DIR, video_uuid, _VIDEO_OVERLAY_NAME)
+    try:
+        with open(video_overlay_path, "rb") as overlay_file:
+            return cache.CachedResponse(overlay_file.read(), "application/json")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Overlay not found")
     except OSError:
-        return HTTPException(
-            status_code=500, detail="Failed to read video garbage data"
-        )
+        raise HTTPException(status_code=500, detail="Failed to read video overlay")
+
 
-    return garbage_data
+def _is_finished(video_uuid: str) -> bool:
+    """Whether the manifest and data of a video are complete."""
+    for session, session_video_uuid in list(live_sessions.values()):
+        if session_video_uuid == video_uuid and session.is_running():
+            return False
+
+    # Data is saved after the playlist is ended
+    video_manifest_path = os.path.join(_HLS_DIR, video_uuid, _VIDEO_MANIFEST_NAME)
+    try:
+        with open(video_manifest_path, "r") as manifest_file:
+            ended = "#EXT-X-ENDLIST" in manifest_file.read()
+    except OSError:
+        return False
+    return ended and os.path.isfile(os.path.join(_DATA_DIR, f"{video_uuid}.json"))
+
+
+def _conditional_response(
+    cached: cache.CachedResponse, finished: bool, if_none_match: Optional[str]
+) -> Response:
+    """Respond with a cached body, or 304 if the client has it already."""
+    headers = {
+        "ETag": cached.etag,
+        "Cache-Control": _FINISHED_CACHE_CONTROL if finished else "no-cache",
+    }
+    if cached.matches(if_none_match):
+        return Response(status_code=304, headers=headers)
+    return Response(
+        content=cached.content, media_type=cached.media_type, headers=headers
+    )
@@ -0,0 +1,279 @@
+import bisect
+import functools
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Record metrics; when disabled every hook returns straight away
+ENABLED = os.environ.get("FLYBY_METRICS", "1") == "1"
+
+# Default histogram buckets in seconds, from 1ms to 10 minutes
+TIME_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+    600,
+)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+_metrics: List["_Metric"] = []
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not labelnames:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    """
+    A named family of time series told apart by label values, registered for
+    rendering on /metrics.
+    """
+
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        with self._lock:
+            samples = list(self._samples())
+        for suffix, labelnames, values, value in samples:
+            labels = _format_labels(labelnames, values)
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+    def _samples(self):
+        for values, value in self._values.items():
+            yield "", self.labelnames, values, value
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value: float, **labels) -> None:
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function: Optional[Callable[[], float]]) -> None:
+        """
+        Read the value from function whenever metrics are rendered.
+        """
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            yield "", (), (), self._function()
+            return
+        yield from super()._samples()
+
+
+class _Timer:
+    def __init__(self, histogram: "Histogram", labels: Dict[str, str]):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._start_time, **self._labels)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames=(), buckets=TIME_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                # Count per bucket plus +Inf, then the sum of observations
+                self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts, _ = state = self._values[key]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    def time(self, **labels):
+        """
+        Context manager observing the seconds spent in its block.
+        """
+        if not ENABLED:
+            return _NULL_TIMER
+        return _Timer(self, labels)
+
+    def _samples(self):
+        bucket_labels = self.labelnames + ("le",)
+        bounds = [_format_value(b) for b in self.buckets] + ["+Inf"]
+        for values, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield "_bucket", bucket_labels, values + (bound,), cumulative
+            yield "_sum", self.labelnames, values, total
+            yield "_count", self.labelnames, values, cumulative
+
+
+def instrument(endpoint: str) -> Callable:
+    """
+    Decorate an endpoint to count its requests by status and time them.
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            status = 500
+            start_time = time.perf_counter()
+            try:
+                response = function(*args, **kwargs)
+                status = getattr(response, "status_code", 200)
+                return response
+            except Exception as error:
+                status = getattr(error, "status_code", 500)
+                raise
+            finally:
+                REQUEST_SECONDS.observe(
+                    time.perf_counter() - start_time, endpoint=endpoint
+                )
+                REQUESTS.inc(endpoint=endpoint, status=status)
+
+        return wrapper
+
+    return decorator
+
+
+def render() -> str:
+    """
+    Every registered metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "flyby_frame_stage_seconds",
+    "Seconds spent on each stage of processing a frame",
+    ["stage"],
+)
+FRAME_SECONDS = Histogram(
+    "flyby_frame_seconds", "Seconds spent processing a frame, all stages together"
+)
+DETECTIONS_PER_FRAME = Histogram(
+    "flyby_detections_per_frame",
+    "Objects detected in a frame",
+    buckets=COUNT_BUCKETS,
+)
+LIVE_TRACKS = Gauge("flyby_live_tracks", "Tracks output by SORT for the last frame")
+FRAMES_PROCESSED = Counter(
+    "flyby_frames_processed_total", "Frames processed", ["detected"]
+)
+FRAMES_GATED = Counter(
+    "flyby_frames_gated_total",
+    "Frames tracked with the previous detections as nothing had moved",
+)
+JOB_QUEUE_DEPTH = Gauge("flyby_job_queue_depth", "Videos queued or being processed")
+UPLOAD_STEP_SECONDS = Histogram(
+    "flyby_upload_step_seconds",
+    "Seconds spent on each step of handling an uploaded video",
+    ["step"],
+)
+FFMPEG_SECONDS = Histogram(
+    "flyby_ffmpeg_seconds", "Lifetime of each ffmpeg HLS encoding process"
+)
+FFMPEG_BYTES = Counter(
+    "flyby_ffmpeg_bytes_written_total", "Bytes of raw video written to ffmpeg"
+)
+RESULT_CACHE_LOOKUPS = Counter(
+    "flyby_result_cache_lookups_total",
+    "Uploads looked up in the result cache, by outcome",
+    ["result"],
+)
+RESULT_CACHE_BYTES = Gauge(
+    "flyby_result_cache_bytes", "Bytes of results kept in the result cache"
+)
+REQUEST_SECONDS = Histogram(
+    "flyby_request_seconds", "Seconds spent serving a request", ["endpoint"]
+)
+REQUESTS = Counter("flyby_requests_total", "Requests served", ["endpoint", "status"])
@@ -0,0 +1,118 @@
+import time
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """
+    Decides which frames are too similar to the last frame detection ran on to
+    be worth running the detector on again, so static stretches of footage,
+    such as hovering shots, reuse that frame's detections.
+
+    Frames are compared as small thumbnails by the fraction of their pixels
+    that changed by more than sensor noise, so a single small object moving
+    counts as motion however still the rest of the frame is. Reused detections
+    are still fed to SORT, so tracks keep being matched and aged as on any
+    other frame instead of coasting until they expire.
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        max_gated_frames: int = 30,
+        thumbnail_width: int = 128,
+        noise_level: int = 24,
+    ):
+        """
+        threshold is the fraction of thumbnail pixels that may change by more
+        than noise_level in any channel for a frame to count as unchanged;
+        detection runs at least once every max_gated_frames + 1 frames
+        regardless.
+        """
+        self.threshold = threshold
+        self.max_gated_frames = max_gated_frames
+        self.thumbnail_width = thumbnail_width
+        self.noise_level = noise_level
+        self._reference = None
+        self._gated_in_a_row = 0
+
+        # Time saved report
+        self.detected_frames = 0
+        self.gated_frames = 0
+        self.detection_seconds = 0.0
+        self.gate_seconds = 0.0
+
+    def is_static(self, frame: np.ndarray) -> bool:
+        """
+        Whether the next frame detection would run on can reuse the detections
+        of the last one instead. Frames found to have changed become the new
+        reference, as detection is expected to run on them.
+        """
+        start_time = time.perf_counter()
+        thumbnail = self._thumbnail(frame)
+        static = (
+            self._reference is not None
+            and self._reference.shape == thumbnail.shape
+            and self._gated_in_a_row < self.max_gated_frames
+            and self._changed_fraction(thumbnail) < self.threshold
+        )
+        if static:
+            self._gated_in_a_row += 1
+            self.gated_frames += 1
+        else:
+            self._reference = thumbnail
+            self._gated_in_a_row = 0
+            self.detected_frames += 1
+        self.gate_seconds += time.perf_counter() - start_time
+        return static
+
+    def report(self) -> Dict[str, Optional[float]]:
+        """
+        Summarise how many frames reused detections and the detection time
+        that saved, net of the time spent comparing frames.
+        """
+        seconds_per_detection = self.detection_seconds / max(1, self.detected_frames)
+        return {
+            "threshold": self.threshold,
+            "detected_frames": self.detected_frames,
+            "gated_frames": self.gated_frames,
+            "gated_fraction": self.gated_frames
+            / max(1, self.detected_frames + self.gated_frames),
+            "detection_seconds": self.detection_seconds,
+            "gate_seconds": self.gate_seconds,
+            "estimated_seconds_saved": self.gated_frames * seconds_per_detection
+            - self.gate_seconds,
+        }
+
+    def merge(self, other: "MotionGate") -> None:
+        """
+        Add the report counts of a gate that ran on another part of the video.
+        """
+        self.detected_frames += other.detected_frames
+        self.gated_frames += other.gated_frames
+        self.detection_seconds += other.detection_seconds
+        self.gate_seconds += other.gate_seconds
+
+    def _changed_fraction(self, thumbnail: np.ndarray) -> float:
+        """
+        Fraction of a thumbnail's pixels that changed since the reference.
+        """
+        difference = cv2.absdiff(thumbnail, self._reference).max(axis=2)
+        return np.count_nonzero(difference > self.noise_level) / difference.size
+
+    def _thumbnail(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Shrink a frame to thumbnail_width pixels wide.
+        """
+        height, width = frame.shape[:2]
+        # Subsample large frames before resizing so the cost stays small
+        step = max(1, width // (self.thumbnail_width * 4))
+        sample = np.ascontiguousarray(frame[::step, ::step])
+        thumbnail_height = max(1, round(height * self.thumbnail_width / width))
+        return cv2.resize(
+            sample,
+            (self.thumbnail_width, thumbnail_height),
+            interpolation=cv2.INTER_AREA,
+        )
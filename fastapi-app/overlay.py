@@ -0,0 +1,102 @@
+import json
+import os
+from typing import Dict
+
+import numpy as np
+
+from track_store import TrackLog
+
+# Frames between keyframes, which list every box; the frames in between only
+# list what changed since the frame before
+OVERLAY_KEYFRAME_INTERVAL = 30
+
+
+def build_overlay(
+    track_log: TrackLog, keyframe_interval: int = OVERLAY_KEYFRAME_INTERVAL
+) -> dict:
+    """
+    Encode the boxes of every frame of a saved track log for a client to draw
+    over the untouched video.
+
+    Every frame is a dict of optional lists: "a" holds the boxes
+    [track_id, x1, y1, x2, y2] of tracks added since the frame before, "u" the
+    changes [track_id, dx1, dy1, dx2, dy2] of boxes that moved and "r" the ids
+    of tracks that are gone. Keyframes, every keyframe_interval frames from the
+    first, are marked "k" and list every box under "a", so playback can start
+    at any keyframe. Coordinates are rounded to whole pixels. Frame n is shown
+    from (n - 1) / fps seconds.
+    """
+    frame_count = track_log.metadata["frames"]
+    frames = []
+    track_classes = {}
+    previous = {}
+
+    # Read the log a keyframe interval at a time, to bound memory
+    for first in range(1, frame_count + 1, keyframe_interval):
+        last = min(first + keyframe_interval, frame_count + 1) - 1
+        rows = track_log.query(start_frame=first, end_frame=last)
+        boxes = np.rint(
+            np.column_stack([rows[n] for n in ("x1", "y1", "x2", "y2")])
+        ).astype(int)
+        bounds = np.searchsorted(rows["frame"], np.arange(first, last + 2))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            current = {
+                track_id: tuple(box)
+                for track_id, box in zip(
+                    rows["track_id"][start:end].tolist(), boxes[start:end].tolist()
+                )
+            }
+            for track_id, class_id in zip(
+                rows["track_id"][start:end].tolist(),
+                rows["class_id"][start:end].tolist(),
+            ):
+                track_classes.setdefault(track_id, class_id)
+
+            if len(frames) % keyframe_interval == 0:
+                frame = {"k": 1, "a": [[i, *box] for i, box in current.items()]}
+            else:
+                frame = _delta(previous, current)
+            frames.append(frame)
+            previous = current
+
+    return {
+        "fps": track_log.metadata["fps"],
+        "keyframe_interval": keyframe_interval,
+        "class_names": track_log.metadata["class_names"],
+        "track_classes": {str(i): class_id for i, class_id in track_classes.items()},
+        "frames": frames,
+    }
+
+
+def _delta(previous: Dict[int, tuple], current: Dict[int, tuple]) -> dict:
+    """
+    Changes between the boxes of two consecutive frames.
+    """
+    added, moved = [], []
+    for track_id, box in current.items():
+        before = previous.get(track_id)
+        if before is None:
+            added.append([track_id, *box])
+        elif before != box:
+            moved.append([track_id, *(b - a for a, b in zip(before, box))])
+    removed = [track_id for track_id in previous if track_id not in current]
+
+    frame = {}
+    if added:
+        frame["a"] = added
+    if moved:
+        frame["u"] = moved
+    if removed:
+        frame["r"] = removed
+    return frame
+
+
+def write_overlay(tracks_path: str, overlay_path: str) -> None:
+    """
+    Build the overlay of a saved track log and write it as compact JSON.
+    """
+    overlay = build_overlay(TrackLog(tracks_path))
+    temp_path = f"{overlay_path}.tmp"
+    with open(temp_path, "w") as overlay_file:
+        json.dump(overlay, overlay_file, separators=(",", ":"))
+    os.replace(temp_path, overlay_path)
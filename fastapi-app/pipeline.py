@@ -0,0 +1,115 @@
+import queue
+import threading
+from typing import Callable, Iterable, List
+
+import numpy as np
+
+# Marks the end of the stream in a stage queue
+_END = object()
+
+
+class _Stage(threading.Thread):
+    """
+    Thread running one end of the pipeline. An error stops the whole pipeline
+    and is kept to be raised on the calling thread.
+    """
+
+    def __init__(self, target: Callable[[], None], name: str, stop: threading.Event):
+        super().__init__(name=name, daemon=True)
+        self._target_fn = target
+        self._stop_pipeline = stop
+        self.error = None
+
+    def run(self) -> None:
+        try:
+            self._target_fn()
+        except BaseException as error:
+            self.error = error
+            self._stop_pipeline.set()
+
+
+def _put(stage_queue: queue.Queue, item, stop: threading.Event) -> bool:
+    """
+    Block until item is queued, giving up if the pipeline is stopped.
+    """
+    while not stop.is_set():
+        try:
+            stage_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(stage_queue: queue.Queue, stop: threading.Event):
+    """
+    Block until an item is available, returning _END if the pipeline is stopped.
+    """
+    while not stop.is_set():
+        try:
+            return stage_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _END
+
+
+def run_pipeline(
+    batches: Iterable[List[np.ndarray]],
+    process: Callable[[List[np.ndarray]], List[np.ndarray]],
+    write: Callable[[np.ndarray], None],
+    queue_size: int = 2,
+) -> None:
+    """
+    Run decode, inference and encode concurrently.
+
+    Batches are pulled from the batches iterable on a decoder thread, passed to
+    process on the calling thread and their output frames handed to write on an
+    encoder thread. Stages are joined by queues holding at most queue_size
+    batches, so a slow stage blocks the ones feeding it instead of letting
+    frames pile up in memory. Batches go through process one at a time and in
+    order, so output is the same as running the stages one after another.
+    """
+    decoded = queue.Queue(maxsize=queue_size)
+    processed = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def decode() -> None:
+        try:
+            for batch in batches:
+                if not _put(decoded, batch, stop):
+                    return
+        finally:
+            _put(decoded, _END, stop)
+
+    def encode() -> None:
+        while True:
+            frames = _get(processed, stop)
+            if frames is _END:
+                return
+            for frame in frames:
+                write(frame)
+
+    decoder = _Stage(decode, "flyby-decode", stop)
+    encoder = _Stage(encode, "flyby-encode", stop)
+    decoder.start()
+    encoder.start()
+
+    try:
+        while True:
+            batch = _get(decoded, stop)
+            if batch is _END:
+                break
+            if not _put(processed, process(batch), stop):
+                break
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        _put(processed, _END, stop)
+        encoder.join()
+        stop.set()
+        decoder.join()
+
+    for stage in (decoder, encoder):
+        if stage.error is not None:
+            raise stage.error
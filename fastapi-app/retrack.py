@@ -0,0 +1,143 @@
+"""
+Track the detections saved while a video was processed again with other
+tracker settings, without running the model.
+
+    python retrack.py DETECTIONS_FILE [--max-age 10 30] [--min-hits 1 3]
+        [--sort-iou-threshold 0.2 0.3] [--confidence-threshold 0.15 0.3]
+
+Every combination of the given values is tracked, in parallel worker
+processes, and the counts of each are printed as JSON.
+
+Saved detections are replayed into sort.ClassTracker, which detector.TACOTracker
+tracks with, without importing the detector, so worker processes never load
+the model stack.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import detection_log
+from sort import TRACK_IOU_THRESHOLD, TRACK_MAX_AGE, TRACK_MIN_HITS, ClassTracker
+
+# Worker processes parameter sets are split between, shared by every request
+RETRACK_WORKERS = int(os.environ.get("FLYBY_RETRACK_WORKERS", str(os.cpu_count() or 1)))
+# Tracker settings that can be changed without running the model again
+GRID_PARAMETERS = ("max_age", "min_hits", "sort_iou_threshold", "confidence_threshold")
+
+
+def parameter_grid(**values: Optional[List]) -> List[dict]:
+    """
+    Every combination of the given parameter values; parameters given as None
+    keep the tracker's default.
+    """
+    given = {name: value for name, value in values.items() if value is not None}
+    return [
+        dict(zip(given, combination))
+        for combination in itertools.product(*given.values())
+    ]
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def retrack(
+    detections_path: str,
+    confidence_threshold: Optional[float] = None,
+    max_age: int = TRACK_MAX_AGE,
+    min_hits: int = TRACK_MIN_HITS,
+    sort_iou_threshold: float = TRACK_IOU_THRESHOLD,
+) -> dict:
+    """
+    Track saved detections with the given settings, returning counts in the
+    format of detector.process_video's results.
+
+    confidence_threshold can only be raised above the one the detections were
+    saved with, as weaker detections were never kept.
+    """
+    frames, metadata = detection_log.load(detections_path)
+    class_names = {int(k): v for k, v in metadata["class_names"].items()}
+    tracker = ClassTracker(
+        max_age=max_age, min_hits=min_hits, iou_threshold=sort_iou_threshold
+    )
+
+    for detections in frames:
+        if detections is None:
+            # Detection was skipped on this frame
+            tracker.coast()
+            continue
+        boxes, class_ids = detections
+        if confidence_threshold is not None:
+            keep = boxes[:, 4] >= confidence_threshold
+            boxes, class_ids = boxes[keep], class_ids[keep]
+        tracker.update(boxes, class_ids)
+
+    report = defaultdict(int)
+    for class_id in tracker.first_classes.values():
+        report[class_names[class_id] if class_id >= 0 else "unknown"] += 1
+    return {
+        "Total tracked objects": len(tracker.first_classes),
+        "Class counts:": dict(report),
+        "Frames processed": len(frames),
+    }
+
+
+def _retrack_parameters(detections_path: str, parameters: dict) -> dict:
+    return {"parameters": parameters, **retrack(detections_path, **parameters)}
+
+
+def retrack_grid(
+    detections_path: str, grid: List[dict], workers: int = RETRACK_WORKERS
+) -> List[dict]:
+    """
+    Track saved detections with every parameter set of grid, returning each
+    set's counts in the same order.
+    """
+    if workers <= 1 or len(grid) == 1:
+        return [_retrack_parameters(detections_path, p) for p in grid]
+
+    return list(
+        _get_executor(workers).map(
+            _retrack_parameters, itertools.repeat(detections_path), grid
+        )
+    )
+
+
+def _get_executor(workers: int) -> ProcessPoolExecutor:
+    """
+    Share one pool of worker processes between requests, so concurrent grids
+    queue for the same workers instead of each starting its own.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawn rather than fork, as the server process runs threads
+            _executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("detections", help=".npz file saved by process_video")
+    parser.add_argument("--max-age", type=int, nargs="+")
+    parser.add_argument("--min-hits", type=int, nargs="+")
+    parser.add_argument("--sort-iou-threshold", type=float, nargs="+")
+    parser.add_argument("--confidence-threshold", type=float, nargs="+")
+    parser.add_argument("--workers", type=int, default=RETRACK_WORKERS)
+    args = parser.parse_args()
+
+    grid = parameter_grid(**{name: getattr(args, name) for name in GRID_PARAMETERS})
+    print(json.dumps(retrack_grid(args.detections, grid, args.workers), indent=2))
+
+
+if __name__ == "__main__":
+    main()
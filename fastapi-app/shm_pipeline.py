@@ -0,0 +1,502 @@
+import collections
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from frame_reader import FfmpegFrameReader, scaled_size
+
+# Seconds to wait for a message from the decoder or workers before checking
+# they are still running
+_POLL_SECONDS = 1.0
+# Seconds the decoder is given to exit on its own once every frame is read
+_EXIT_SECONDS = 5.0
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> "_InferencePool":
+    """
+    Share one pool of inference workers between videos, so the model stays
+    loaded in them and concurrent videos do not oversubscribe the CPU. A pool
+    whose workers died is replaced.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.broken:
+            if _pool is not None:
+                _pool.shutdown()
+            _pool = _InferencePool(workers)
+        return _pool
+
+
+def _discard_pool(pool: "_InferencePool") -> None:
+    """
+    Stop a pool whose queues may be corrupt, so the next video starts another.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown()
+
+
+class _InferencePool:
+    """
+    Inference worker processes taking batches of ring slots of any video from
+    one queue, with the messages they send back routed to the video each is
+    about by a thread in this process.
+    """
+
+    def __init__(self, workers: int):
+        # Spawn rather than fork, as the server process runs threads
+        context = multiprocessing.get_context("spawn")
+        self.work = context.Queue()
+        self.results = context.Queue()
+        self.class_names = None
+        self._error = None
+        self._ready = threading.Event()
+        self._videos = {}
+        self._video_ids = itertools.count()
+        self._lock = threading.Lock()
+
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        self.processes = [
+            context.Process(
+                target=_infer,
+                args=(threads, self.work, self.results),
+                name=f"flyby-inference-{worker}",
+                daemon=True,
+            )
+            for worker in range(workers)
+        ]
+        for process in self.processes:
+            process.start()
+        threading.Thread(
+            target=self._dispatch, name="flyby-inference-results", daemon=True
+        ).start()
+
+    @property
+    def broken(self) -> bool:
+        """
+        Whether any worker has exited, as they only do on failure.
+        """
+        return any(process.exitcode is not None for process in self.processes)
+
+    def check(self) -> None:
+        """
+        Raise RuntimeError if any worker has exited.
+        """
+        for process in self.processes:
+            if process.exitcode is not None:
+                raise RuntimeError(
+                    self._error or f"{process.name} exited with code {process.exitcode}"
+                )
+
+    def wait_ready(self) -> Dict[int, str]:
+        """
+        Wait for the first worker to load the model and return its class names.
+        """
+        while not self._ready.wait(_POLL_SECONDS):
+            self.check()
+        if self.class_names is None:
+            raise RuntimeError(self._error)
+        return self.class_names
+
+    def register(self) -> Tuple[int, queue.Queue]:
+        """
+        Start routing the messages about a new video to a queue, returning the
+        id to tag its work with and the queue.
+        """
+        messages = queue.Queue()
+        with self._lock:
+            video_id = next(self._video_ids)
+            self._videos[video_id] = messages
+        return video_id, messages
+
+    def unregister(self, video_id: int) -> None:
+        """
+        Drop the messages still to come about a video.
+        """
+        with self._lock:
+            self._videos.pop(video_id, None)
+
+    def shutdown(self) -> None:
+        """
+        Stop the workers and the thread routing their messages.
+        """
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        self.results.put(None)
+
+    def _dispatch(self) -> None:
+        while True:
+            message = self.results.get()
+            if message is None:
+                return
+            video_id, (kind, *content) = message
+            if video_id is None:
+                # Sent by a worker once it has loaded the model, or failed to
+                if kind == "ready":
+                    self.class_names = self.class_names or content[0]
+                else:
+                    self._error = content[0]
+                self._ready.set()
+                continue
+            with self._lock:
+                messages = self._videos.get(video_id)
+            if messages is not None:
+                messages.put((kind, *content))
+
+
+class SharedMemoryInference:
+    """
+    Decodes a video in one process into a ring of frame buffers in shared
+    memory and runs the model on it in a pool of inference worker processes
+    shared by every video, which keep the model loaded between videos.
+
+    The decoder hands batches of ring slots to whichever worker is free and the
+    workers send back only the detections of each batch, so no frame is ever
+    pickled between processes. Batches are yielded in order, as the frames and
+    detections of each, for a single tracker to track in this process.
+
+    A batch's frames are views of the ring, overwritten once held_batches more
+    batches have been yielded, and must not be used after release().
+    """
+
+    def __init__(
+        self,
+        video_path: str,
+        workers: int,
+        batch_size: int,
+        held_batches: int,
+        max_width: Optional[int] = None,
+        max_height: Optional[int] = None,
+        ffmpeg_decode: bool = False,
+        tracker_options: Optional[dict] = None,
+        min_held_batches: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        """
+        With ffmpeg_decode, frames are decoded by ffmpeg scaled down to fit
+        within max_width by max_height, and box_scale is set to the factors of
+        their boxes to source video coordinates. Workers run
+        detector.TACOTracker with tracker_options; the pool is started with
+        workers processes by the first video to use it, and keeps that many.
+
+        If the ring for held_batches would take more than max_bytes, the caller
+        is given as many batches to hold as fit, down to min_held_batches, and
+        held_batches is set to that. RuntimeError is raised if even those do
+        not fit, or /dev/shm has too little space free for the ring.
+        """
+        if ffmpeg_decode:
+            width, height, box_scale = scaled_size(video_path, max_width, max_height)
+        else:
+            cap = cv2.VideoCapture(video_path)
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            cap.release()
+            if width == 0 or height == 0:
+                raise RuntimeError(f"Could not open {video_path}")
+            box_scale = None
+        self.width, self.height = width, height
+        if box_scale is not None and not np.any(box_scale != 1):
+            box_scale = None
+        self.box_scale = box_scale
+        self._pool = _get_pool(workers)
+        workers = len(self._pool.processes)
+
+        # Enough slots for the batches held by the caller, one being decoded and
+        # one being inferred by each worker
+        batch_bytes = batch_size * height * width * 3
+        if min_held_batches is None:
+            min_held_batches = held_batches
+        if max_bytes is not None:
+            held_batches = min(held_batches, max_bytes // batch_bytes - workers - 1)
+            if held_batches < min_held_batches:
+                raise RuntimeError(
+                    f"Shared memory for {min_held_batches + workers + 1} batches of"
+                    f" {batch_size} {width}x{height} frames needs"
+                    f" {_megabytes((min_held_batches + workers + 1) * batch_bytes)},"
+                    f" over the budget of {_megabytes(max_bytes)};"
+                    " raise FLYBY_SHM_RING_BUDGET_MB or lower FLYBY_BATCH_SIZE"
+                )
+        slots = batch_size * (held_batches + workers + 1)
+        shape = (slots, height, width, 3)
+        self.held_batches = held_batches
+        _check_free_space(slots * height * width * 3)
+        self._shared_memory = SharedMemory(create=True, size=int(np.prod(shape)))
+        self._ring = np.ndarray(shape, np.uint8, self._shared_memory.buf)
+        self._video_id, self._messages = self._pool.register()
+
+        # Spawn rather than fork, as the server process runs threads
+        context = multiprocessing.get_context("spawn")
+        self._stop = context.Event()
+        self._free_slots = context.Queue()
+        for slot in range(slots):
+            self._free_slots.put(slot)
+
+        # Every batch of work carries what a worker needs to run on it
+        video = (
+            self._video_id,
+            self._shared_memory.name,
+            shape,
+            self.box_scale,
+            {**(tracker_options or {}), "annotate": False, "max_stride": 1},
+        )
+        decoder_size = (max_width, max_height) if ffmpeg_decode else None
+        self._decoder = context.Process(
+            target=_decode,
+            args=(
+                video_path,
+                decoder_size,
+                video,
+                batch_size,
+                self._stop,
+                self._free_slots,
+                self._pool.work,
+                self._pool.results,
+            ),
+            name="flyby-decoder",
+            daemon=True,
+        )
+
+        self._detected = {}
+        self._batches = None
+        self._decoder.start()
+
+    @property
+    def class_names(self) -> Dict[int, str]:
+        """
+        The model's class names, once the first worker has loaded it.
+        """
+        return self._pool.wait_ready()
+
+    def __iter__(self) -> Iterator[Tuple[List[np.ndarray], list]]:
+        held = collections.deque()
+        batch_number = 0
+        while self._batches is None or batch_number < self._batches:
+            if batch_number not in self._detected:
+                self._receive()
+                continue
+
+            slots, detections = self._detected.pop(batch_number)
+            yield [self._ring[slot] for slot in slots], detections
+            batch_number += 1
+
+            # Hand the oldest batch's slots back to the decoder
+            held.append(slots)
+            if len(held) > self.held_batches:
+                for slot in held.popleft():
+                    self._free_slots.put(slot)
+
+    def _receive(self) -> None:
+        """
+        Wait for the next message from the decoder or a worker, raising
+        RuntimeError if one failed.
+        """
+        while True:
+            try:
+                message = self._messages.get(timeout=_POLL_SECONDS)
+                break
+            except queue.Empty:
+                if self._decoder.exitcode not in (None, 0):
+                    raise RuntimeError(
+                        f"{self._decoder.name} exited with code"
+                        f" {self._decoder.exitcode}"
+                    )
+                self._pool.check()
+
+        kind, *content = message
+        if kind == "batch":
+            batch_number, slots, detections = content
+            self._detected[batch_number] = (slots, detections)
+        elif kind == "end":
+            self._batches = content[0]
+        else:
+            raise RuntimeError(content[0])
+
+    def release(self) -> None:
+        """
+        Stop the decoder and free the shared memory. Batches of it still queued
+        for the workers fail to find it and are dropped.
+        """
+        if self._ring is None:
+            return
+
+        # Ask the decoder to stop rather than kill it, as it shares the pool's
+        # queues, which a process killed while writing to them leaves corrupt
+        self._stop.set()
+        self._free_slots.put(None)
+        self._decoder.join(_EXIT_SECONDS)
+        if self._decoder.is_alive():
+            self._decoder.terminate()
+            self._decoder.join()
+            _discard_pool(self._pool)
+        self._free_slots.close()
+        self._free_slots.cancel_join_thread()
+        self._pool.unregister(self._video_id)
+
+        self._ring = None
+        self._shared_memory.close()
+        self._shared_memory.unlink()
+
+
+def _check_free_space(size: int) -> None:
+    """
+    Raise RuntimeError if /dev/shm has less than size bytes free, as shared
+    memory past that is only found missing when first written to, killing the
+    writer with SIGBUS.
+    """
+    try:
+        stats = os.statvfs("/dev/shm")
+    except OSError:
+        # Shared memory is not backed by /dev/shm on this platform
+        return
+    free = stats.f_bavail * stats.f_frsize
+    if size > free:
+        raise RuntimeError(
+            f"Shared memory for the frame ring needs {_megabytes(size)} but"
+            f" /dev/shm has {_megabytes(free)} free; give the container more with"
+            " shm_size or --shm-size, or lower FLYBY_SHM_RING_BUDGET_MB"
+        )
+
+
+def _megabytes(size: int) -> str:
+    return f"{size / (1024 * 1024):.0f} MB"
+
+
+def _decode(
+    video_path: str,
+    size: Optional[Tuple[Optional[int], Optional[int]]],
+    video: tuple,
+    batch_size: int,
+    stop: multiprocessing.Event,
+    free_slots: multiprocessing.Queue,
+    work: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+) -> None:
+    """
+    Decode every frame of a video into free slots of the ring and queue them a
+    batch at a time, with ffmpeg scaled down to fit within size if given or
+    otherwise with OpenCV, until stop is set.
+
+    video is the (id, shared memory name, ring shape, box scale, tracker
+    options) workers need to run on its batches.
+    """
+    video_id, shared_memory_name, shape = video[:3]
+    shared_memory = SharedMemory(shared_memory_name)
+    ring = np.ndarray(shape, np.uint8, shared_memory.buf)
+    if size is None:
+        cap = cv2.VideoCapture(video_path)
+
+        def read_into(frame: np.ndarray) -> bool:
+            success, decoded = cap.read(frame)
+            if success and decoded is not frame:
+                frame[...] = decoded
+            return success
+
+        release = cap.release
+    else:
+        reader = FfmpegFrameReader(video_path, *size, buffers=0)
+        read_into, release = reader.read_into, reader.release
+
+    batch_number = 0
+    try:
+        slots = []
+        while not stop.is_set():
+            slot = free_slots.get()
+            if slot is None or not read_into(ring[slot]):
+                break
+            slots.append(slot)
+            if len(slots) == batch_size:
+                work.put((*video, batch_number, slots))
+                batch_number += 1
+                slots = []
+        if stop.is_set():
+            return
+        if slots:
+            work.put((*video, batch_number, slots))
+            batch_number += 1
+        results.put((video_id, ("end", batch_number)))
+    except Exception as error:
+        results.put((video_id, ("error", f"Decoding failed: {error}")))
+    finally:
+        release()
+        del ring
+        shared_memory.close()
+
+
+def _infer(
+    threads: int, work: multiprocessing.Queue, results: multiprocessing.Queue
+) -> None:
+    """
+    Load the model and run it on batches of ring slots of any video, sending
+    back the detections of each batch.
+    """
+    import detector
+
+    # Split the cores between workers instead of every worker using all of them
+    import torch
+
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+
+    try:
+        tracker = detector.TACOTracker(detector.MODEL_PATH, annotate=False)
+    except Exception as error:
+        results.put((None, ("error", f"Inference failed: {error}")))
+        return
+    results.put((None, ("ready", tracker.class_names)))
+
+    # Trackers are rebuilt, around the model already loaded, only when the
+    # options change; rings stay attached while their video keeps the worker busy
+    options = None
+    attached = {}
+    while True:
+        try:
+            batch = work.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            _detach(attached)
+            continue
+        video_id, shared_memory_name, shape, box_scale, tracker_options = batch[:5]
+        batch_number, slots = batch[5:]
+        try:
+            if tracker_options != options:
+                tracker = detector.TACOTracker(detector.MODEL_PATH, **tracker_options)
+                options = tracker_options
+            tracker.box_scale = box_scale
+            _detach(attached, keep=shared_memory_name)
+            if shared_memory_name not in attached:
+                attached[shared_memory_name] = SharedMemory(shared_memory_name)
+            ring = np.ndarray(shape, np.uint8, attached[shared_memory_name].buf)
+            detections = tracker._detect([ring[slot] for slot in slots])
+            del ring
+            results.put((video_id, ("batch", batch_number, slots, detections)))
+        except Exception as error:
+            results.put((video_id, ("error", f"Inference failed: {error}")))
+
+
+def _detach(attached: Dict[str, SharedMemory], keep: Optional[str] = None) -> None:
+    """
+    Close the rings attached other than keep, so the memory of rings already
+    released by their video is freed.
+    """
+    for name in list(attached):
+        if name == keep:
+            continue
+        try:
+            attached[name].close()
+        except BufferError:
+            # Frames of it are still referenced by the model, until its next run
+            continue
+        del attached[name]
@@ -31,17 +31,30 @@ import glob
 import time
 import argparse
 from filterpy.kalman import KalmanFilter
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 
 np.random.seed(0)
 
+# Defaults of ClassTracker, the tracker detector.TACOTracker runs and retrack.py
+# replays saved detections with
+TRACK_MAX_AGE = 30
+TRACK_MIN_HITS = 3
+TRACK_IOU_THRESHOLD = 0.3
+
+
+try:
+    import lap
+except ImportError:
+    # checked once, as a failed import is retried (slowly) on every attempt
+    lap = None
 
-def linear_assignment(cost_matrix):
-    try:
-        import lap
 
+def linear_assignment(cost_matrix):
+    if lap is not None:
         _, x, y = lap.lapjv(cost_matrix, extend_cost=True)
         return np.array([[y[i], i] for i in x if i >= 0])  #
-    except ImportError:
+    else:
         from scipy.optimize import linear_sum_assignment
 
         x, y = linear_sum_assignment(cost_matrix)
@@ -176,6 +189,15 @@ class KalmanBoxTracker(object):
         self.history.append(convert_x_to_bbox(self.kf.x))
         return self.history[-1]
 
+    def coast(self):
+        """
+        Advances the state vector by one frame without counting it as a missed
+        detection, for frames on which the detector is not run.
+        """
+        if (self.kf.x[6] + self.kf.x[2]) <= 0:
+            self.kf.x[6] *= 0.0
+        self.kf.predict()
+
     def get_state(self):
         """
         Returns the current bounding box estimate.
@@ -183,10 +205,139 @@ class KalmanBoxTracker(object):
         return convert_x_to_bbox(self.kf.x)
 
 
-def associate_detections_to_trackers(detections, trackers, iou_threshold=0.3):
+def iou_pairs(bb_test, bb_gt):
+    """
+    Computes IOU between aligned pairs of bboxes in the form [x1,y1,x2,y2]
+    """
+    xx1 = np.maximum(bb_test[:, 0], bb_gt[:, 0])
+    yy1 = np.maximum(bb_test[:, 1], bb_gt[:, 1])
+    xx2 = np.minimum(bb_test[:, 2], bb_gt[:, 2])
+    yy2 = np.minimum(bb_test[:, 3], bb_gt[:, 3])
+    w = np.maximum(0.0, xx2 - xx1)
+    h = np.maximum(0.0, yy2 - yy1)
+    wh = w * h
+    o = wh / (
+        (bb_test[:, 2] - bb_test[:, 0]) * (bb_test[:, 3] - bb_test[:, 1])
+        + (bb_gt[:, 2] - bb_gt[:, 0]) * (bb_gt[:, 3] - bb_gt[:, 1])
+        - wh
+    )
+    return o
+
+
+def grid_cells(bboxes, cell_size):
+    """
+    Lists the cells of a uniform grid covered by each bbox in the form [x1,y1,x2,y2]
+
+    Returns 2 arrays of equal length holding the bbox index and the cell key of
+    every (bbox, cell) pair
+    """
+    first = np.floor(bboxes[:, :2] / cell_size).astype(np.int64)
+    last = np.floor(bboxes[:, 2:4] / cell_size).astype(np.int64)
+    span = np.maximum(last - first + 1, 1)
+    counts = span[:, 0] * span[:, 1]
+
+    index = np.repeat(np.arange(len(bboxes)), counts)
+    offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cx = first[index, 0] + offset % span[index, 0]
+    cy = first[index, 1] + offset // span[index, 0]
+    return index, (cx << 32) + (cy & 0xFFFFFFFF)
+
+
+def overlapping_pairs(bb_test, bb_gt):
+    """
+    Finds every pair of bboxes in the form [x1,y1,x2,y2] with a positive IOU by
+    bucketing them into a grid and only comparing bboxes sharing a cell
+
+    Returns 3 arrays of test indices, gt indices and their IOU
+    """
+    sides = np.concatenate(
+        [bb_test[:, 2:4] - bb_test[:, :2], bb_gt[:, 2:4] - bb_gt[:, :2]]
+    )
+    cell_size = max(2.0 * float(np.median(sides.max(axis=1))), 1.0)
+
+    test_index, test_keys = grid_cells(bb_test, cell_size)
+    gt_index, gt_keys = grid_cells(bb_gt, cell_size)
+    order = np.argsort(gt_keys, kind="stable")
+    gt_index, gt_keys = gt_index[order], gt_keys[order]
+
+    # join the two cell lists on the cell key
+    lo = np.searchsorted(gt_keys, test_keys, side="left")
+    hi = np.searchsorted(gt_keys, test_keys, side="right")
+    counts = hi - lo
+    offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    pair_keys = np.unique(
+        np.repeat(test_index, counts) * len(bb_gt)
+        + gt_index[np.repeat(lo, counts) + offset]
+    )
+    t, g = pair_keys // len(bb_gt), pair_keys % len(bb_gt)
+
+    iou = iou_pairs(bb_test[t], bb_gt[g])
+    positive = iou > 0
+    return t[positive], g[positive], iou[positive]
+
+
+def gated_linear_assignment(det_index, trk_index, iou, n_dets, n_trks, iou_threshold):
+    """
+    Maximises the total IOU of the assignment of detections to trackers, given
+    only the (detection, tracker, IOU) triples with a positive IOU
+
+    Every connected component of the overlap graph is solved on its own, which
+    reaches the same optimum as a full linear assignment on the dense IOU matrix.
+    Returns the matched indices ordered by detection and the IOU of each match.
+    """
+    above = iou > iou_threshold
+    if np.any(above) and (
+        np.bincount(det_index[above]).max() == 1
+        and np.bincount(trk_index[above]).max() == 1
+    ):
+        return np.stack([det_index[above], trk_index[above]], axis=1), iou[above]
+
+    n = n_dets + n_trks
+    graph = coo_matrix((np.ones(len(iou)), (det_index, n_dets + trk_index)), (n, n))
+    _, labels = connected_components(graph, directed=False)
+    component = labels[det_index]
+    pair_counts = np.bincount(component, minlength=n)
+
+    # components made of a single overlapping pair match directly
+    single = pair_counts[component] == 1
+    matched = [np.stack([det_index[single], trk_index[single]], axis=1)]
+    matched_iou = [iou[single]]
+
+    order = np.argsort(component[~single], kind="stable")
+    multi_det = det_index[~single][order]
+    multi_trk = trk_index[~single][order]
+    multi_iou = iou[~single][order]
+    bounds = np.flatnonzero(np.diff(component[~single][order])) + 1
+    for d, t, o in zip(
+        np.split(multi_det, bounds),
+        np.split(multi_trk, bounds),
+        np.split(multi_iou, bounds),
+    ):
+        if len(o) == 0:
+            continue
+        dets, d = np.unique(d, return_inverse=True)
+        trks, t = np.unique(t, return_inverse=True)
+        iou_matrix = np.zeros((len(dets), len(trks)))
+        iou_matrix[d, t] = o
+        sub = linear_assignment(-iou_matrix).reshape(-1, 2).astype(int)
+        matched.append(np.stack([dets[sub[:, 0]], trks[sub[:, 1]]], axis=1))
+        matched_iou.append(iou_matrix[sub[:, 0], sub[:, 1]])
+
+    matched = np.concatenate(matched)
+    matched_iou = np.concatenate(matched_iou)
+    order = np.argsort(matched[:, 0], kind="stable")
+    return matched[order], matched_iou[order]
+
+
+def associate_detections_to_trackers(
+    detections, trackers, iou_threshold=0.3, gated=False
+):
     """
     Assigns detections to tracked object (both represented as bounding boxes)
 
+    When gated, only overlapping pairs found through a spatial grid are scored,
+    which avoids the dense IOU matrix for scenes with many objects.
+
     Returns 3 lists of matches, unmatched_detections and unmatched_trackers
     """
     if len(trackers) == 0:
@@ -196,50 +347,51 @@ def associate_detections_to_trackers(detections, trackers, iou_threshold=0.3):
             np.empty((0, 5), dtype=int),
         )
 
-    iou_matrix = iou_batch(detections, trackers)
-
-    if min(iou_matrix.shape) > 0:
+    if len(detections) == 0:
+        matched_indices = np.empty((0, 2), dtype=int)
+        matched_iou = np.empty(0)
+    elif gated:
+        det_index, trk_index, iou = overlapping_pairs(detections, trackers)
+        matched_indices, matched_iou = gated_linear_assignment(
+            det_index, trk_index, iou, len(detections), len(trackers), iou_threshold
+        )
+    else:
+        iou_matrix = iou_batch(detections, trackers)
         a = (iou_matrix > iou_threshold).astype(np.int32)
         if a.sum(1).max() == 1 and a.sum(0).max() == 1:
             matched_indices = np.stack(np.where(a), axis=1)
         else:
             matched_indices = linear_assignment(-iou_matrix)
-    else:
-        matched_indices = np.empty(shape=(0, 2))
+        matched_indices = matched_indices.reshape(-1, 2).astype(int)
+        matched_iou = iou_matrix[matched_indices[:, 0], matched_indices[:, 1]]
 
-    unmatched_detections = []
-    for d, det in enumerate(detections):
-        if d not in matched_indices[:, 0]:
-            unmatched_detections.append(d)
-    unmatched_trackers = []
-    for t, trk in enumerate(trackers):
-        if t not in matched_indices[:, 1]:
-            unmatched_trackers.append(t)
+    det_matched = np.zeros(len(detections), dtype=bool)
+    det_matched[matched_indices[:, 0]] = True
+    trk_matched = np.zeros(len(trackers), dtype=bool)
+    trk_matched[matched_indices[:, 1]] = True
 
     # filter out matched with low IOU
-    matches = []
-    for m in matched_indices:
-        if iou_matrix[m[0], m[1]] < iou_threshold:
-            unmatched_detections.append(m[0])
-            unmatched_trackers.append(m[1])
-        else:
-            matches.append(m.reshape(1, 2))
-    if len(matches) == 0:
-        matches = np.empty((0, 2), dtype=int)
-    else:
-        matches = np.concatenate(matches, axis=0)
+    low = matched_iou < iou_threshold
+    unmatched_detections = np.concatenate(
+        [np.flatnonzero(~det_matched), matched_indices[low, 0]]
+    )
+    unmatched_trackers = np.concatenate(
+        [np.flatnonzero(~trk_matched), matched_indices[low, 1]]
+    )
+    matches = matched_indices[~low]
 
-    return matches, np.array(unmatched_detections), np.array(unmatched_trackers)
+    return matches, unmatched_detections, unmatched_trackers
 
 
 class Sort(object):
-    def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3):
+    def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3, gated=False):
         """
         Sets key parameters for SORT
         """
         self.max_age = max_age
         self.min_hits = min_hits
         self.iou_threshold = iou_threshold
+        self.gated = gated
         self.trackers = []
         self.frame_count = 0
 
@@ -266,7 +418,7 @@ class Sort(object):
         for t in reversed(to_del):
             self.trackers.pop(t)
         matched, unmatched_dets, unmatched_trks = associate_detections_to_trackers(
-            dets, trks, self.iou_threshold
+            dets, trks, self.iou_threshold, self.gated
         )
 
         # update matched trackers with assigned detections
@@ -294,6 +446,319 @@ class Sort(object):
             return np.concatenate(ret)
         return np.empty((0, 5))
 
+    def coast(self):
+        """
+        Moves every track forward one frame on its constant velocity model, for
+        frames on which the detector is skipped. Tracks are not aged, so max_age
+        and min_hits keep counting frames passed to update.
+
+        Returns the predicted bboxes of the tracks returned by the last update, in
+        the same format as update.
+        """
+        ret = []
+        for trk in reversed(self.trackers):
+            trk.coast()
+            if (trk.time_since_update < 1) and (
+                trk.hit_streak >= self.min_hits or self.frame_count <= self.min_hits
+            ):
+                ret.append(np.concatenate((trk.get_state()[0], [trk.id + 1])))
+        if len(ret) > 0:
+            return np.stack(ret)
+        return np.empty((0, 5))
+
+
+def convert_bboxes_to_z(bboxes):
+    """
+    Vectorised convert_bbox_to_z: takes bounding boxes of shape (n, 4+) in the form
+      [x1,y1,x2,y2] and returns z of shape (n, 4, 1) in the form [x,y,s,r]
+    """
+    w = bboxes[:, 2] - bboxes[:, 0]
+    h = bboxes[:, 3] - bboxes[:, 1]
+    x = bboxes[:, 0] + w / 2.0
+    y = bboxes[:, 1] + h / 2.0
+    s = w * h  # scale is just area
+    r = w / h.astype(float)
+    return np.stack([x, y, s, r], axis=1).reshape((-1, 4, 1))
+
+
+def convert_xs_to_bboxes(xs):
+    """
+    Vectorised convert_x_to_bbox: takes states of shape (n, 7, 1) in the centre form
+      [x,y,s,r,...] and returns bounding boxes of shape (n, 4) in the form [x1,y1,x2,y2]
+    """
+    w = np.sqrt(xs[:, 2, 0] * xs[:, 3, 0])
+    h = xs[:, 2, 0] / w
+    return np.stack(
+        [
+            xs[:, 0, 0] - w / 2.0,
+            xs[:, 1, 0] - h / 2.0,
+            xs[:, 0, 0] + w / 2.0,
+            xs[:, 1, 0] + h / 2.0,
+        ],
+        axis=1,
+    )
+
+
+class KalmanBoxTrackers(object):
+    """
+    Struct-of-arrays counterpart of KalmanBoxTracker holding the internal state of
+    every tracked object in stacked arrays, so that all tracks are predicted and
+    updated with a few batched operations.
+    """
+
+    # same constant velocity model as KalmanBoxTracker
+    F = np.array(
+        [
+            [1, 0, 0, 0, 1, 0, 0],
+            [0, 1, 0, 0, 0, 1, 0],
+            [0, 0, 1, 0, 0, 0, 1],
+            [0, 0, 0, 1, 0, 0, 0],
+            [0, 0, 0, 0, 1, 0, 0],
+            [0, 0, 0, 0, 0, 1, 0],
+            [0, 0, 0, 0, 0, 0, 1],
+        ]
+    )
+    H = np.array(
+        [
+            [1, 0, 0, 0, 0, 0, 0],
+            [0, 1, 0, 0, 0, 0, 0],
+            [0, 0, 1, 0, 0, 0, 0],
+            [0, 0, 0, 1, 0, 0, 0],
+        ]
+    )
+    R = np.diag([1.0, 1.0, 10.0, 10.0])
+    Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.01, 0.01, 0.0001])
+    # give high uncertainty to the unobservable initial velocities
+    P0 = np.diag([10.0, 10.0, 10.0, 10.0, 10000.0, 10000.0, 10000.0])
+
+    def __init__(self):
+        self.x = np.zeros((0, 7, 1))
+        self.P = np.zeros((0, 7, 7))
+        self.id = np.zeros(0, dtype=int)
+        self.time_since_update = np.zeros(0, dtype=int)
+        self.hits = np.zeros(0, dtype=int)
+        self.hit_streak = np.zeros(0, dtype=int)
+        self.age = np.zeros(0, dtype=int)
+
+    def __len__(self):
+        return len(self.id)
+
+    def add(self, bboxes):
+        """
+        Initialises a tracker for each of the initial bounding boxes.
+        """
+        n = len(bboxes)
+        x = np.zeros((n, 7, 1))
+        x[:, :4] = convert_bboxes_to_z(bboxes)
+        self.x = np.concatenate([self.x, x])
+        self.P = np.concatenate([self.P, np.broadcast_to(self.P0, (n, 7, 7))])
+        # ids are drawn from the same counter as KalmanBoxTracker
+        self.id = np.concatenate(
+            [self.id, KalmanBoxTracker.count + np.arange(n, dtype=int)]
+        )
+        KalmanBoxTracker.count += n
+        zeros = np.zeros(n, dtype=int)
+        self.time_since_update = np.concatenate([self.time_since_update, zeros])
+        self.hits = np.concatenate([self.hits, zeros])
+        self.hit_streak = np.concatenate([self.hit_streak, zeros])
+        self.age = np.concatenate([self.age, zeros])
+
+    def keep(self, mask):
+        """
+        Drops every tracker for which mask is False.
+        """
+        self.x = self.x[mask]
+        self.P = self.P[mask]
+        self.id = self.id[mask]
+        self.time_since_update = self.time_since_update[mask]
+        self.hits = self.hits[mask]
+        self.hit_streak = self.hit_streak[mask]
+        self.age = self.age[mask]
+
+    def predict(self):
+        """
+        Advances every state vector and returns the predicted bounding box estimates.
+        """
+        self.coast()
+        self.age += 1
+        self.hit_streak[self.time_since_update > 0] = 0
+        self.time_since_update += 1
+        return convert_xs_to_bboxes(self.x)
+
+    def coast(self):
+        """
+        Advances every state vector by one frame without counting it as a missed
+        detection, for frames on which the detector is not run.
+        """
+        self.x[(self.x[:, 6, 0] + self.x[:, 2, 0]) <= 0, 6] *= 0.0
+        self.x = self.F @ self.x
+        self.P = self.F @ self.P @ self.F.T + self.Q
+
+    def update(self, indices, bboxes):
+        """
+        Updates the state vectors of the trackers at indices with observed bboxes.
+        """
+        self.time_since_update[indices] = 0
+        self.hits[indices] += 1
+        self.hit_streak[indices] += 1
+
+        x = self.x[indices]
+        P = self.P[indices]
+        HT = self.H.T
+        y = convert_bboxes_to_z(bboxes) - self.H @ x
+        PHT = P @ HT
+        S = self.H @ PHT + self.R
+        K = PHT @ np.linalg.inv(S)
+        I_KH = np.eye(7) - K @ self.H
+        self.x[indices] = x + K @ y
+        I_KHT = np.swapaxes(I_KH, 1, 2)
+        KT = np.swapaxes(K, 1, 2)
+        self.P[indices] = I_KH @ P @ I_KHT + K @ self.R @ KT
+
+    def get_state(self):
+        """
+        Returns the current bounding box estimates.
+        """
+        return convert_xs_to_bboxes(self.x)
+
+
+class VectorizedSort(object):
+    def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3, gated=False):
+        """
+        Sets key parameters for SORT. Produces the same output as Sort, but keeps
+        every track in a single KalmanBoxTrackers instead of one filter per track.
+        """
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.iou_threshold = iou_threshold
+        self.gated = gated
+        self.trackers = KalmanBoxTrackers()
+        self.frame_count = 0
+
+    def update(self, dets=np.empty((0, 5))):
+        """
+        Params:
+          dets - a numpy array of detections in the format [[x1,y1,x2,y2,score],[x1,y1,x2,y2,score],...]
+        Requires: this method must be called once for each frame even with empty detections (use np.empty((0, 5)) for frames without detections).
+        Returns the a similar array, where the last column is the object ID.
+
+        NOTE: The number of objects returned may differ from the number of detections provided.
+        """
+        self.frame_count += 1
+        # get predicted locations from existing trackers.
+        pos = self.trackers.predict()
+        valid = ~np.any(np.isnan(pos), axis=1)
+        self.trackers.keep(valid)
+        trks = np.zeros((len(self.trackers), 5))
+        trks[:, :4] = pos[valid]
+        matched, unmatched_dets, unmatched_trks = associate_detections_to_trackers(
+            dets, trks, self.iou_threshold, self.gated
+        )
+
+        # update matched trackers with assigned detections
+        if len(matched) > 0:
+            self.trackers.update(matched[:, 1], dets[matched[:, 0], :])
+
+        # create and initialise new trackers for unmatched detections
+        if len(unmatched_dets) > 0:
+            self.trackers.add(dets[unmatched_dets.astype(int), :])
+
+        ret = self._output()
+
+        # remove dead tracklets
+        self.trackers.keep(self.trackers.time_since_update <= self.max_age)
+        return ret
+
+    def coast(self):
+        """
+        Moves every track forward one frame on its constant velocity model, for
+        frames on which the detector is skipped. Tracks are not aged, so max_age
+        and min_hits keep counting frames passed to update.
+
+        Returns the predicted bboxes of the tracks returned by the last update, in
+        the same format as update.
+        """
+        self.trackers.coast()
+        return self._output()
+
+    def _output(self):
+        """
+        Returns the confirmed tracks updated this frame in the same (reversed)
+        order as Sort.
+        """
+        trackers = self.trackers
+        output = (trackers.time_since_update < 1) & (
+            (trackers.hit_streak >= self.min_hits) | (self.frame_count <= self.min_hits)
+        )
+        output = output[::-1]
+        ret = np.concatenate(
+            [
+                trackers.get_state()[::-1][output],
+                # +1 as MOT benchmark requires positive
+                (trackers.id[::-1][output] + 1).reshape(-1, 1),
+            ],
+            axis=1,
+        )
+        if len(ret) > 0:
+            return ret
+        return np.empty((0, 5))
+
+
+class ClassTracker(object):
+    def __init__(
+        self,
+        max_age=TRACK_MAX_AGE,
+        min_hits=TRACK_MIN_HITS,
+        iou_threshold=TRACK_IOU_THRESHOLD,
+        vectorized=True,
+        gated=True,
+    ):
+        """
+        Tracks detections with VectorizedSort, or Sort unless vectorized, and
+        gives tracks the class of their detection. Tracks keep the class of the
+        detection they were first output with, in first_classes, for counting
+        and for frames on which detection is skipped.
+        """
+        sort_class = VectorizedSort if vectorized else Sort
+        self.sort = sort_class(
+            max_age=max_age, min_hits=min_hits, iou_threshold=iou_threshold, gated=gated
+        )
+        self.first_classes = {}
+
+    def update(self, dets, class_ids):
+        """
+        Updates SORT with the detections of a frame and their class ids.
+
+        Returns the tracks as SORT.update does and the class id of each, that of
+        the detection in the same position as SORT outputs matched tracks
+        first, or -1.
+        """
+        tracks = self.sort.update(dets)
+        n_matched = min(len(tracks), len(class_ids))
+        track_class_ids = np.full(len(tracks), -1, dtype=int)
+        track_class_ids[:n_matched] = class_ids[:n_matched]
+        self._remember(tracks, track_class_ids)
+        return tracks, track_class_ids
+
+    def coast(self):
+        """
+        Predicts the tracks of a frame on which detection was skipped, as
+        SORT.coast does, with the class id each was first output with.
+        """
+        tracks = self.sort.coast()
+        track_class_ids = np.array(
+            [self.first_classes.get(int(track[4]), -1) for track in tracks],
+            dtype=int,
+        )
+        self._remember(tracks, track_class_ids)
+        return tracks, track_class_ids
+
+    def _remember(self, tracks, track_class_ids):
+        for track_id, class_id in zip(
+            tracks[:, 4].astype(int).tolist(), track_class_ids.tolist()
+        ):
+            self.first_classes.setdefault(track_id, class_id)
+
 
 def parse_args():
     """Parse input arguments."""
@@ -325,6 +790,16 @@ def parse_args():
     parser.add_argument(
         "--iou_threshold", help="Minimum IOU for match.", type=float, default=0.3
     )
+    parser.add_argument(
+        "--gated",
+        help="Only score overlapping detection/tracker pairs [False]",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--vectorized",
+        help="Use VectorizedSort instead of Sort [False]",
+        action="store_true",
+    )
     args = parser.parse_args()
     return args
 
@@ -351,10 +826,11 @@ if __name__ == "__main__":
         os.makedirs("output")
     pattern = os.path.join(args.seq_path, phase, "*", "det", "det.txt")
     for seq_dets_fn in glob.glob(pattern):
-        mot_tracker = Sort(
+        mot_tracker = (VectorizedSort if args.vectorized else Sort)(
             max_age=args.max_age,
             min_hits=args.min_hits,
             iou_threshold=args.iou_threshold,
+            gated=args.gated,
         )  # create instance of the SORT tracker
         seq_dets = np.loadtxt(seq_dets_fn, delimiter=",")
         seq = seq_dets_fn[pattern.find("*") :].split(os.path.sep)[0]
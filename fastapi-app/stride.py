@@ -0,0 +1,147 @@
+from typing import Dict, List
+
+import numpy as np
+from sort import iou_pairs
+
+
+class AdaptiveStride:
+    """
+    Decides on which frames to run the detector, letting SORT's Kalman filters
+    predict the boxes of the frames in between.
+
+    The stride grows by one frame at a time while tracked objects move slowly
+    relative to their size, is capped lower in dense scenes and drops back to 1
+    as soon as more objects are detected than before.
+    """
+
+    def __init__(
+        self,
+        max_stride: int,
+        motion_threshold: float = 0.05,
+        density_step: int = 50,
+    ):
+        """
+        motion_threshold is the fraction of a box's diagonal an object may move
+        between detections; every density_step detections halve the stride cap.
+        """
+        self.max_stride = max_stride
+        self.motion_threshold = motion_threshold
+        self.density_step = density_step
+        self.stride = 1
+        self._next_detection_frame = 1
+        self._last_detection_frame = None
+        self._last_detection_count = 0
+        self._last_boxes = {}
+        self._predicted_boxes = {}
+
+        # Accuracy versus speed report
+        self.detected_frames = 0
+        self.predicted_frames = 0
+        self.detection_seconds = 0.0
+        self._prediction_ious = []
+
+    def plan(self, frame_count: int, n_frames: int) -> List[bool]:
+        """
+        For the n_frames frames following frame_count, whether to run detection.
+
+        The plan uses the current stride; changes to it apply from the next plan.
+        """
+        detect = []
+        next_detection = self._next_detection_frame
+        for frame_number in range(frame_count + 1, frame_count + 1 + n_frames):
+            if frame_number >= next_detection:
+                detect.append(True)
+                next_detection = frame_number + self.stride
+            else:
+                detect.append(False)
+        return detect
+
+    def observe_detection(
+        self, frame_number: int, detections: np.ndarray, tracked_objects: np.ndarray
+    ) -> None:
+        """
+        Adapt the stride to the tracks updated with the detections of a frame.
+        """
+        self.detected_frames += 1
+        boxes = {int(track[4]): track[:4] for track in tracked_objects}
+
+        # How well the boxes predicted on the previous frame agreed with detection
+        common = [track_id for track_id in boxes if track_id in self._predicted_boxes]
+        if common:
+            predicted = np.array([self._predicted_boxes[i] for i in common])
+            detected = np.array([boxes[i] for i in common])
+            self._prediction_ious.append(float(np.mean(iou_pairs(predicted, detected))))
+        self._predicted_boxes = {}
+
+        if len(detections) > self._last_detection_count:
+            # New objects appeared, track them on every frame
+            self.stride = 1
+        else:
+            elapsed = frame_number - (self._last_detection_frame or frame_number)
+            motion = self._motion(boxes, elapsed)
+            density_cap = max(
+                1, self.max_stride >> (len(detections) // self.density_step)
+            )
+            motion_cap = (
+                int(self.motion_threshold / motion) if motion > 0 else self.max_stride
+            )
+            self.stride = max(1, min(self.stride + 1, motion_cap, density_cap))
+
+        self._last_boxes = boxes
+        self._last_detection_frame = frame_number
+        self._last_detection_count = len(detections)
+        self._next_detection_frame = frame_number + self.stride
+
+    def observe_prediction(self, tracked_objects: np.ndarray) -> None:
+        """
+        Record the boxes predicted for a frame on which detection was skipped.
+        """
+        self.predicted_frames += 1
+        self._predicted_boxes = {int(track[4]): track[:4] for track in tracked_objects}
+
+    def report(self) -> Dict[str, float]:
+        """
+        Summarise the detection time saved and how closely predicted boxes
+        matched the next detections.
+        """
+        frames = self.detected_frames + self.predicted_frames
+        seconds_per_detection = self.detection_seconds / max(1, self.detected_frames)
+        return {
+            "max_stride": self.max_stride,
+            "detected_frames": self.detected_frames,
+            "predicted_frames": self.predicted_frames,
+            "mean_stride": frames / max(1, self.detected_frames),
+            "detection_seconds": self.detection_seconds,
+            "estimated_seconds_saved": self.predicted_frames * seconds_per_detection,
+            "prediction_iou": (
+                float(np.mean(self._prediction_ious)) if self._prediction_ious else None
+            ),
+        }
+
+    def merge(self, other: "AdaptiveStride") -> None:
+        """
+        Add the report counts of a policy that ran on another part of the video.
+        """
+        self.detected_frames += other.detected_frames
+        self.predicted_frames += other.predicted_frames
+        self.detection_seconds += other.detection_seconds
+        self._prediction_ious.extend(other._prediction_ious)
+
+    def _motion(self, boxes: Dict[int, np.ndarray], elapsed: int) -> float:
+        """
+        Largest per-frame movement of a track since the last detection, as a
+        fraction of its box diagonal.
+        """
+        common = [track_id for track_id in boxes if track_id in self._last_boxes]
+        if not common or elapsed <= 0:
+            return 0.0
+
+        previous = np.array([self._last_boxes[i] for i in common])
+        current = np.array([boxes[i] for i in common])
+        shift = (current[:, :2] + current[:, 2:]) / 2 - (
+            previous[:, :2] + previous[:, 2:]
+        ) / 2
+        size = current[:, 2:] - current[:, :2]
+        distance = np.hypot(shift[:, 0], shift[:, 1])
+        diagonal = np.maximum(np.hypot(size[:, 0], size[:, 1]), 1.0)
+        return float(np.max(distance / diagonal)) / elapsed
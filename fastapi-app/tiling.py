@@ -0,0 +1,95 @@
+from typing import List, Tuple
+
+import numpy as np
+from sort import iou_batch
+
+MERGE_STRATEGIES = ("nms", "merge")
+
+
+def tile_origins(
+    height: int, width: int, tile_size: int, overlap: float
+) -> List[Tuple[int, int]]:
+    """
+    Top-left corners of overlapping square tiles covering a frame.
+
+    Neighbouring tiles share overlap (a fraction of tile_size) pixels and the
+    last row and column of tiles are aligned with the frame's edges.
+    """
+    step = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(length: int) -> List[int]:
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, step))
+        return positions + [length - tile_size]
+
+    return [(x, y) for y in starts(height) for x in starts(width)]
+
+
+def slice_frame(
+    frame: np.ndarray, origins: List[Tuple[int, int]], tile_size: int
+) -> List[np.ndarray]:
+    """
+    Cut a frame into tiles; tiles are views into the frame, not copies.
+    """
+    return [frame[y : y + tile_size, x : x + tile_size] for x, y in origins]
+
+
+def _intersection_over_smaller(boxes: np.ndarray) -> np.ndarray:
+    """
+    Pairwise intersection over the area of the smaller box, which stays high
+    for a partial box cut off at a tile edge and the full box in the next tile.
+    """
+    iou = iou_batch(boxes, boxes)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union = areas[:, None] + areas[None, :]
+    intersection = iou * union / (1 + iou)
+    return intersection / np.maximum(np.minimum(areas[:, None], areas[None, :]), 1e-9)
+
+
+def merge_detections(
+    detections: np.ndarray,
+    class_ids: np.ndarray,
+    iou_threshold: float = 0.5,
+    strategy: str = "nms",
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merge duplicate boxes of the same class found in overlapping tiles.
+
+    detections are rows of [x1,y1,x2,y2,score] in frame coordinates. "nms" keeps
+    the highest scoring box of every group of boxes overlapping by more than
+    iou_threshold. "merge" instead compares intersection over the smaller box and
+    replaces every group by the union of its boxes with the group's best score.
+    """
+    if strategy not in MERGE_STRATEGIES:
+        raise ValueError(f"Unknown tile merge strategy: {strategy}")
+    if len(detections) == 0:
+        return detections, class_ids
+
+    order = np.argsort(-detections[:, 4], kind="stable")
+    detections, class_ids = detections[order], class_ids[order]
+    if strategy == "nms":
+        overlap = iou_batch(detections, detections)
+    else:
+        overlap = _intersection_over_smaller(detections)
+    overlap = (overlap > iou_threshold) & (class_ids[:, None] == class_ids[None, :])
+
+    # Greedily let each remaining box absorb the lower scoring boxes it overlaps
+    kept_rows = []
+    remaining = np.ones(len(detections), dtype=bool)
+    for i in range(len(detections)):
+        if not remaining[i]:
+            continue
+        members = overlap[i] & remaining
+        members[i] = True
+        remaining &= ~members
+
+        row = detections[i].copy()
+        if strategy == "merge":
+            row[:2] = detections[members, :2].min(axis=0)
+            row[2:4] = detections[members, 2:4].max(axis=0)
+        kept_rows.append((row, class_ids[i]))
+
+    merged = np.array([row for row, _ in kept_rows], dtype=detections.dtype)
+    merged_class_ids = np.array([c for _, c in kept_rows], dtype=class_ids.dtype)
+    return merged, merged_class_ids
@@ -0,0 +1,297 @@
+import json
+import os
+import tempfile
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+# Name and type of every column of the store
+COLUMNS = (
+    ("frame", np.int32),
+    ("track_id", np.int32),
+    ("x1", np.float32),
+    ("y1", np.float32),
+    ("x2", np.float32),
+    ("y2", np.float32),
+    ("conf", np.float32),
+    ("class_id", np.int16),
+)
+ROW_BYTES = sum(np.dtype(dtype).itemsize for _, dtype in COLUMNS)
+# Files of a saved store besides its columns, indexing the rows of every track
+_TRACK_IDS_FILE = "track_ids.npy"
+_TRACK_OFFSETS_FILE = "track_offsets.npy"
+_TRACK_ROWS_FILE = "track_rows.npy"
+_METADATA_FILE = "metadata.json"
+
+
+class TrackStore:
+    """
+    Append-only columnar log of the tracks seen in every frame.
+
+    Rows are kept in preallocated arrays that double in size when full. Once the
+    in-memory rows exceed memory_budget bytes they are spilled to files on disk,
+    so memory stays flat however long the video is.
+    """
+
+    def __init__(self, capacity: int = 4096, memory_budget: Optional[int] = None):
+        self.memory_budget = memory_budget
+        self._columns = {name: np.empty(capacity, dtype) for name, dtype in COLUMNS}
+        self._size = 0
+        self._spilled = 0
+        self._spill_dir = None
+
+    def __len__(self) -> int:
+        return self._spilled + self._size
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Bytes held in memory by the columns.
+        """
+        return sum(column.nbytes for column in self._columns.values())
+
+    def append(
+        self,
+        frame: int,
+        tracks: np.ndarray,
+        confidences: np.ndarray,
+        class_ids: np.ndarray,
+    ) -> None:
+        """
+        Add the tracks of one frame, given as SORT output rows [x1,y1,x2,y2,id].
+        """
+        n = len(tracks)
+        if n == 0:
+            return
+        self._reserve(n)
+
+        rows = slice(self._size, self._size + n)
+        self._columns["frame"][rows] = frame
+        self._columns["track_id"][rows] = tracks[:, 4]
+        for i, name in enumerate(("x1", "y1", "x2", "y2")):
+            self._columns[name][rows] = tracks[:, i]
+        self._columns["conf"][rows] = confidences
+        self._columns["class_id"][rows] = class_ids
+        self._size += n
+        self._spill_if_over_budget()
+
+    def extend(self, columns: Dict[str, np.ndarray]) -> None:
+        """
+        Add rows given as one array per column, as returned by column().
+        """
+        n = len(columns["frame"])
+        if n == 0:
+            return
+        self._reserve(n)
+
+        rows = slice(self._size, self._size + n)
+        for name, _ in COLUMNS:
+            self._columns[name][rows] = columns[name]
+        self._size += n
+        self._spill_if_over_budget()
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Return every value of a column, reading spilled rows back from disk.
+        """
+        in_memory = self._columns[name][: self._size]
+        if self._spilled == 0:
+            return in_memory.copy()
+
+        dtype = self._columns[name].dtype
+        spilled = np.fromfile(self._spill_path(name), dtype=dtype)
+        return np.concatenate([spilled, in_memory])
+
+    def summaries(self) -> Dict[str, np.ndarray]:
+        """
+        Summarise every track with a vectorised group-by on track_id.
+
+        Returns columns of equal length holding the track_id, first and last
+        frame seen, dwell time in frames, number of rows, class_id of the first
+        row and total distance travelled by the bounding box centre.
+        """
+        track_ids = self.column("track_id")
+        order = np.argsort(track_ids, kind="stable")  # keeps rows in frame order
+        track_ids = track_ids[order]
+        frames = self.column("frame")[order]
+        centre_x = (self.column("x1")[order] + self.column("x2")[order]) / 2
+        centre_y = (self.column("y1")[order] + self.column("y2")[order]) / 2
+
+        if len(track_ids) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return {
+                "track_id": empty,
+                "first_seen": empty,
+                "last_seen": empty,
+                "dwell_frames": empty,
+                "rows": empty,
+                "class_id": empty,
+                "distance": np.empty(0),
+            }
+
+        same_track = track_ids[1:] == track_ids[:-1]
+        starts = np.flatnonzero(np.concatenate([[True], ~same_track]))
+
+        steps = np.zeros(len(track_ids))
+        steps[1:] = np.hypot(np.diff(centre_x), np.diff(centre_y)) * same_track
+
+        first_seen = frames[starts]
+        last_seen = np.maximum.reduceat(frames, starts)
+        return {
+            "track_id": track_ids[starts],
+            "first_seen": first_seen,
+            "last_seen": last_seen,
+            "dwell_frames": last_seen - first_seen + 1,
+            "rows": np.diff(np.append(starts, len(track_ids))),
+            "class_id": self.column("class_id")[order][starts],
+            "distance": np.add.reduceat(steps, starts),
+        }
+
+    def save(self, directory: str, **metadata) -> None:
+        """
+        Write every row to directory as one .npy file per column, with an index
+        of the rows of every track, to be read by TrackLog. metadata is saved
+        alongside as JSON.
+
+        Spilled rows are copied from disk without loading them into memory;
+        only the track ids are read back, to index them.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name, dtype in COLUMNS:
+            saved = np.lib.format.open_memmap(
+                os.path.join(directory, f"{name}.npy"),
+                mode="w+",
+                dtype=dtype,
+                shape=(len(self),),
+            )
+            if self._spilled:
+                saved[: self._spilled] = np.memmap(
+                    self._spill_path(name), dtype=dtype, mode="r"
+                )
+            saved[self._spilled :] = self._columns[name][: self._size]
+            saved.flush()
+            del saved
+
+        # Rows sorted by track, keeping every track's rows in frame order
+        track_ids = self.column("track_id")
+        track_rows = np.argsort(track_ids, kind="stable")
+        ids, starts = np.unique(track_ids[track_rows], return_index=True)
+        np.save(os.path.join(directory, _TRACK_IDS_FILE), ids)
+        np.save(
+            os.path.join(directory, _TRACK_OFFSETS_FILE),
+            np.append(starts, len(track_rows)),
+        )
+        np.save(os.path.join(directory, _TRACK_ROWS_FILE), track_rows)
+
+        with open(os.path.join(directory, _METADATA_FILE), "w") as metadata_file:
+            json.dump({"rows": len(self), **metadata}, metadata_file)
+
+    def close(self) -> None:
+        """
+        Delete any rows spilled to disk.
+        """
+        if self._spill_dir is not None:
+            self._spill_dir.cleanup()
+            self._spill_dir = None
+        self._spilled = 0
+
+    def _reserve(self, n: int) -> None:
+        capacity = len(self._columns["frame"])
+        if self._size + n <= capacity:
+            return
+
+        new_capacity = max(2 * capacity, self._size + n)
+        for name, column in self._columns.items():
+            grown = np.empty(new_capacity, column.dtype)
+            grown[: self._size] = column[: self._size]
+            self._columns[name] = grown
+
+    def _spill_if_over_budget(self) -> None:
+        if (
+            self.memory_budget is not None
+            and self._size * ROW_BYTES > self.memory_budget
+        ):
+            self._spill()
+
+    def _spill(self) -> None:
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.TemporaryDirectory(prefix="flyby-tracks-")
+
+        for name, column in self._columns.items():
+            with open(self._spill_path(name), "ab") as spill_file:
+                column[: self._size].tofile(spill_file)
+        self._spilled += self._size
+        self._size = 0
+
+    def _spill_path(self, name: str) -> str:
+        return os.path.join(self._spill_dir.name, f"{name}.bin")
+
+
+class TrackLog:
+    """
+    Read-only view of a TrackStore saved to a directory.
+
+    Columns are memory-mapped, so a query only reads the rows it returns plus
+    a binary search of the frame column.
+    """
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, _METADATA_FILE)) as metadata_file:
+            self.metadata = json.load(metadata_file)
+        self._columns = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name, _ in COLUMNS
+        }
+        self._track_ids = np.load(os.path.join(directory, _TRACK_IDS_FILE))
+        self._track_offsets = np.load(os.path.join(directory, _TRACK_OFFSETS_FILE))
+        self._track_rows = np.load(
+            os.path.join(directory, _TRACK_ROWS_FILE), mmap_mode="r"
+        )
+
+    def __len__(self) -> int:
+        return len(self._columns["frame"])
+
+    def query(
+        self,
+        start_frame: Optional[int] = None,
+        end_frame: Optional[int] = None,
+        track_ids: Optional[Iterable[int]] = None,
+        class_ids: Optional[Iterable[int]] = None,
+        limit: Optional[int] = None,
+    ) -> Dict[str, np.ndarray]:
+        """
+        Return the rows of frames start_frame to end_frame inclusive, of the
+        given tracks and classes, in frame order. At most limit rows are
+        returned.
+        """
+        frames = self._columns["frame"]
+        low = 0 if start_frame is None else np.searchsorted(frames, start_frame)
+        high = (
+            len(frames)
+            if end_frame is None
+            else np.searchsorted(frames, end_frame, side="right")
+        )
+
+        rows = None  # every row from low to high
+        if track_ids is not None:
+            positions = np.searchsorted(self._track_ids, list(track_ids))
+            positions = positions[positions < len(self._track_ids)]
+            positions = positions[np.isin(self._track_ids[positions], list(track_ids))]
+            track_rows = [
+                self._track_rows[self._track_offsets[p] : self._track_offsets[p + 1]]
+                for p in np.unique(positions)
+            ]
+            rows = np.sort(np.concatenate([np.empty(0, np.int64), *track_rows]))
+            rows = rows[(rows >= low) & (rows < high)]
+
+        if class_ids is not None:
+            class_column = self._columns["class_id"]
+            classes = class_column[low:high] if rows is None else class_column[rows]
+            matched = np.flatnonzero(np.isin(classes, list(class_ids)))
+            rows = low + matched if rows is None else rows[matched]
+
+        if rows is None:
+            rows = slice(low, high if limit is None else min(high, low + limit))
+        elif limit is not None:
+            rows = rows[:limit]
+        return {name: np.array(column[rows]) for name, column in self._columns.items()}
@@ -0,0 +1,246 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart before 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+
+class UploadTooLarge(Exception):
+    """
+    Raised when an upload grows past its size limit.
+    """
+
+
+class UploadConflict(Exception):
+    """
+    Raised when a part does not start where an upload is at, or an upload is
+    changed while a part of it is being received.
+    """
+
+
+class InvalidForm(Exception):
+    """
+    Raised when a form upload is not valid multipart/form-data with a file.
+    """
+
+
+class PartialUpload:
+    """
+    A video uploaded in one or more parts, written to disk and hashed a chunk
+    at a time as it arrives, so memory use stays flat however large it is.
+
+    A part cut off midway keeps the bytes received before it was, so the
+    upload can be resumed from offset.
+    """
+
+    def __init__(self, path: str, max_bytes: int, size: Optional[int] = None):
+        """
+        size, if given, is the size the upload is declared to have once
+        complete.
+        """
+        if size is not None and size > max_bytes:
+            raise UploadTooLarge(f"Uploads are limited to {max_bytes} bytes")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.size = size
+        self.offset = 0
+        self._digest = hashlib.sha256()
+        self._file = None
+        self._closed = False
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        open(path, "wb").close()
+
+    @property
+    def idle_seconds(self) -> float:
+        """
+        Seconds since the last part was received, or 0 while one is.
+        """
+        if self._file is not None:
+            return 0.0
+        return time.monotonic() - self._updated
+
+    @contextmanager
+    def receiving_part(self, offset: int) -> Iterator[None]:
+        """
+        Open the upload for the chunks of one part starting at offset to be
+        written to it.
+        """
+        self.start_part(offset)
+        try:
+            yield
+        finally:
+            self.end_part()
+
+    def start_part(self, offset: int) -> None:
+        """
+        Open the upload for the chunks of a part starting at offset, raising
+        UploadConflict if the upload is not at offset, so a part sent twice is
+        never appended twice, or another part is being received.
+        """
+        with self._lock:
+            if self._file is not None or self._closed:
+                raise UploadConflict("A part of this upload is being received")
+            if offset != self.offset:
+                raise UploadConflict(f"Upload is at offset {self.offset}")
+            self._file = open(self.path, "ab")
+
+    def end_part(self) -> None:
+        """
+        Close the upload after the part being received.
+        """
+        self._file.close()
+        self._updated = time.monotonic()
+        with self._lock:
+            self._file = None
+
+    def write(self, chunk: bytes) -> None:
+        """
+        Append a chunk of the part being received, raising UploadTooLarge
+        instead if it would take the upload past its size limit.
+        """
+        limit = self.max_bytes if self.size is None else self.size
+        if self.offset + len(chunk) > limit:
+            raise UploadTooLarge(f"Upload would exceed {limit} bytes")
+        self._file.write(chunk)
+        self._digest.update(chunk)
+        self.offset += len(chunk)
+
+    def close(self) -> str:
+        """
+        Stop accepting parts and return the SHA-256 of the upload, raising
+        UploadConflict if a part is being received.
+        """
+        with self._lock:
+            if self._file is not None:
+                raise UploadConflict("A part of this upload is being received")
+            self._closed = True
+        return self._digest.hexdigest()
+
+    def remove(self) -> None:
+        """
+        Stop accepting parts and delete what was received.
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class FormFileParser:
+    """
+    Parses a multipart/form-data body as it arrives, writing the file sent as
+    field_name straight to a PartialUpload in directory, so the body is never
+    spooled to disk first and the size limit applies while it arrives. Other
+    fields are ignored.
+    """
+
+    def __init__(
+        self, content_type: str, field_name: str, directory: str, max_bytes: int
+    ):
+        _, params = parse_options_header(content_type)
+        if b"boundary" not in params:
+            raise InvalidForm("Expected a multipart/form-data body")
+        self.field_name = field_name.encode()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.upload = None
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._receiving = False
+        self._parser = MultipartParser(
+            params[b"boundary"],
+            {
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+            },
+        )
+
+    def write(self, data: bytes) -> None:
+        """
+        Parse the next chunk of the body, raising UploadTooLarge once the file
+        exceeds max_bytes.
+        """
+        try:
+            self._parser.write(data)
+        except (UploadTooLarge, UploadConflict):
+            raise
+        except Exception as error:
+            raise InvalidForm(f"Invalid multipart body: {error}") from error
+
+    def finish(self) -> PartialUpload:
+        """
+        Check the whole body was parsed and return the upload of the file.
+        """
+        try:
+            self._parser.finalize()
+        except Exception as error:
+            raise InvalidForm(f"Invalid multipart body: {error}") from error
+        if self.upload is None or self._receiving:
+            raise InvalidForm(
+                f"Expected a file in the {self.field_name.decode()} field"
+            )
+        return self.upload
+
+    def discard(self) -> None:
+        """
+        Delete whatever was received of the file.
+        """
+        if self.upload is not None:
+            if self._receiving:
+                self.upload.end_part()
+                self._receiving = False
+            self.upload.remove()
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(
+            self._headers.get(b"content-disposition", b"")
+        )
+        if (
+            options.get(b"name") != self.field_name
+            or b"filename" not in options
+            or self.upload is not None
+        ):
+            return
+        # Name the file uniquely, keeping only the extension the client sent
+        filename = options[b"filename"].decode(errors="replace")
+        extension = os.path.splitext(os.path.basename(filename))[1]
+        self.upload = PartialUpload(
+            os.path.join(self.directory, f"{uuid.uuid4()}{extension}"), self.max_bytes
+        )
+        self.upload.start_part(0)
+        self._receiving = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._receiving:
+            self.upload.write(data[start:end])
+
+    def _on_part_end(self) -> None:
+        if self._receiving:
+            self.upload.end_part()
+            self._receiving = False
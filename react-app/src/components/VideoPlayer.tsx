@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useRef } from "react";
 import Hls from "hls.js";
 import { UploadIcon, CheckCircledIcon } from "@radix-ui/react-icons";
+import { OverlayDecoder, drawOverlay } from "@/lib/overlay";
 
 interface VideoPlayerProps {
   setData: (data: any) => void;
@@ -9,6 +10,8 @@ interface VideoPlayerProps {
 const VideoPlayer: React.FC<VideoPlayerProps> = ({ setData }) => {
   const videoRef = useRef<HTMLVideoElement | null>(null);
   const hlsInstance = useRef<Hls | null>(null);
+  const canvasRef = useRef<HTMLCanvasElement | null>(null);
+  const overlayDecoder = useRef<OverlayDecoder | null>(null);
 
   const [_, setVideoAvailable] = useState<boolean>(false);
   const [videoLoaded, setVideoLoaded] = useState<boolean>(false);
@@ -17,6 +20,7 @@ const VideoPlayer: React.FC<VideoPlayerProps> = ({ setData }) => {
 
   const API_BASE_URL =
     "http://ec2-3-145-106-40.us-east-2.compute.amazonaws.com:8000";
+  const JOB_POLL_INTERVAL_MS = 2000;
 
   // HLS STREAMING
   useEffect(() => {
@@ -46,6 +50,7 @@ const VideoPlayer: React.FC<VideoPlayerProps> = ({ setData }) => {
           console.log("HLS manifest loaded successfully.");
           setVideoAvailable(true);
           loadData();
+          loadOverlay();
           video
             .play()
             .catch((error) => console.warn("Autoplay blocked:", error));
@@ -59,6 +64,7 @@ const VideoPlayer: React.FC<VideoPlayerProps> = ({ setData }) => {
         video.src = API_BASE_URL + "/stream/" + UIUD;
         video.load();
         loadData();
+        loadOverlay();
       }
     };
 
@@ -69,6 +75,15 @@ const VideoPlayer: React.FC<VideoPlayerProps> = ({ setData }) => {
       setData(data);
     };
 
+    // Loads the boxes to draw over videos the server left untouched
+    const loadOverlay = async () => {
+      overlayDecoder.current = null;
+      const response = await fetch(API_BASE_URL + "/overlay/" + UIUD);
+      if (response.ok) {
+        overlayDecoder.current = new OverlayDecoder(await response.json());
+      }
+    };
+
     loadHlsStream();
 
     return () => {
@@ -78,6 +93,22 @@ const VideoPlayer: React.FC<VideoPlayerProps> = ({ setData }) => {
     };
   }, [videoLoaded, UIUD]);
 
+  // OVERLAY DRAWING
+  useEffect(() => {
+    const video = videoRef.current;
+    const canvas = canvasRef.current;
+    if (!video || !canvas || UIUD === "") return;
+
+    let animationFrame = 0;
+    const draw = () => {
+      drawOverlay(video, canvas, overlayDecoder.current);
+      animationFrame = requestAnimationFrame(draw);
+    };
+    animationFrame = requestAnimationFrame(draw);
+
+    return () => cancelAnimationFrame(animationFrame);
+  }, [videoLoaded, UIUD]);
+
   // FILE UPLOADING
   const handleFileChange = (event: React.ChangeEvent<HTMLInputElement>) => {
     if (event.target.files && event.target.files.length > 0) {
@@ -101,9 +132,8 @@ const VideoPlayer: React.FC<VideoPlayerProps> = ({ setData }) => {
 
       if (response.ok) {
         const data = await response.json();
-        const videoUuid = data.video_uuid;
-        setUIUD(videoUuid);
         console.log("Upload successful");
+        waitForJob(data.job_id);
       } else {
         console.error("Upload failed");
       }
@@ -112,15 +142,44 @@ const VideoPlayer: React.FC<VideoPlayerProps> = ({ setData }) => {
     }
   };
 
+  // Polls the processing job until the analyzed video is ready
+  const waitForJob = async (jobId: string) => {
+    while (true) {
+      const response = await fetch(API_BASE_URL + "/jobs/" + jobId);
+      if (!response.ok) {
+        console.error("Failed to get job status");
+        return;
+      }
+
+      const job = await response.json();
+      if (job.status === "done") {
+        setUIUD(job.video_uuid);
+        return;
+      }
+      if (job.status === "failed") {
+        console.error("Processing failed:", job.error);
+        return;
+      }
+
+      await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    }
+  };
+
   return (
     <div className="w-full h-full flex flex-col justify-center items-center">
       {videoLoaded ? (
-        <video
-          ref={videoRef}
-          controls
-          muted
-          className="relative z-50 pointer-events-auto w-full h-full object-cover rounded"
-        />
+        <div className="relative w-full h-full">
+          <video
+            ref={videoRef}
+            controls
+            muted
+            className="relative z-50 pointer-events-auto w-full h-full object-cover rounded"
+          />
+          <canvas
+            ref={canvasRef}
+            className="absolute inset-0 z-[60] pointer-events-none w-full h-full"
+          />
+        </div>
       ) : (
         <div className="relative z-50 pointer-events-auto flex flex-col items-center border-2 border-dashed p-6 rounded-lg">
           <p className="text-gray-500 mb-2">No video available. Upload one!</p>
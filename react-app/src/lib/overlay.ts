@@ -0,0 +1,116 @@
+// Boxes of every frame of a video, as served by /overlay/{video_uuid}
+export interface Overlay {
+  fps: number;
+  keyframe_interval: number;
+  class_names: Record<string, string>;
+  track_classes: Record<string, number>;
+  frames: OverlayFrame[];
+}
+
+// Keyframes ("k") list every box under "a"; other frames list the boxes
+// added ("a"), moved ("u") and removed ("r") since the frame before
+interface OverlayFrame {
+  k?: number;
+  a?: number[][];
+  u?: number[][];
+  r?: number[];
+}
+
+// Rebuilds the boxes of any frame, applying one frame's changes at a time
+// during playback and starting from the nearest keyframe after a seek
+export class OverlayDecoder {
+  private overlay: Overlay;
+  private index = -1;
+  private boxes = new Map<number, number[]>();
+
+  constructor(overlay: Overlay) {
+    this.overlay = overlay;
+  }
+
+  get fps(): number {
+    return this.overlay.fps;
+  }
+
+  boxesAt(index: number): Map<number, number[]> {
+    const { frames, keyframe_interval } = this.overlay;
+    index = Math.min(Math.max(index, 0), frames.length - 1);
+
+    if (index < this.index || index - this.index > keyframe_interval) {
+      this.index = index - (index % keyframe_interval) - 1;
+      this.boxes.clear();
+    }
+    while (this.index < index) {
+      this.index += 1;
+      this.apply(frames[this.index]);
+    }
+    return this.boxes;
+  }
+
+  label(trackId: number): string {
+    const classId = this.overlay.track_classes[String(trackId)] ?? -1;
+    const className =
+      classId >= 0 ? this.overlay.class_names[String(classId)] : "unknown";
+    return `ID: ${trackId} | ${className}`;
+  }
+
+  private apply(frame: OverlayFrame) {
+    if (frame.k) this.boxes.clear();
+    for (const [trackId, ...box] of frame.a ?? []) {
+      this.boxes.set(trackId, box);
+    }
+    for (const [trackId, ...change] of frame.u ?? []) {
+      const box = this.boxes.get(trackId);
+      if (box) this.boxes.set(trackId, box.map((value, i) => value + change[i]));
+    }
+    for (const trackId of frame.r ?? []) {
+      this.boxes.delete(trackId);
+    }
+  }
+}
+
+// Draws the boxes of the current frame of video on a canvas laid over it,
+// in the same style the server draws them into videos
+export function drawOverlay(
+  video: HTMLVideoElement,
+  canvas: HTMLCanvasElement,
+  decoder: OverlayDecoder | null
+) {
+  const ratio = window.devicePixelRatio || 1;
+  const width = canvas.clientWidth;
+  const height = canvas.clientHeight;
+  if (canvas.width !== Math.round(width * ratio)) {
+    canvas.width = Math.round(width * ratio);
+  }
+  if (canvas.height !== Math.round(height * ratio)) {
+    canvas.height = Math.round(height * ratio);
+  }
+
+  const context = canvas.getContext("2d");
+  if (!context) return;
+  context.setTransform(1, 0, 0, 1, 0, 0);
+  context.clearRect(0, 0, canvas.width, canvas.height);
+  if (!decoder || !video.videoWidth || !video.videoHeight) return;
+
+  // The video covers the element, cropping whatever overflows it
+  const scale = Math.max(width / video.videoWidth, height / video.videoHeight);
+  const offsetX = (width - video.videoWidth * scale) / 2;
+  const offsetY = (height - video.videoHeight * scale) / 2;
+  context.setTransform(
+    ratio * scale,
+    0,
+    0,
+    ratio * scale,
+    ratio * offsetX,
+    ratio * offsetY
+  );
+
+  context.strokeStyle = "rgb(0, 255, 0)";
+  context.fillStyle = "rgb(0, 255, 0)";
+  context.lineWidth = 2;
+  context.font = "16px sans-serif";
+  const boxes = decoder.boxesAt(Math.floor(video.currentTime * decoder.fps));
+  for (const [trackId, [x1, y1, x2, y2]] of boxes) {
+    context.strokeRect(x1, y1, x2 - x1, y2 - y1);
+    context.fillText(decoder.label(trackId), x1, y1 - 10);
+  }
+}